@@ -2,28 +2,41 @@ import argparse
 import os
 import sys
 
+from importlib import import_module
 from pathlib import Path
+from typing import TYPE_CHECKING, Callable
 
-from dotpkg.commands import install_cmd, uninstall_cmd, sync_cmd, upgrade_install_manifest_cmd
+from dotpkg.constants import INSTALL_MANIFEST_NAME, STATE_DIR_PATH
 from dotpkg.error import DotpkgError
-from dotpkg.install import install_manifest_path
-from dotpkg.options import Options
-from dotpkg.utils.prompt import confirm
 from dotpkg.utils.log import warn, error
 
+if TYPE_CHECKING:
+    from dotpkg.options import Options
+
 if sys.version_info < (3, 9):
     print('Python version >= 3.9 is required!')
     sys.exit(1)
 
 # CLI
 
+# Commands are only imported once invoked, so that e.g. status does not have
+# to load the entire install machinery (which dominates the startup time).
 COMMANDS = {
-    'install': install_cmd,
-    'uninstall': uninstall_cmd,
-    'sync': sync_cmd,
-    'upgrade-install-manifest': upgrade_install_manifest_cmd,
+    'install': 'dotpkg.commands:install_cmd',
+    'uninstall': 'dotpkg.commands:uninstall_cmd',
+    'sync': 'dotpkg.commands:sync_cmd',
+    'plan': 'dotpkg.commands:plan_cmd',
+    'apply': 'dotpkg.commands:apply_cmd',
+    'list': 'dotpkg.queries:list_cmd',
+    'owns': 'dotpkg.queries:owns_cmd',
+    'status': 'dotpkg.queries:status_cmd',
+    'upgrade-install-manifest': 'dotpkg.commands:upgrade_install_manifest_cmd',
 }
 
+def load_command(name: str) -> Callable[[list[str], 'Options'], None]:
+    module_name, attr = COMMANDS[name].split(':')
+    return getattr(import_module(module_name), attr)
+
 def main():
     parser = argparse.ArgumentParser(description='Dotfile package manager')
     parser.add_argument('-C', '--cwd', type=Path, default=Path.cwd(), help='The working directory for all dotpkg-related operations. Defaults to the current working directory.')
@@ -31,11 +44,22 @@ def main():
     parser.add_argument('-d', '--dry-run', action='store_true', help='Simulate a run without any modifications to the file system.')
     parser.add_argument('-y', '--assume-yes', action='store_true', help='Accept prompts with yes and run non-interactively (great for scripts)')
     parser.add_argument('-s', '--safe-mode', action='store_true', help='Skip any user-defined shell commands such as scripts.')
-    parser.add_argument('--no-install-manifest', action='store_false', dest='update_install_manifest', help=f'Skips updating the install manifest at {install_manifest_path(Options())}.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='The number of packages to (un)install in parallel. Packages with overlapping target paths are still processed one after another. Requires --assume-yes.')
+    parser.add_argument('--script-timeout', type=float, help='The number of seconds after which scripts are killed. By default, scripts may run indefinitely.')
+    parser.add_argument('--json', action='store_true', dest='json_output', help='Print machine-readable JSON output (supported by list and status).')
+    parser.add_argument('--profile', action='store_true', help='Print how long each phase took per package at the end.')
+    parser.add_argument('--profile-trace', type=Path, help='Write the profile as a Chrome trace event file (viewable e.g. in Perfetto) to the given path. Implies --profile.')
+    parser.add_argument('--lock-timeout', type=float, default=30, help='The number of seconds to wait for other dotpkg runs to release the state. Negative values wait indefinitely.')
+    parser.add_argument('--no-install-manifest', action='store_false', dest='update_install_manifest', help=f'Skips updating the install manifest at ~/{STATE_DIR_PATH}/{INSTALL_MANIFEST_NAME}.')
     parser.add_argument('command', choices=sorted(COMMANDS.keys()), help='The command to invoke')
     parser.add_argument('subargs', nargs=argparse.ZERO_OR_MORE, help='The arguments to the command.')
 
     args = parser.parse_args()
+
+    from dotpkg.options import Options
+    from dotpkg.utils.profiler import profiling
+    from dotpkg.utils.prompt import confirm
+
     opts = Options(
         cwd=args.cwd,
         home=args.home,
@@ -43,6 +67,10 @@ def main():
         assume_yes=args.assume_yes,
         update_install_manifest=args.update_install_manifest,
         safe_mode=args.safe_mode,
+        jobs=args.jobs,
+        json_output=args.json_output,
+        script_timeout=args.script_timeout,
+        lock_timeout=args.lock_timeout if args.lock_timeout >= 0 else None,
     )
 
     if opts.dry_run:
@@ -54,7 +82,8 @@ def main():
             sys.exit(0)
 
     try:
-        COMMANDS[args.command](args.subargs, opts)
+        with profiling(args.profile or args.profile_trace is not None, args.profile_trace):
+            load_command(args.command)(args.subargs, opts)
     except DotpkgError as e:
         error(str(e))
         sys.exit(1)
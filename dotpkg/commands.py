@@ -1,74 +1,89 @@
+from contextlib import redirect_stdout
 from pathlib import Path
+from typing import Optional
 
-from dotpkg.constants import IGNORED_NAMES
-from dotpkg.error import MissingDotpkgManifestError
-from dotpkg.install import install, install_manifest_path, read_install_manifest, uninstall
+from dotpkg.compact import COMPACT_VERSION
+from dotpkg.discovery import discover_packages
+from dotpkg.error import InvalidPlanError, MissingDotpkgManifestError
+from dotpkg.install import apply_package_plan, install, install_manifest_path, uninstall, write_install_manifest
+from dotpkg.state import State, lock_state, open_state
 from dotpkg.resolve import batch_skip_reason
 from dotpkg.manifest.dotpkg import DotpkgManifest
+from dotpkg.manifest.installs import InstallsManifest
+from dotpkg.manifest.installs_v4 import InstallsV4Manifest
+from dotpkg.manifest.installs_v5 import InstallsV5Manifest
 from dotpkg.model import Dotpkg, DotpkgRef, DotpkgRefs
 from dotpkg.options import Options
-from dotpkg.utils.file import move
-from dotpkg.utils.log import info, warn
+from dotpkg.parallel import run_packages
+from dotpkg.plan import Plan, plan_packages
+from dotpkg.sync import unchanged_targets
+from dotpkg.utils.log import info, note, success, warn
 from dotpkg.utils.prompt import confirm, prompt
 
+import json
 import sys
 
-def cwd_dotpkgs(opts: Options) -> DotpkgRefs:
+def cwd_dotpkgs(opts: Options, state: State) -> DotpkgRefs:
     cwd = opts.cwd.resolve()
 
     # Prefer current directory if it contains a manifest
     cwd_ref = DotpkgRef(cwd)
-    if cwd_ref.manifest_path.exists():
+    if opts.fs.exists(cwd_ref.manifest_path):
         return DotpkgRefs(
             refs=[cwd_ref],
             is_batch=False,
         )
     
-    # Otherwise resolve child directories
+    # Otherwise discover the packages in (nested) child directories
     return DotpkgRefs(
-        refs=[
-            ref
-            for p in cwd.iterdir()
-            for ref in [DotpkgRef(p)]
-            if not p.name in IGNORED_NAMES and ref.manifest_path.exists()
-        ],
+        refs=[DotpkgRef(p) for p in discover_packages(cwd, opts, state.discovery)],
         is_batch=True,
     )
 
-def resolve_refs(raw_dotpkg_paths: list[str], opts: Options) -> DotpkgRefs:
+def resolve_refs(raw_dotpkg_paths: list[str], opts: Options, state: State) -> DotpkgRefs:
     if raw_dotpkg_paths:
         return DotpkgRefs([DotpkgRef(Path(p).resolve()) for p in raw_dotpkg_paths], is_batch=False)
     else:
-        return cwd_dotpkgs(opts)
-
-def install_cmd(raw_dotpkg_paths: list[str], opts: Options):
-    refs = resolve_refs(raw_dotpkg_paths, opts)
+        return cwd_dotpkgs(opts, state)
 
+def install_refs(refs: DotpkgRefs, opts: Options, state: State):
     if refs.is_batch and not confirm(f"Install dotpkgs {', '.join(ref.name for ref in refs)}?", opts):
         print('Cancelling')
         sys.exit(0)
 
+    pkgs: list[Dotpkg] = []
+
     for ref in refs:
-        pkg = ref.read()
+        pkg = ref.read(state.manifests, opts.fs)
         name = pkg.manifest.name
 
-        if refs.is_batch and (skip_reason := batch_skip_reason(pkg.manifest, opts)):
+        if refs.is_batch and (skip_reason := batch_skip_reason(pkg.manifest, opts, state.executables)):
             warn(f'Skipping {name} ({skip_reason})')
             continue
 
-        info(f'Installing {name} ({pkg.manifest.description})...')
-        install(pkg, opts)
+        pkgs.append(pkg)
 
-def uninstall_cmd(raw_dotpkg_paths: list[str], opts: Options):
-    refs = resolve_refs(raw_dotpkg_paths, opts)
+    def install_pkg(pkg: Dotpkg):
+        info(f'Installing {pkg.name} ({pkg.manifest.description})...')
+        install(pkg, opts, state)
+
+    run_packages(pkgs, install_pkg, opts, state)
 
+def install_cmd(raw_dotpkg_paths: list[str], opts: Options):
+    with open_state(opts) as state:
+        refs = resolve_refs(raw_dotpkg_paths, opts, state)
+        install_refs(refs, opts, state)
+
+def uninstall_refs(refs: DotpkgRefs, opts: Options, state: State, keeps: Optional[dict[str, set[Path]]] = None):
     if refs.is_batch and not confirm(f"Uninstall dotpkgs {', '.join(ref.name for ref in refs)}?", opts):
         print('Cancelling')
         sys.exit(0)
 
+    pkgs: list[Dotpkg] = []
+
     for ref in refs:
         try:
-            pkg = ref.read()
+            pkg = ref.read(state.manifests, opts.fs)
         except MissingDotpkgManifestError:
             response = prompt(f'No manifest found for {ref.name}, should we attempt to uninstall anyway using a fallback manifest?', ['uninstall', 'skip'], 'uninstall', opts)
             if response == 'skip':
@@ -80,29 +95,142 @@ def uninstall_cmd(raw_dotpkg_paths: list[str], opts: Options):
 
         name = pkg.manifest.name
 
-        if refs.is_batch and (skip_reason := batch_skip_reason(pkg.manifest, opts)):
+        if refs.is_batch and (skip_reason := batch_skip_reason(pkg.manifest, opts, state.executables)):
             warn(f'Skipping {name} ({skip_reason})')
             continue
 
-        info(f"Uninstalling {name} ({pkg.manifest.description})...")
-        uninstall(pkg, opts)
+        pkgs.append(pkg)
+
+    def uninstall_pkg(pkg: Dotpkg):
+        info(f"Uninstalling {pkg.name} ({pkg.manifest.description})...")
+        uninstall(pkg, opts, state, keep=keeps.get(str(pkg.path)) if keeps else None)
+
+    run_packages(pkgs, uninstall_pkg, opts, state)
+
+def uninstall_cmd(raw_dotpkg_paths: list[str], opts: Options):
+    with open_state(opts) as state:
+        refs = resolve_refs(raw_dotpkg_paths, opts, state)
+        uninstall_refs(refs, opts, state)
 
 def sync_cmd(raw_paths: list[str], opts: Options):
-    uninstall_cmd(raw_paths, opts)
-    install_cmd(raw_paths, opts)
+    with open_state(opts) as state:
+        refs = resolve_refs(raw_paths, opts, state)
+
+        # Only reinstall packages that changed, keeping their unchanged files
+        stale_refs: list[DotpkgRef] = []
+        keeps: dict[str, set[Path]] = {}
+
+        for ref in refs:
+            try:
+                pkg = ref.read(state.manifests, opts.fs)
+            except MissingDotpkgManifestError:
+                stale_refs.append(ref)
+                continue
 
-def upgrade_install_manifest_cmd(unused_args: list[str], opts: Options):
-    if unused_args:
-        print('This command expects no arguments!')
-        sys.exit(1)
+            up_to_date, unchanged = unchanged_targets(pkg, opts, state)
+            if up_to_date:
+                note(f'Skipping {pkg.name} (up to date)')
+            else:
+                stale_refs.append(ref)
+                keeps[str(ref.path)] = unchanged
+
+        if not stale_refs:
+            success('Everything is up to date')
+            return
+
+        stale = DotpkgRefs(refs=stale_refs, is_batch=refs.is_batch)
+        uninstall_refs(stale, opts, state, keeps)
+        install_refs(stale, opts, state)
+
+def plan_cmd(raw_dotpkg_paths: list[str], opts: Options):
+    # Keep stdout clean for the plan itself
+    with redirect_stdout(sys.stderr), lock_state(opts, exclusive=False):
+        # The plan is computed against the current state, but does not change it
+        state = State(opts, read_only=True)
+        refs = resolve_refs(raw_dotpkg_paths, opts, state)
+        pkgs: list[Dotpkg] = []
+
+        for ref in refs:
+            pkg = ref.read(state.manifests, opts.fs)
+
+            if refs.is_batch and (skip_reason := batch_skip_reason(pkg.manifest, opts, state.executables)):
+                warn(f'Skipping {pkg.name} ({skip_reason})')
+                continue
 
-    manifest = read_install_manifest(opts)
-    raw_paths = list(manifest.installs.keys())
+            pkgs.append(pkg)
 
-    uninstall_cmd(raw_paths, opts)
+        plan = plan_packages(pkgs, opts, state)
+        state.save_caches()
 
-    info('Backing install manifest up and removing it')
-    manifest_path = install_manifest_path(opts)
-    move(manifest_path, manifest_path.with_name(f'{manifest_path.name}.v{manifest.version}.backup'), opts)
+    print(json.dumps(plan.to_dict(), indent=2))
+
+def apply_cmd(args: list[str], opts: Options):
+    if len(args) != 1:
+        print('This command expects a single plan file (or - for stdin)!')
+        sys.exit(1)
+
+    try:
+        if args[0] == '-':
+            raw_plan = json.load(sys.stdin)
+        else:
+            with open(args[0], 'r') as f:
+                raw_plan = json.load(f)
+        plan = Plan.from_dict(raw_plan)
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidPlanError(f'Could not read plan: {e}') from e
+
+    with open_state(opts) as state:
+        for pkg_plan in plan.packages:
+            info(f'Applying {pkg_plan.action} of {pkg_plan.name}...')
+            apply_package_plan(pkg_plan, opts, state)
+
+def upgrade_install_manifest_cmd(args: list[str], opts: Options):
+    # The compact version is opt-in, since older dotpkg versions cannot read it
+    compact = args == [str(COMPACT_VERSION)]
+    if args and not compact:
+        print(f'This command expects no arguments (or {COMPACT_VERSION} to opt into the compact install manifest)!')
+        sys.exit(1)
 
-    install_cmd(raw_paths, opts)
+    # Hold the lock across the whole upgrade, the commands below reenter it
+    with lock_state(opts):
+        # Opening the state recovers any changes from interrupted runs first
+        with open_state(opts) as state:
+            manifest = state.install_manifest
+        raw_paths = list(manifest.installs.keys())
+        manifest_path = install_manifest_path(opts)
+        backup_path = manifest_path.with_name(f'{manifest_path.name}.v{manifest.version}.backup')
+
+        if compact and isinstance(manifest, InstallsV5Manifest):
+            info('Install manifest is already compact')
+            return
+
+        if compact and isinstance(manifest, InstallsV4Manifest):
+            # The compact version only changes the encoding, so we can convert
+            # the entries without reinstalling the packages
+            info('Backing install manifest up and converting it')
+            print(f'Moving {manifest_path} to {backup_path}')
+            opts.fs.move(manifest_path, backup_path)
+            write_compact_install_manifest(manifest, opts)
+            return
+
+        # Reinstalling writes the current (non-compact) version, which also
+        # lets users opt out of the compact version again
+        uninstall_cmd(raw_paths, opts)
+
+        info('Backing install manifest up and removing it')
+        print(f'Moving {manifest_path} to {backup_path}')
+        opts.fs.move(manifest_path, backup_path)
+
+        install_cmd(raw_paths, opts)
+
+        if compact:
+            with open_state(opts) as state:
+                manifest = state.install_manifest
+            info('Converting install manifest')
+            write_compact_install_manifest(manifest, opts)
+
+def write_compact_install_manifest(manifest: InstallsManifest, opts: Options):
+    write_install_manifest(InstallsV5Manifest(installs={
+        key: InstallsV5Manifest.InstallsEntry.from_dict(entry.to_dict())
+        for key, entry in manifest.installs.items()
+    }), opts)
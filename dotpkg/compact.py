@@ -0,0 +1,143 @@
+from collections.abc import MutableMapping
+from typing import Any, Iterator, Optional, Union, cast
+
+from dotpkg.error import InvalidManifestError
+from dotpkg.manifest.installs_v5 import InstallsV5Manifest
+
+import base64
+import json
+import os
+
+# Compact install manifests (v5)
+#
+# The first line of the file is a JSON header containing the version and an
+# index mapping each install key to the line of its entry. Each following
+# line holds a single entry, whose paths are interned as [dir index, name]
+# pairs into a per-entry table of directories and whose (SHA-256) digests are
+# stored as base64-encoded bytes. Entries are thus only decoded when looked
+# up and unchanged entries are written back verbatim.
+
+COMPACT_VERSION = 5
+
+Entry = InstallsV5Manifest.InstallsEntry
+
+def encode_digest(digest: str) -> str:
+    try:
+        return base64.b64encode(bytes.fromhex(digest)).decode('ascii').rstrip('=')
+    except ValueError:
+        # Not a hex digest, ':' cannot occur in base64
+        return f':{digest}'
+
+def decode_digest(raw: str) -> str:
+    if raw.startswith(':'):
+        return raw[1:]
+    return base64.b64decode(raw + '=' * (-len(raw) % 4)).hex()
+
+def encode_entry(entry: Entry) -> str:
+    dirs: dict[str, int] = {}
+
+    def encode_path(path: str) -> list[Any]:
+        parent, name = os.path.split(path)
+        return [dirs.setdefault(parent, len(dirs)), name]
+
+    encoded = {
+        't': entry.target_dir,
+        's': [encode_path(path) for path in entry.src_paths],
+        'p': [encode_path(path) for path in entry.paths],
+        'c': [encode_digest(checksum) for checksum in entry.checksums],
+    }
+    encoded['d'] = list(dirs.keys())
+    return json.dumps(encoded, separators=(',', ':'))
+
+def decode_entry(raw: Union[str, bytes]) -> Entry:
+    encoded = json.loads(raw)
+    dirs: list[str] = encoded['d']
+
+    def decode_path(path: list[Any]) -> str:
+        return os.path.join(dirs[path[0]], path[1])
+
+    return Entry(
+        target_dir=encoded['t'],
+        src_paths=[decode_path(path) for path in encoded['s']],
+        paths=[decode_path(path) for path in encoded['p']],
+        checksums=[decode_digest(checksum) for checksum in encoded['c']],
+    )
+
+class CompactInstalls(MutableMapping[str, Entry]):
+    '''The installs of a compact manifest, decoded lazily upon lookup.'''
+
+    def __init__(self, raw_entries: Optional[dict[str, bytes]] = None):
+        self.entries: dict[str, Union[bytes, Entry]] = dict(raw_entries or {})
+
+    def __getitem__(self, key: str) -> Entry:
+        entry = self.entries[key]
+        if isinstance(entry, bytes):
+            entry = decode_entry(entry)
+            self.entries[key] = entry
+        return entry
+
+    def __setitem__(self, key: str, entry: Entry):
+        self.entries[key] = entry
+
+    def __delitem__(self, key: str):
+        del self.entries[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __repr__(self) -> str:
+        return f'CompactInstalls({list(self.entries.keys())})'
+
+    def encoded_entries(self) -> Iterator[tuple[str, str]]:
+        for key, entry in self.entries.items():
+            if isinstance(entry, bytes):
+                yield key, entry.decode('utf-8').strip()
+            else:
+                yield key, encode_entry(entry)
+
+def read_compact_manifest(data: bytes) -> Optional[InstallsV5Manifest]:
+    '''Reads a compact manifest or returns None if the data is not one.'''
+
+    header_end = data.find(b'\n')
+    try:
+        header = json.loads(data[:header_end] if header_end >= 0 else data)
+    except ValueError:
+        # Pretty-printed (i.e. legacy) manifests do not have a header line
+        return None
+
+    if not isinstance(header, dict) or header.get('version') != COMPACT_VERSION:
+        return None
+
+    index = header.get('index')
+    if not isinstance(index, dict):
+        # Silently treating this as empty would lose all installs
+        raise InvalidManifestError('Compact install manifest has no index')
+
+    lines = data.split(b'\n')
+    try:
+        installs = CompactInstalls({key: lines[i] for key, i in cast(dict[str, int], index).items()})
+    except (IndexError, TypeError):
+        raise InvalidManifestError('Compact install manifest has an invalid index')
+
+    return InstallsV5Manifest(installs=cast(dict[str, Entry], installs))
+
+def write_compact_manifest(manifest: InstallsV5Manifest) -> str:
+    installs = manifest.installs
+    if isinstance(installs, CompactInstalls):
+        encoded_entries = list(installs.encoded_entries())
+    else:
+        encoded_entries = [(key, encode_entry(entry)) for key, entry in installs.items()]
+
+    header = {
+        'version': COMPACT_VERSION,
+        'index': {key: i + 1 for i, (key, _) in enumerate(encoded_entries)},
+    }
+
+    return '\n'.join([
+        json.dumps(header, separators=(',', ':')),
+        *(line for _, line in encoded_entries),
+        '',
+    ])
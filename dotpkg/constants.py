@@ -1,3 +1,17 @@
+STATE_DIR_PATH = '.local/state/dotpkg'
 DOTPKG_MANIFEST_NAME = 'dotpkg.json'
 INSTALL_MANIFEST_NAME = 'installs.json'
+INSTALL_JOURNAL_NAME = 'installs.journal'
+STATE_LOCK_NAME = 'lock'
+OWNER_INDEX_NAME = 'owners.json'
+DIGEST_CACHE_NAME = 'digests.json'
+DIGEST_CACHE_CAPACITY = 16384
 IGNORED_NAMES = {DOTPKG_MANIFEST_NAME, INSTALL_MANIFEST_NAME, '.git', '.gitignore', '.DS_Store'}
+SYNC_DIGESTS_NAME = 'synced.json'
+SYNC_DIGESTS_CAPACITY = 4096
+MANIFEST_CACHE_NAME = 'manifests.json'
+MANIFEST_CACHE_CAPACITY = 4096
+DISCOVERY_INDEX_NAME = 'discovery.json'
+DISCOVERY_INDEX_CAPACITY = 64
+EXECUTABLE_CACHE_NAME = 'executables.json'
+EXECUTABLE_CACHE_CAPACITY = 256
@@ -0,0 +1,166 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+from dotpkg.constants import DISCOVERY_INDEX_CAPACITY, DISCOVERY_INDEX_NAME, DOTPKG_MANIFEST_NAME, IGNORED_NAMES
+from dotpkg.options import Options
+from dotpkg.utils.cache import PersistentCache
+from dotpkg.utils.file import RACY_MTIME_NS
+
+import os
+import time
+
+# Package discovery
+#
+# Packages are found by walking the directory tree up to a limited depth,
+# without descending into packages themselves (whose contents are dotfiles),
+# into nested Git repositories (e.g. vendored ones, whose test fixtures may
+# look like packages), into symlinks (which may form cycles) or into hidden
+# and vendored directories, which usually contain lots of files, but no
+# packages. The latter are still packages if they directly contain a
+# manifest, like every child of the root was before nesting. The depth limit
+# keeps runs from large directories (e.g. the home directory) cheap, while
+# leaving plenty of room for grouping. The result is indexed by the root along with
+# the mtimes of all directories looked into, which change whenever an entry
+# (e.g. a package or its manifest) is added, removed or renamed. As long as
+# none of them changed, stat'ing them is enough to reuse the result.
+
+# Directories that are not descended into (like hidden ones), unless they are packages themselves
+VENDORED_NAMES = {'node_modules', 'vendor', 'venv', '__pycache__'}
+
+# The depth up to which packages are found (e.g. 3 for group/subgroup/package)
+MAX_DISCOVERY_DEPTH = 3
+
+# Only use a worker pool if there are enough directories to amortize it
+PARALLEL_DISCOVERY_MIN_DIRS = 8
+
+DiscoveryIndex = PersistentCache[Any]
+
+def discovery_index(opts: Options) -> DiscoveryIndex:
+    return DiscoveryIndex(opts.state_dir / DISCOVERY_INDEX_NAME, capacity=DISCOVERY_INDEX_CAPACITY)
+
+@dataclass
+class ScannedDir:
+    mtime_ns: int
+    is_package: bool
+    subdirs: list[str] = field(default_factory=list)
+    '''The subdirectories to descend into (if not a package).'''
+
+    checked_dirs: dict[str, int] = field(default_factory=dict)
+    '''The mtimes of the subdirectories that were only checked for a manifest.'''
+
+    checked_packages: list[str] = field(default_factory=list)
+    '''The checked subdirectories that are packages.'''
+
+    is_repo: bool = False
+    '''Whether the directory is (the root of) a Git repository.'''
+
+def scan_dir(path: str) -> Optional[ScannedDir]:
+    '''Lists the directory, returning None if unreadable.'''
+
+    try:
+        # Stat'ing before listing errs on the side of an outdated mtime
+        scanned = ScannedDir(mtime_ns=os.stat(path).st_mtime_ns, is_package=False)
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name == DOTPKG_MANIFEST_NAME:
+                    scanned.is_package = True
+                elif entry.name == '.git':
+                    scanned.is_repo = True
+                elif entry.name in IGNORED_NAMES:
+                    continue
+                elif entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.') and entry.name not in VENDORED_NAMES:
+                    scanned.subdirs.append(entry.path)
+                elif entry.is_dir():
+                    # Symlinked, hidden and vendored directories are not
+                    # descended into, but may still be packages
+                    try:
+                        scanned.checked_dirs[entry.path] = os.stat(entry.path).st_mtime_ns
+                    except OSError:
+                        continue
+                    if os.path.exists(os.path.join(entry.path, DOTPKG_MANIFEST_NAME)):
+                        scanned.checked_packages.append(entry.path)
+        if scanned.is_package:
+            scanned.subdirs, scanned.checked_dirs, scanned.checked_packages = [], {}, []
+        return scanned
+    except OSError:
+        return None
+
+def is_index_valid(root: str, indexed_dirs: dict[str, int]) -> bool:
+    for rel_path, mtime_ns in indexed_dirs.items():
+        try:
+            if os.stat(os.path.join(root, rel_path)).st_mtime_ns != mtime_ns:
+                return False
+        except OSError:
+            return False
+    return True
+
+def discover_packages(root: Path, opts: Options, index: Optional[DiscoveryIndex] = None) -> list[Path]:
+    '''Finds the packages in the given directory (or the directory itself if it is one), sorted by path.'''
+
+    # Paths are handled as strings, since constructing Paths would dominate
+    root_str = str(root)
+
+    if index and (indexed := index.get(root_str)):
+        try:
+            if is_index_valid(root_str, indexed['dirs']):
+                return [root / rel_path for rel_path in indexed['packages']]
+        except (KeyError, TypeError, AttributeError):
+            # Treat a corrupt index like a missing one
+            pass
+
+    dirs: dict[str, int] = {}
+    rel_packages: list[str] = []
+    level = [root_str]
+
+    def relativize(path: str) -> str:
+        return '.' if path == root_str else path[len(root_str) + 1:]
+
+    executor = None
+    depth = 0
+
+    try:
+        while level:
+            scanned_level: Iterable[Optional[ScannedDir]]
+            if opts.jobs > 1 and len(level) >= PARALLEL_DISCOVERY_MIN_DIRS:
+                if executor is None:
+                    # Only imported when needed (see status)
+                    from concurrent.futures import ThreadPoolExecutor
+                    executor = ThreadPoolExecutor(max_workers=opts.jobs)
+                scanned_level = executor.map(scan_dir, level)
+            else:
+                scanned_level = map(scan_dir, level)
+
+            next_level: list[str] = []
+            for path, scanned in zip(level, scanned_level):
+                if scanned is None:
+                    continue
+                rel_path = relativize(path)
+                dirs[rel_path] = scanned.mtime_ns
+                if scanned.is_package:
+                    rel_packages.append(rel_path)
+                # Nested repositories (unlike the one we are in) are not ours
+                if depth == MAX_DISCOVERY_DEPTH or (scanned.is_repo and path != root_str):
+                    continue
+                for checked_path, mtime_ns in scanned.checked_dirs.items():
+                    dirs[relativize(checked_path)] = mtime_ns
+                rel_packages += map(relativize, scanned.checked_packages)
+                next_level += scanned.subdirs
+            level = next_level
+            depth += 1
+    finally:
+        if executor:
+            executor.shutdown()
+
+    rel_packages.sort()
+
+    # Directories modified very recently might change again without their
+    # mtime changing (depending on its granularity), so we don't index them
+    racy_ns = time.time_ns() - RACY_MTIME_NS
+    if index and all(mtime_ns < racy_ns for mtime_ns in dirs.values()):
+        index.put(root_str, {
+            'dirs': dirs,
+            'packages': rel_packages,
+        })
+
+    return [root / rel_path for rel_path in rel_packages]
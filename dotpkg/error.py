@@ -9,3 +9,15 @@ class MissingDotpkgManifestError(DotpkgError):
 
 class NoTargetDirError(DotpkgError):
     pass
+
+class InvalidPlanError(DotpkgError):
+    pass
+
+class StateLockedError(DotpkgError):
+    pass
+
+class ScriptTimeoutError(DotpkgError):
+    pass
+
+class OperationFailedError(DotpkgError):
+    pass
@@ -0,0 +1,204 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from dotpkg.error import OperationFailedError
+from dotpkg.options import Options
+from dotpkg.plan import Operation
+from dotpkg.scripts import run_script_command
+from dotpkg.timings import ScriptTimes
+from dotpkg.utils.fs import FileSystem
+
+import errno
+import os
+
+# Only use a worker pool if there are enough independent operations to amortize it
+PARALLEL_EXECUTE_MIN_CHAINS = 16
+PARALLEL_EXECUTE_WORKERS = min(8, os.cpu_count() or 1)
+
+# File operations
+
+def describe(op: Operation, fs: FileSystem) -> Optional[str]:
+    '''Describes the operation or returns None if there is nothing to do.'''
+    if op.kind == 'mkdir':
+        return None if fs.is_dir(op.path) else f'Creating directory {op.path}'
+    elif op.kind == 'touch':
+        return f'Touching {op.path}'
+    elif op.kind == 'link':
+        # E.g. when applying a plan again
+        if fs.is_symlink(op.path) and fs.readlink(op.path) == op.src:
+            return None
+        return f'Linking {op.path} -> {op.src}'
+    elif op.kind == 'copy':
+        return f'Copying {op.src} to {op.path}'
+    elif op.kind == 'move':
+        return f'Moving {op.src} to {op.path}'
+    elif op.kind == 'remove':
+        if fs.is_symlink(op.path) or not fs.is_dir(op.path):
+            return f'Removing {op.path}'
+        else:
+            return f'Removing directory {op.path}'
+    else:
+        raise ValueError(f'Cannot describe operation {op.kind}')
+
+def perform(op: Operation, fs: FileSystem) -> Optional[str]:
+    '''Performs the file operation and returns the digest of the target if it was copied.'''
+    if op.kind == 'mkdir':
+        fs.mkdir(op.path)
+    elif op.kind == 'touch':
+        fs.touch(op.path)
+    elif op.kind == 'link':
+        assert op.src
+        fs.symlink(op.path, op.src)
+    elif op.kind == 'copy':
+        assert op.src
+        # Copying files would silently overwrite them otherwise
+        if fs.lstat(op.path) is not None:
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), str(op.path))
+        return fs.copy(op.src, op.path)
+    elif op.kind == 'move':
+        assert op.src
+        fs.move(op.src, op.path)
+    elif op.kind == 'remove':
+        fs.remove(op.path)
+    else:
+        raise ValueError(f'Cannot perform operation {op.kind}')
+
+def operation_paths(op: Operation) -> list[Path]:
+    return [op.path, op.src] if op.src else [op.path]
+
+def chain_operations(ops: list[Operation]) -> list[list[Operation]]:
+    '''
+    Groups file operations into chains that may run independently of each
+    other. Operations touching the same path (or a path within it) end up in
+    the same chain, in their original order. Chains are sorted by directory,
+    so operations on nearby paths run close to each other.
+    '''
+
+    parents = list(range(len(ops)))
+
+    def find(i: int) -> int:
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    owners: dict[Path, int] = {}
+    for i, op in enumerate(ops):
+        for path in operation_paths(op):
+            if path in owners:
+                parents[find(i)] = find(owners[path])
+            else:
+                owners[path] = i
+
+    # Link operations on paths nested in each other
+    for path, i in owners.items():
+        for parent in path.parents:
+            if (j := owners.get(parent)) is not None:
+                parents[find(i)] = find(j)
+
+    chains: dict[int, list[Operation]] = {}
+    for i, op in enumerate(ops):
+        chains.setdefault(find(i), []).append(op)
+
+    return sorted(chains.values(), key=lambda chain: (chain[0].path.parent, chain[0].path.name))
+
+def dedupe_mkdirs(paths: list[Path]) -> list[Path]:
+    '''Drops duplicate directories and those created anyway as parents of others.'''
+    unique = set(paths)
+    ancestors = {parent for path in unique for parent in path.parents}
+    return sorted(unique - ancestors)
+
+class Executor:
+    '''
+    Queues operations and performs them in batches. Within a batch (i.e.
+    between scripts, which may depend on anything before them), directories
+    are created first, then the remaining file operations run as independent
+    chains, on a worker pool if there are enough of them. Output is printed
+    in a deterministic order, just like running the operations serially.
+    '''
+
+    def __init__(self, opts: Options, workers: int = PARALLEL_EXECUTE_WORKERS, script_times: Optional[ScriptTimes] = None):
+        self.opts = opts
+        self.workers = workers
+        self.script_times = script_times
+        self.queue: list[Operation] = []
+        self.digests: dict[Path, str] = {}
+        '''The digests of the copied paths.'''
+        self.performed: list[Operation] = []
+        '''The operations performed so far (including those that turned out to have nothing to do).'''
+
+    def submit(self, op: Operation):
+        self.queue.append(op)
+
+    def flush(self) -> dict[Path, str]:
+        '''Performs the queued operations and returns the digests of the copies.'''
+        queue, self.queue = self.queue, []
+        batch: list[Operation] = []
+
+        for op in queue:
+            if op.kind == 'script':
+                self.run_batch(batch)
+                batch = []
+                assert op.script and op.command
+                run_script_command(op.script, op.command, op.path, self.opts, self.script_times)
+                self.performed.append(op)
+            else:
+                batch.append(op)
+
+        self.run_batch(batch)
+        return self.digests
+
+    def run_chain(self, chain: list[Operation]) -> tuple[list[str], dict[Path, str], list[Operation], Optional[Exception]]:
+        lines: list[str] = []
+        digests: dict[Path, str] = {}
+        performed: list[Operation] = []
+        try:
+            for op in chain:
+                if (description := describe(op, self.opts.fs)) is not None:
+                    lines.append(description)
+                    try:
+                        digest = perform(op, self.opts.fs)
+                    except OSError as e:
+                        # E.g. if the file system changed since the operation was planned
+                        raise OperationFailedError(f'{description} failed: {e.strerror or e}') from e
+                    if digest is not None:
+                        digests[op.path] = digest
+                performed.append(op)
+        except Exception as e:
+            return lines, digests, performed, e
+        return lines, digests, performed, None
+
+    def run_batch(self, ops: list[Operation]):
+        if not ops:
+            return
+
+        mkdirs = dedupe_mkdirs([op.path for op in ops if op.kind == 'mkdir'])
+        chains = [[Operation('mkdir', path)] for path in mkdirs]
+        chains += chain_operations([op for op in ops if op.kind != 'mkdir'])
+
+        # Only the real file system benefits from concurrent operations
+        if self.workers > 1 and self.opts.fs.persistent and len(chains) >= PARALLEL_EXECUTE_MIN_CHAINS:
+            # Directories have to exist before anything is placed in them
+            results = [self.run_chain(chain) for chain in chains[:len(mkdirs)]]
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results += executor.map(self.run_chain, chains[len(mkdirs):])
+        else:
+            results = []
+            for chain in chains:
+                results.append(self.run_chain(chain))
+                # Like any serial run, we stop at the first failure
+                if results[-1][3]:
+                    break
+
+        # Everything that was performed (even after a failure in another
+        # chain) is accounted for, before raising the first error
+        first_error: Optional[Exception] = None
+        for lines, digests, performed, error in results:
+            for line in lines:
+                print(line)
+            self.digests.update(digests)
+            self.performed += performed
+            first_error = first_error or error
+        if first_error:
+            raise first_error
@@ -59,6 +59,9 @@ class DotpkgManifest:
     name: str
     '''The name of the dotpkg (usually a short, kebab-cases identifier e.g. referring to the program configured). By default this is the name of the parent dir.'''
     
+    always_sync: bool = field(default_factory=lambda: False)
+    '''Whether 'dotpkg sync' should always reinstall the package (including running its scripts), even if its files and manifest are unchanged. Useful for packages whose scripts have effects that dotpkg cannot track.'''
+    
     copy: bool = field(default_factory=lambda: False)
     '''Whether to copy the files instead of linking them.'''
     
@@ -72,7 +75,7 @@ class DotpkgManifest:
     '''A list of file (glob) patterns that are considered to be host-specific. Files that are irrelevant to the current host (e.g. those for other hosts) will be ignored. Each pattern should include '${hostname}' to refer to such files.'''
     
     ignored_files: list[str] = field(default_factory=lambda: [])
-    '''A list of file (glob) patterns that are to be ignored, i.e. not linked. This could e.g. be useful to store generic scripts in the dotpkg that are not intended to be linked into some config directory.'''
+    '''A list of file (glob) patterns that are to be ignored, i.e. not linked. This could e.g. be useful to store generic scripts in the dotpkg that are not intended to be linked into some config directory. Patterns are relative to the dotpkg, '*' does not match across directories, '**' matches any number of directories and a pattern ending with '**' or '/' only matches directories.'''
     
     is_scripts_only: bool = field(default_factory=lambda: False)
     '''Implicitly ignores all files for linking. Useful for packages that only use their install/uninstall scripts.'''
@@ -115,6 +118,7 @@ class DotpkgManifest:
             create_target_dir_if_needed=d.get('createTargetDirIfNeeded') or False,
             touch_files=[v for v in (d.get('touchFiles') or [])],
             skip_during_batch_install=d.get('skipDuringBatchInstall') or False,
+            always_sync=d.get('alwaysSync') or False,
             copy=d.get('copy') or False,
             is_scripts_only=d.get('isScriptsOnly') or False,
             requires=d.get('requires') or None,
@@ -134,6 +138,7 @@ class DotpkgManifest:
             'createTargetDirIfNeeded': self.create_target_dir_if_needed,
             'touchFiles': [(v) for v in (self.touch_files)],
             'skipDuringBatchInstall': self.skip_during_batch_install,
+            'alwaysSync': self.always_sync,
             'copy': self.copy,
             'isScriptsOnly': self.is_scripts_only,
             'requires': self.requires,
@@ -5,7 +5,8 @@ from .installs_v1 import InstallsV1Manifest
 from .installs_v2 import InstallsV2Manifest
 from .installs_v3 import InstallsV3Manifest
 from .installs_v4 import InstallsV4Manifest
+from .installs_v5 import InstallsV5Manifest
 from typing import Union
 
-InstallsManifest = Union[InstallsV1Manifest, InstallsV2Manifest, InstallsV3Manifest, InstallsV4Manifest]
+InstallsManifest = Union[InstallsV1Manifest, InstallsV2Manifest, InstallsV3Manifest, InstallsV4Manifest, InstallsV5Manifest]
 
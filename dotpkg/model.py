@@ -1,11 +1,19 @@
 from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
+from typing import Any, Optional, Protocol
 
 from dotpkg.constants import DOTPKG_MANIFEST_NAME
 from dotpkg.error import MissingDotpkgManifestError
 from dotpkg.manifest.dotpkg import DotpkgManifest
+from dotpkg.utils.file import stat_signature
+from dotpkg.utils.fs import FileSystem, OSFileSystem
 
 import json
+import os
+import stat
+import threading
+import time
 
 @dataclass
 class Dotpkg:
@@ -16,6 +24,38 @@ class Dotpkg:
     def name(self) -> str:
         return self.manifest.name
 
+@lru_cache(maxsize=None)
+def resolve_cwd(cwd: Path) -> Path:
+    return cwd.resolve()
+
+def package_label(path: Path, cwd: Path) -> str:
+    '''
+    Identifies the package at the path for humans, by its path relative to
+    the cwd (like list does), since directory names are not unique across
+    groups (e.g. linux/git and macos/git).
+    '''
+    for base in (cwd, resolve_cwd(cwd)):
+        try:
+            rel_path = path.relative_to(base)
+        except ValueError:
+            continue
+        return str(rel_path) if rel_path.parts else path.name
+    return str(path)
+
+class ManifestCache(Protocol):
+    '''Protocol for caches of raw dotpkg manifests, keyed by path.'''
+    def get(self, key: str, /) -> Optional[Any]:
+        raise NotImplementedError()
+
+    def put(self, key: str, value: Any, /) -> None:
+        raise NotImplementedError()
+
+# The raw manifests parsed by this process (e.g. sync reads every package
+# twice), keyed by path along with the signature of the file they were parsed
+# from. Every read still creates a fresh (mutable) DotpkgManifest from these.
+parsed_manifests: dict[str, tuple[str, Any]] = {}
+parsed_manifests_lock = threading.Lock()
+
 @dataclass
 class DotpkgRef:
     path: Path
@@ -28,14 +68,45 @@ class DotpkgRef:
     def manifest_path(self) -> Path:
         return self.path / DOTPKG_MANIFEST_NAME
 
-    def read(self) -> Dotpkg:
-        if not self.manifest_path.exists():
+    def read(self, cache: Optional[ManifestCache] = None, fs: Optional[FileSystem] = None) -> Dotpkg:
+        '''
+        Reads the package's manifest (from the real file system, unless
+        another one is given), reusing it if this process parsed it before or
+        it is in the given (on-disk) cache and the file's metadata did not
+        change since.
+        '''
+
+        if fs is None:
+            fs = OSFileSystem()
+
+        path = str(self.manifest_path)
+        st = fs.stat(self.manifest_path)
+        if st is None:
             raise MissingDotpkgManifestError(f"Missing dotpkg.json manifest for '{self.name}'!")
 
-        with open(str(self.manifest_path), 'r') as f:
-            manifest = DotpkgManifest.from_dict(json.load(f))
+        # Recently modified manifests are not cached (see stat_signature)
+        signature = stat_signature(st, time.time_ns())
+        raw_manifest: Any = None
+
+        # Virtual file systems (e.g. in memory) don't share the memo and cache
+        if signature and fs.disk is not None:
+            with parsed_manifests_lock:
+                parsed = parsed_manifests.get(path)
+            if parsed and parsed[0] == signature:
+                raw_manifest = parsed[1]
+            elif cache and (cached := cache.get(path)) and cached[0] == signature:
+                raw_manifest = cached[1]
+
+        if raw_manifest is None:
+            raw_manifest = json.loads(fs.read_bytes(self.manifest_path))
+
+        if signature and fs.disk is not None:
+            with parsed_manifests_lock:
+                parsed_manifests[path] = (signature, raw_manifest)
+            if cache:
+                cache.put(path, [signature, raw_manifest])
         
-        return Dotpkg(path=self.path, manifest=manifest)
+        return Dotpkg(path=self.path, manifest=DotpkgManifest.from_dict(raw_manifest))
 
 @dataclass
 class DotpkgRefs:
@@ -44,3 +115,40 @@ class DotpkgRefs:
 
     def __iter__(self):
         return iter(self.refs)
+
+@dataclass
+class LinkCandidate:
+    '''A source path along with the path it is to be installed to.'''
+
+    src_path: Path
+    target_path: Path
+    target_stat: Optional[os.stat_result]
+    '''The (cached) lstat of the target path or None if it does not exist.'''
+
+    src_stat: Optional[os.stat_result] = None
+    '''The (cached) lstat of the source path, if known.'''
+
+    src_dest: Optional[Path] = None
+    '''The resolved source path, if known.'''
+
+    @property
+    def target_exists(self) -> bool:
+        '''Whether the target exists (or is a, possibly broken, symlink).'''
+        return self.target_stat is not None
+
+    @property
+    def target_is_symlink(self) -> bool:
+        return self.target_stat is not None and stat.S_ISLNK(self.target_stat.st_mode)
+
+    @property
+    def target_is_dir(self) -> bool:
+        '''Whether the target is a directory (without following symlinks).'''
+        return self.target_stat is not None and stat.S_ISDIR(self.target_stat.st_mode)
+
+    def target_links_to_src(self, fs: FileSystem) -> bool:
+        if not self.target_is_symlink:
+            return False
+        src_dest = self.src_dest or fs.resolve(self.src_path)
+        # Most links point directly to the source (as created by link), which
+        # lets us avoid resolving the entire chain of the target.
+        return fs.readlink(self.target_path) == src_dest or fs.resolve(self.target_path) == src_dest
@@ -1,5 +1,9 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Optional
+
+from dotpkg.constants import STATE_DIR_PATH
+from dotpkg.utils.fs import FileSystem, OSFileSystem, OverlayFileSystem
 
 @dataclass
 class Options:
@@ -7,10 +11,21 @@ class Options:
     home: Path = Path.home()
     safe_mode: bool = False
     update_install_manifest: bool = True
+    jobs: int = 1
+    script_timeout: Optional[float] = None # Seconds after which scripts are killed (None lets them run indefinitely)
+    lock_timeout: Optional[float] = 30 # Seconds to wait for other runs to release the state (None waits indefinitely)
+    fs: FileSystem = field(default_factory=OSFileSystem)
+    json_output: bool = False # Prints machine-readable output (where supported)
 
-    dry_run: bool = False # TODO: Replace with a 'file system' interface
+    dry_run: bool = False # Simulates file system operations on an overlay of fs (scripts are skipped)
     assume_yes: bool = False # TODO: Replace with a 'decider' interface
 
+    def __post_init__(self):
+        # Dry runs see the effects of earlier (simulated) operations, but
+        # never change the underlying file system
+        if self.dry_run and self.fs.persistent:
+            self.fs = OverlayFileSystem(self.fs)
+
     @property
     def state_dir(self) -> Path:
-        return self.home / '.local' / 'state' / 'dotpkg'
+        return self.home / STATE_DIR_PATH
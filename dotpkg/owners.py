@@ -0,0 +1,85 @@
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+from dotpkg.manifest.installs_v1 import InstallsV1Manifest
+
+import json
+import os
+
+# Owner index
+#
+# Maps each installed target path to the install key of the package owning it
+# and the position of the path in the package's install entry. The index is
+# derived from the install manifest and persisted in the state dir along with
+# a fingerprint of the manifest file it was derived from, so it can be reused
+# as long as the manifest has not been rewritten behind our back (rewrites are
+# atomic, i.e. always create a new inode).
+
+OWNER_INDEX_VERSION = 1
+
+def manifest_fingerprint(st: Optional[os.stat_result]) -> Optional[str]:
+    if st is None:
+        return None
+    return f'{st.st_ino}:{st.st_size}:{st.st_mtime}'
+
+def entry_paths(entry: Any) -> list[str]:
+    # The first manifest version did not record any paths
+    return [] if isinstance(entry, InstallsV1Manifest.InstallsEntry) else entry.paths
+
+class OwnerIndex:
+    '''A reverse index from target paths to the packages that installed them.'''
+
+    def __init__(self, owners: Optional[dict[str, tuple[str, int]]] = None):
+        self.owners = dict(owners or {})
+        self.dirty = False
+
+    @classmethod
+    def build(cls, installs: dict[str, Any]):
+        index = cls()
+        for key, entry in installs.items():
+            index.add(key, entry)
+        return index
+
+    def owner(self, path: Path) -> Optional[tuple[str, int]]:
+        '''Looks up the install key and position of the path, if installed.'''
+        return self.owners.get(str(path))
+
+    def add(self, key: str, entry: Any):
+        for i, path in enumerate(entry_paths(entry)):
+            self.owners[path] = (key, i)
+        self.dirty = True
+
+    def remove(self, key: str, entry: Any):
+        for path in entry_paths(entry):
+            # Another package may have taken the path over in the meantime
+            owner = self.owners.get(path)
+            if owner and owner[0] == key:
+                del self.owners[path]
+        self.dirty = True
+
+    @classmethod
+    def parse(cls, data: bytes, fingerprint: Optional[str]):
+        '''Parses a persisted index, returning None if it is stale or invalid.'''
+        try:
+            raw = json.loads(data)
+            if raw.get('version') != OWNER_INDEX_VERSION or raw.get('manifest') != fingerprint:
+                return None
+            keys: list[str] = raw['keys']
+            return cls({path: (keys[k], i) for path, (k, i) in raw['owners'].items()})
+        except (ValueError, KeyError, TypeError, IndexError):
+            return None
+
+    def serialize(self, fingerprint: Optional[str]) -> str:
+        # Interning the keys keeps the index small, since packages usually own many paths
+        keys: dict[str, int] = {}
+        return json.dumps({
+            'version': OWNER_INDEX_VERSION,
+            'manifest': fingerprint,
+            'owners': {path: [keys.setdefault(key, len(keys)), i] for path, (key, i) in self.owners.items()},
+            'keys': list(keys.keys()),
+        }, separators=(',', ':'))
+
+def owner_candidates(path: Path) -> Iterable[Path]:
+    '''The path and its ancestors, since a package may own a linked directory containing it.'''
+    yield path
+    yield from path.parents
@@ -0,0 +1,107 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable
+
+from dotpkg.error import DotpkgError
+from dotpkg.model import Dotpkg
+from dotpkg.options import Options
+from dotpkg.resolve import find_link_candidates, find_target_dir, package_renamer
+from dotpkg.state import State
+from dotpkg.utils.log import buffered_output, error, thread_local_output, warn
+
+# Parallel (un)installation
+
+def claimed_paths(pkg: Dotpkg, opts: Options, state: State) -> tuple[set[Path], set[Path]]:
+    '''
+    Conservatively estimates the paths that (un)installing the given package
+    may modify. Returns a pair of exclusively claimed paths (links, copies and
+    touched files, including previously installed ones) and shared paths (the
+    target dir, which is only created if needed).
+    '''
+
+    exclusive: set[Path] = set()
+    shared: set[Path] = set()
+
+    install = state.installs.get(str(pkg.path))
+    if install:
+        exclusive.update(Path(path) for path in getattr(install, 'paths', []))
+        if install.target_dir:
+            shared.add(Path(install.target_dir))
+
+    if not pkg.manifest.is_scripts_only:
+        try:
+            target_dir = find_target_dir(pkg.manifest, opts)
+        except DotpkgError:
+            # The (un)installation will report this error
+            return exclusive, shared
+
+        shared.add(target_dir)
+        exclusive.update(target_dir / rel_path for rel_path in pkg.manifest.touch_files)
+        exclusive.update(candidate.target_path for candidate in find_link_candidates(pkg.path, target_dir, opts.fs, package_renamer(pkg, opts)))
+
+    return exclusive, shared
+
+def independent_groups(pkgs: list[Dotpkg], opts: Options, state: State) -> list[list[Dotpkg]]:
+    '''
+    Partitions the packages into groups such that packages from different groups
+    never touch overlapping paths. Within a group, the original order is kept.
+    '''
+
+    parents = list(range(len(pkgs)))
+
+    def find(i: int) -> int:
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    def union(i: int, j: int):
+        parents[find(i)] = find(j)
+
+    claims = [claimed_paths(pkg, opts, state) for pkg in pkgs]
+    owners: dict[Path, int] = {}
+
+    for i, (exclusive, _) in enumerate(claims):
+        for path in exclusive:
+            if path in owners:
+                union(i, owners[path])
+            else:
+                owners[path] = i
+
+    # Packages also conflict if a path lies within a path claimed by another
+    for i, (exclusive, shared) in enumerate(claims):
+        for path in exclusive | shared:
+            for parent in path.parents:
+                if parent in owners:
+                    union(i, owners[parent])
+
+    groups: dict[int, list[Dotpkg]] = {}
+    for i, pkg in enumerate(pkgs):
+        groups.setdefault(find(i), []).append(pkg)
+    return list(groups.values())
+
+def run_packages(pkgs: list[Dotpkg], action: Callable[[Dotpkg], None], opts: Options, state: State):
+    '''Runs the action for every package, in parallel if multiple jobs are requested.'''
+
+    if opts.jobs > 1 and len(pkgs) > 1 and not opts.assume_yes:
+        warn('Running serially since parallel jobs require --assume-yes (prompts cannot be answered concurrently)')
+    elif opts.jobs > 1 and len(pkgs) > 1:
+        groups = independent_groups(pkgs, opts, state)
+
+        def run_group(group: list[Dotpkg]):
+            for pkg in group:
+                with buffered_output():
+                    action(pkg)
+
+        with thread_local_output(), ThreadPoolExecutor(max_workers=opts.jobs) as executor:
+            futures = [executor.submit(run_group, group) for group in groups]
+            errors = [e for future in futures if (e := future.exception())]
+
+        for e in errors[1:]:
+            error(str(e))
+        if errors:
+            raise errors[0]
+        return
+
+    for pkg in pkgs:
+        action(pkg)
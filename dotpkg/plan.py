@@ -0,0 +1,380 @@
+from dataclasses import dataclass, field, replace
+from itertools import zip_longest
+from pathlib import Path
+from typing import Any, Literal, Optional
+
+from dotpkg.error import InvalidPlanError
+from dotpkg.manifest.installs_v1 import InstallsV1Manifest
+from dotpkg.manifest.installs_v2 import InstallsV2Manifest
+from dotpkg.model import Dotpkg, LinkCandidate
+from dotpkg.options import Options
+from dotpkg.resolve import compile_ignores, find_link_candidates, find_target_dir, package_renamer
+from dotpkg.state import State, install_manifest_path
+from dotpkg.sync import manifest_digest
+from dotpkg.utils.log import note, warn
+from dotpkg.utils.prompt import confirm, prompt
+
+import stat
+
+# Plans
+
+OperationKind = Literal['mkdir', 'touch', 'link', 'copy', 'move', 'remove', 'script']
+
+@dataclass
+class Operation:
+    '''A single file system operation or script invocation.'''
+
+    kind: OperationKind
+    path: Path
+    '''The path operated on (the destination for links, copies and moves, the working directory for scripts).'''
+
+    src: Optional[Path] = None
+    '''The source path for links, copies and moves.'''
+
+    script: Optional[str] = None
+    '''The name of the script (e.g. 'preinstall').'''
+
+    command: Optional[str] = None
+    '''The shell command of the script.'''
+
+    @classmethod
+    def from_dict(cls, d: dict[str, Any]):
+        return cls(
+            kind=d['kind'],
+            path=Path(d['path']),
+            src=Path(d['src']) if d.get('src') else None,
+            script=d.get('script') or None,
+            command=d.get('command') or None,
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        d: dict[str, Any] = {'kind': self.kind, 'path': str(self.path)}
+        if self.src:
+            d['src'] = str(self.src)
+        if self.script:
+            d['script'] = self.script
+        if self.command:
+            d['command'] = self.command
+        return d
+
+@dataclass
+class PackagePlan:
+    '''The operations for (un)installing a package and the resulting install manifest update.'''
+
+    action: Literal['install', 'uninstall']
+    path: Path
+    '''The path of the dotpkg (which is also its key in the install manifest).'''
+
+    name: str
+    operations: list[Operation] = field(default_factory=list)
+
+    target_dir: Optional[Path] = None
+    src_paths: list[Path] = field(default_factory=list)
+    paths: list[Path] = field(default_factory=list)
+    checksums: list[Optional[str]] = field(default_factory=list)
+    '''The digests of the installed paths, if already known at planning time.'''
+
+    manifest_digest: Optional[str] = None
+    requires: Optional[str] = None
+
+    @property
+    def removed_paths(self) -> set[Path]:
+        return {op.path for op in self.operations if op.kind == 'remove'}
+
+    def add_script(self, name: str, pkg: Dotpkg):
+        command = getattr(pkg.manifest.scripts, name)
+        if command:
+            self.operations.append(Operation('script', pkg.path, script=name, command=command))
+
+    def record(self, src_path: Path, target_path: Path, checksum: Optional[str] = None):
+        self.src_paths.append(src_path)
+        self.paths.append(target_path)
+        self.checksums.append(checksum)
+
+    def applied(self, performed: list[Operation]) -> 'PackagePlan':
+        '''Restricts the plan to the given performed operations (e.g. of a failed run) and the paths they installed.'''
+        planned = {op.path for op in self.operations if op.kind in ('link', 'copy')}
+        installed = {op.path for op in performed if op.kind in ('link', 'copy')}
+        # Paths without an operation were already installed at planning time
+        kept = [i for i, path in enumerate(self.paths) if path not in planned or path in installed]
+        return replace(
+            self,
+            operations=[op for op in self.operations if op in performed],
+            src_paths=[self.src_paths[i] for i in kept],
+            paths=[self.paths[i] for i in kept],
+            checksums=[self.checksums[i] for i in kept],
+        )
+
+    @classmethod
+    def from_dict(cls, d: dict[str, Any]):
+        return cls(
+            action=d['action'],
+            path=Path(d['path']),
+            name=d['name'],
+            operations=[Operation.from_dict(op) for op in (d.get('operations') or [])],
+            target_dir=Path(d['targetDir']) if d.get('targetDir') else None,
+            src_paths=[Path(p) for p in (d.get('srcPaths') or [])],
+            paths=[Path(p) for p in (d.get('paths') or [])],
+            checksums=[c for c in (d.get('checksums') or [])],
+            manifest_digest=d.get('manifestDigest') or None,
+            requires=d.get('requires') or None,
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'action': self.action,
+            'path': str(self.path),
+            'name': self.name,
+            'operations': [op.to_dict() for op in self.operations],
+            'targetDir': str(self.target_dir) if self.target_dir else None,
+            'srcPaths': [str(p) for p in self.src_paths],
+            'paths': [str(p) for p in self.paths],
+            'checksums': self.checksums,
+            'manifestDigest': self.manifest_digest,
+            'requires': self.requires,
+        }
+
+@dataclass
+class Plan:
+    '''A serializable plan for (un)installing a set of packages.'''
+
+    VERSION = 1
+
+    packages: list[PackagePlan] = field(default_factory=list)
+
+    @classmethod
+    def from_dict(cls, d: dict[str, Any]):
+        version = d.get('version')
+        if version != cls.VERSION:
+            raise InvalidPlanError(f'Unsupported plan version {version}')
+        return cls(packages=[PackagePlan.from_dict(p) for p in (d.get('packages') or [])])
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'version': self.VERSION,
+            'packages': [p.to_dict() for p in self.packages],
+        }
+
+# Planning
+
+def confirm_uninstall_first(pkg: Dotpkg, opts: Options, state: State) -> bool:
+    '''Asks whether an already installed package should be uninstalled before reinstalling it.'''
+
+    install_key = str(pkg.path)
+    existing_install = state.installs.get(install_key)
+    if not existing_install:
+        return False
+
+    target_dir = find_target_dir(pkg.manifest, opts)
+    existing_paths = [Path(path) for path in existing_install.paths] if not isinstance(existing_install, InstallsV1Manifest.InstallsEntry) else []
+    existing_target_dir = Path(existing_install.target_dir or str(target_dir))
+
+    if confirm(f'The dotpkg {pkg.name} is already installed to {existing_target_dir} and currently targets {target_dir}. Should it be uninstalled first?', opts):
+        return True
+    elif target_dir.resolve() != existing_target_dir.resolve():
+        warn('\n'.join([
+            f'This will leave the installed files at the old target dir {existing_target_dir} orphaned, since the install for {install_key} in {install_manifest_path(opts)} will be repointed to {target_dir}. These files are affected:',
+            *[f'  {path}' for path in existing_paths],
+        ]))
+    return False
+
+def plan_install(pkg: Dotpkg, opts: Options, state: State, removed: Optional[set[Path]] = None, pre_scripts: bool = True) -> PackagePlan:
+    '''
+    Plans the installation of a package, prompting for how to resolve
+    conflicts. Paths in removed are treated as if they did not exist (e.g.
+    because they are removed by a previously planned uninstallation).
+    '''
+
+    target_dir = find_target_dir(pkg.manifest, opts)
+    plan = PackagePlan(
+        action='install',
+        path=pkg.path,
+        name=pkg.name,
+        target_dir=target_dir,
+        manifest_digest=manifest_digest(pkg.manifest),
+        requires=pkg.manifest.requires,
+    )
+
+    if pre_scripts:
+        plan.add_script('preinstall', pkg)
+
+    if not pkg.manifest.is_scripts_only:
+        plan.operations.append(Operation('mkdir', target_dir))
+
+        for rel_path in pkg.manifest.touch_files:
+            plan.operations.append(Operation('touch', target_dir / rel_path))
+
+        is_ignored = compile_ignores(pkg, opts)
+        renamer = package_renamer(pkg, opts)
+        should_copy = pkg.manifest.copy
+        plan_key = str(pkg.path)
+        install_kind: OperationKind = 'copy' if should_copy else 'link'
+
+        for candidate in find_link_candidates(pkg.path, target_dir, opts.fs, renamer):
+            src_path = candidate.src_path
+            target_path = candidate.target_path
+            # Links point to the resolved source
+            install_src = src_path if should_copy else (candidate.src_dest or opts.fs.resolve(src_path))
+
+            if is_ignored(src_path):
+                note(f'Ignoring {src_path}')
+                continue
+
+            if candidate.target_exists and not (removed and target_path in removed):
+                if should_copy:
+                    legacy_order = state.install_manifest.version <= 3
+                    target_digest = opts.fs.digest(target_path, legacy_order=legacy_order, cache=state.digests)
+                    # Directory digests include the name, which renames may change
+                    if target_digest == opts.fs.digest(src_path, legacy_order=legacy_order, cache=state.digests, name=target_path.name):
+                        note(f'Skipping {target_path} (target and src hashes match)')
+                        plan.record(src_path, target_path, target_digest)
+                        continue
+                else:
+                    if candidate.target_links_to_src(opts.fs):
+                        note(f'Skipping {target_path} (already linked)')
+                        plan.record(src_path, target_path)
+                        continue
+
+                choices = {
+                    'backup': [Operation('move', target_path.with_name(f'{target_path.name}.backup'), src=target_path)],
+                    'overwrite': [Operation('remove', target_path)],
+                    'skip': None,
+                    'theirs': [Operation('move', src_path, src=target_path)],
+                }
+
+                default_choice = 'backup'
+                owner = state.owner(target_path)
+
+                if owner and owner[0] != plan_key:
+                    # Don't take over another package's files unless asked to
+                    prompt_msg = f'{target_path} is installed by the dotpkg at {owner[0]}.'
+                    default_choice = 'skip'
+                elif should_copy:
+                    prompt_msg = f"{target_path} exists and is not a copy of the dotpkg's file."
+                else:
+                    # TODO: Add option to view the file e.g. with an editor if its a regular file
+                    #       and show non-dotpkg symlink destination otherwise.
+                    prompt_msg = f'{target_path} exists and is not a link into the dotpkg.'
+
+                response = prompt(prompt_msg, sorted(choices.keys()), default_choice, opts)
+                resolution = choices.get(response)
+
+                if resolution is None:
+                    note(f'Skipping {target_path}')
+                    continue
+
+                plan.operations += resolution
+
+            plan.operations.append(Operation(install_kind, target_path, src=install_src))
+            plan.record(src_path, target_path)
+
+    plan.add_script('install', pkg)
+    plan.add_script('postinstall', pkg)
+
+    return plan
+
+def plan_uninstall(pkg: Dotpkg, opts: Options, state: State, keep: Optional[set[Path]] = None, pre_scripts: bool = True) -> PackagePlan:
+    '''Plans the uninstallation of a package, except for the target paths in keep.'''
+
+    install_manifest = state.install_manifest
+    install_key = str(pkg.path)
+    install = state.installs.get(install_key)
+
+    plan = PackagePlan(
+        action='uninstall',
+        path=pkg.path,
+        name=pkg.name,
+        requires=pkg.manifest.requires,
+    )
+
+    if pre_scripts:
+        plan.add_script('preuninstall', pkg)
+        plan.add_script('uninstall', pkg)
+
+    if not pkg.manifest.is_scripts_only:
+        target_dir = Path(install.target_dir) if install and install.target_dir else find_target_dir(pkg.manifest, opts)
+        should_copy = pkg.manifest.copy
+
+        if install and not isinstance(install, InstallsV1Manifest.InstallsEntry):
+            paths = list(zip_longest(map(Path, install.src_paths), map(Path, install.paths)))
+        else:
+            paths = [(candidate.src_path, candidate.target_path) for candidate in find_link_candidates(pkg.path, target_dir, opts.fs)]
+
+        if install and not isinstance(install, InstallsV1Manifest.InstallsEntry) and not isinstance(install, InstallsV2Manifest.InstallsEntry):
+            checksums = install.checksums
+        else:
+            legacy_order = install_manifest.version <= 3
+            checksums = [opts.fs.digest(src_path, legacy_order=legacy_order, cache=state.digests, name=target_path.name if target_path else None) if src_path else None for src_path, target_path in paths]
+
+        for (src_path, target_path), checksum in zip_longest(paths, checksums):
+            if not target_path:
+                note(f'Skipping src path {src_path} (no target path)')
+                continue
+
+            if keep and target_path in keep:
+                note(f'Keeping {target_path} (unchanged)')
+                continue
+
+            # TODO: Instead of just skipping these paths (and uninstalling the package from the install manifest)
+            #       we should probably prompt the user (similar to the backup/overwrite options during installation)
+            #       for how to proceed.
+
+            target_stat = opts.fs.lstat(target_path)
+            target_is_symlink = target_stat is not None and stat.S_ISLNK(target_stat.st_mode)
+
+            if should_copy:
+                if not src_path:
+                    note(f'Skipping {target_path} (no src path in a copy-package)')
+                    continue
+
+                if target_is_symlink:
+                    note(f'Skipping {target_path} (is a symlink while the package is copy)')
+                    continue
+
+                if not checksum:
+                    warn(f'Skipping {target_path} (missing checksum)')
+                    continue
+
+                if not target_stat:
+                    warn(f'Skipping {target_path} (file does not exist)')
+                    continue
+
+                if install_manifest.version >= 4 or not stat.S_ISDIR(target_stat.st_mode):
+                    target_checksum = opts.fs.digest(target_path, cache=state.digests)
+
+                    if target_checksum != checksum:
+                        note(f'Skipping {target_path} (target checksum {target_checksum} != {checksum})')
+                        continue
+                else:
+                    warn(f'Ignoring checksum for {target_path} since the legacy directory hashes (which were generated in non-deterministic order) are unreliable, unfortunately.')
+            else:
+                if not target_is_symlink:
+                    note(f'Skipping {target_path} (not a symlink)')
+                    continue
+
+                if src_path and not LinkCandidate(src_path=src_path, target_path=target_path, target_stat=target_stat).target_links_to_src(opts.fs):
+                    target_dest = opts.fs.resolve(target_path)
+                    src_dest = opts.fs.resolve(src_path)
+                    note(f'Skipping {target_path} (target dest {target_dest} != src dest {src_dest}, probably not a link into the package)')
+                    continue
+
+            plan.operations.append(Operation('remove', target_path))
+
+    plan.add_script('postuninstall', pkg)
+
+    return plan
+
+def plan_packages(pkgs: list[Dotpkg], opts: Options, state: State) -> Plan:
+    '''Plans the installation of the given packages (uninstalling them first if requested).'''
+
+    plan = Plan()
+
+    for pkg in pkgs:
+        removed: set[Path] = set()
+        if confirm_uninstall_first(pkg, opts, state):
+            uninstall_plan = plan_uninstall(pkg, opts, state)
+            removed = uninstall_plan.removed_paths
+            plan.packages.append(uninstall_plan)
+        plan.packages.append(plan_install(pkg, opts, state, removed=removed))
+
+    return plan
@@ -0,0 +1,95 @@
+from pathlib import Path
+
+from dotpkg.discovery import discover_packages, discovery_index
+from dotpkg.options import Options
+from dotpkg.state import State, lock_state
+from dotpkg.status import check_status
+from dotpkg.utils.log import info, success, warn
+
+import json
+import os
+import sys
+
+# Read-only commands
+#
+# These are kept apart from the other commands, since they are run often
+# (e.g. from shell hooks) and thus should not import the install machinery.
+
+def owns_cmd(raw_paths: list[str], opts: Options):
+    if not raw_paths:
+        print('This command expects at least one path!')
+        sys.exit(1)
+
+    all_owned = True
+
+    with lock_state(opts, exclusive=False):
+        state = State(opts, read_only=True)
+
+        for raw_path in raw_paths:
+            # Only resolve the parent, since the path itself is usually a link into a package
+            path = Path(os.path.abspath(raw_path))
+            path = path.parent.resolve() / path.name
+
+            if owner := state.owner(path):
+                key, i = owner
+                entry = state.installs[key]
+                src_path = Path(entry.src_paths[i]) if i < len(entry.src_paths) else None
+                if src_path and Path(entry.paths[i]) != path:
+                    src_path = src_path / path.relative_to(entry.paths[i])
+                print(f"{path} is owned by {key}{f' (installed from {src_path})' if src_path else ''}")
+            else:
+                print(f'{path} is not owned by any dotpkg')
+                all_owned = False
+
+        state.save_caches()
+
+    if not all_owned:
+        sys.exit(1)
+
+def status_cmd(raw_dotpkg_paths: list[str], opts: Options):
+    keys = [str(Path(p).resolve()) for p in raw_dotpkg_paths] or None
+
+    with lock_state(opts, exclusive=False):
+        state = State(opts, read_only=True)
+        report = check_status(keys, opts, state)
+        # Keeps the digests of unchanged copies, thus speeding up the next run
+        state.save_caches()
+
+    drifted = report.drifted
+
+    if opts.json_output:
+        print(json.dumps(report.to_dict(), indent=2))
+    elif drifted:
+        for f in drifted:
+            warn(f"{f.kind.capitalize()}: {f.path} (from {f.package}{f', {f.detail}' if f.detail else ''})")
+        counts = ', '.join(f'{count} {kind}' for kind, count in sorted(report.counts().items()))
+        info(f'{len(drifted)} of {len(report.files)} installed file(s) drifted ({counts})')
+    else:
+        success(f'All {len(report.files)} installed file(s) are in sync')
+
+    if drifted:
+        sys.exit(1)
+
+def list_cmd(prefixes: list[str], opts: Options):
+    # Doesn't load the state, since this is used for shell completion
+    cwd = opts.cwd.resolve()
+    index = discovery_index(opts)
+
+    with lock_state(opts, exclusive=False):
+        paths = discover_packages(cwd, opts, index)
+        if opts.update_install_manifest and opts.fs.persistent:
+            index.save()
+
+    # Prefixes let shells complete package paths
+    rel_paths = [
+        rel_path
+        for path in paths
+        for rel_path in [os.path.relpath(path, cwd)]
+        if not prefixes or any(rel_path.startswith(prefix) for prefix in prefixes)
+    ]
+
+    if opts.json_output:
+        print(json.dumps(rel_paths))
+    else:
+        for rel_path in rel_paths:
+            print(rel_path)
@@ -1,68 +1,180 @@
+from functools import lru_cache
 from pathlib import Path
 from typing import Callable, Iterable, Optional
 
 from dotpkg.constants import IGNORED_NAMES
 from dotpkg.error import NoTargetDirError
 from dotpkg.manifest.dotpkg import DotpkgManifest
-from dotpkg.model import Dotpkg
+from dotpkg.model import Dotpkg, LinkCandidate
 from dotpkg.options import Options
+from dotpkg.utils.executables import ExecutableIndex
+from dotpkg.utils.fs import FileSystem
+from dotpkg.utils.glob import GlobPattern
+from dotpkg.utils.profiler import profiled
 
+import getpass
+import os
 import platform
-import shutil
+import re
 import socket
+import stat
 
 # Manifest resolution
 
-def find_link_candidates(src_dir: Path, target_dir: Path, renamer: Callable[[str], str] = lambda name: name) -> Iterable[tuple[Path, Path]]:
-    for src_path in sorted(src_dir.iterdir()):
-        name = renamer(src_path.name)
+@profiled('find_link_candidates')
+def find_link_candidates(src_dir: Path, target_dir: Path, fs: FileSystem, renamer: Callable[[str], str] = lambda name: name, installed: Optional[set[Path]] = None) -> list[LinkCandidate]:
+    '''
+    Pairs the package's files with their target paths, descending into
+    existing target directories, except for the installed target paths
+    (e.g. directories copied by a previous installation of the package).
+    '''
+    # Collected eagerly, so the (profiled) time is spent here rather than by the consumer
+    candidates: list[LinkCandidate] = []
+    collect_link_candidates(src_dir, fs.resolve(src_dir), target_dir, renamer, fs, installed or set(), candidates)
+    return candidates
+
+def collect_link_candidates(src_dir: Path, src_dest_dir: Path, target_dir: Path, renamer: Callable[[str], str], fs: FileSystem, installed: set[Path], candidates: list[LinkCandidate]):
+    for src_name, src_stat in sorted(fs.scandir(src_dir), key=lambda entry: entry[0]):
+        name = renamer(src_name)
+        if name in IGNORED_NAMES:
+            continue
+
+        src_path = src_dir / src_name
+        # Only symlinks have to be resolved, everything else lives in the resolved dir
+        src_is_symlink = stat.S_ISLNK(src_stat.st_mode)
+        src_dest = fs.resolve(src_path) if src_is_symlink else src_dest_dir / src_name
         target_path = target_dir / name
-
-        if name not in IGNORED_NAMES:
-            # We only descend into existing directories that are not Git repos
-            if target_path.exists() and not target_path.is_symlink() and target_path.is_dir() and not (target_path / '.git').exists():
-                yield from find_link_candidates(src_path, target_path)
-            else:
-                yield src_path, target_path
-
-def manifest_vars(opts: Options):
-    return {
-        '${home}': str(opts.home.resolve()),
-        '${hostname}': socket.gethostname()
-    }
+        target_stat = fs.lstat(target_path)
+
+        # We only descend into existing directories that are not Git repos
+        if (
+            target_stat and stat.S_ISDIR(target_stat.st_mode)
+            and target_path not in installed
+            and (stat.S_ISDIR(src_stat.st_mode) or (src_is_symlink and fs.is_dir(src_dest)))
+            and not fs.exists(target_path / '.git')
+        ):
+            collect_link_candidates(src_path, src_dest, target_path, lambda name: name, fs, installed, candidates)
+        else:
+            candidates.append(LinkCandidate(src_path=src_path, target_path=target_path, target_stat=target_stat, src_stat=src_stat, src_dest=src_dest))
+
+class ManifestVars:
+    '''
+    The variables that can be referenced as '${name}' in manifest strings.
+    Each variable is only computed when first referenced and resolved strings
+    are memoized, so this should be created once and shared for a run.
+    '''
+
+    VAR_PATTERN = re.compile(r'\$\{(\w+)\}')
+
+    def __init__(self, home: Path):
+        self.providers: dict[str, Callable[[], str]] = {
+            'home': lambda: str(home.resolve()),
+            'hostname': socket.gethostname,
+            'user': getpass.getuser,
+            'platform': lambda: platform.system().lower(),
+            'xdg_config': lambda: os.environ.get('XDG_CONFIG_HOME') or str(home.resolve() / '.config'),
+        }
+        self.values: dict[str, Optional[str]] = {}
+        self.resolved: dict[str, str] = {}
+
+    def get(self, name: str) -> Optional[str]:
+        if name not in self.values:
+            provider = self.providers.get(name)
+            try:
+                self.values[name] = provider() if provider else None
+            except (OSError, KeyError):
+                # E.g. if the user cannot be determined
+                self.values[name] = None
+        return self.values[name]
+
+    def resolve(self, s: str) -> str:
+        resolved = self.resolved.get(s)
+        if resolved is None:
+            # Unknown variables are left as-is
+            resolved = self.VAR_PATTERN.sub(lambda m: self.get(m[1]) or m[0], s) if '${' in s else s
+            self.resolved[s] = resolved
+        return resolved
+
+@lru_cache(maxsize=None)
+def home_manifest_vars(home: Path) -> ManifestVars:
+    return ManifestVars(home)
+
+def manifest_vars(opts: Options) -> ManifestVars:
+    return home_manifest_vars(opts.home)
 
 def resolve_manifest_str(s: str, opts: Options) -> str:
-    resolved = s
-    for key, value in manifest_vars(opts).items():
-        resolved = resolved.replace(key, value)
-    return resolved
+    return manifest_vars(opts).resolve(s)
+
+def compile_ignores(pkg: Dotpkg, opts: Options) -> Callable[[Path], bool]:
+    '''
+    Compiles the package's ignore rules (host-specific and ignored files) into
+    a predicate on paths within the package. In contrast to globbing each
+    pattern, this lets us check the candidates while walking the package once.
+    '''
 
-def resolve_ignores(pkg: Dotpkg, opts: Options) -> set[Path]:
     host_specific_patterns = pkg.manifest.host_specific_files
     host_specific_includes = {
         pkg.path / resolve_manifest_str(p, opts)
         for p in host_specific_patterns
     }
-    host_specific_ignores = {
-        i
-        for p in host_specific_patterns
-        for i in pkg.path.glob(p.replace('${hostname}', '*'))
-        if i not in host_specific_includes and not i.name.endswith('.private')
-    }
-    custom_ignores = {
-        i
-        for p in pkg.manifest.ignored_files
-        for i in pkg.path.glob(p)
-    }
-    ignores = host_specific_ignores.union(custom_ignores)
-    return ignores
+    host_specific_globs = [GlobPattern(p.replace('${hostname}', '*')) for p in host_specific_patterns]
+    custom_globs = [GlobPattern(p) for p in pkg.manifest.ignored_files]
+
+    if not host_specific_globs and not custom_globs:
+        return lambda path: False
+
+    def is_ignored(path: Path) -> bool:
+        try:
+            parts = path.relative_to(pkg.path).parts
+        except ValueError:
+            return False
+
+        def is_dir() -> bool:
+            return opts.fs.is_dir(path)
+
+        if any(g.matches(parts, is_dir) for g in custom_globs):
+            return True
+
+        return (
+            path not in host_specific_includes
+            and not path.name.endswith('.private')
+            and any(g.matches(parts, is_dir) for g in host_specific_globs)
+        )
+
+    return is_ignored
+
+def package_renamer(pkg: Dotpkg, opts: Options) -> Callable[[str], str]:
+    # Resolve the rules once up front (dropping no-ops)
+    rules = [
+        (pat, s)
+        for raw_pat, raw_s in pkg.manifest.renames.items()
+        for pat, s in [(resolve_manifest_str(raw_pat, opts), resolve_manifest_str(raw_s, opts))]
+        if pat != s
+    ]
+
+    if not rules:
+        return lambda name: name
+
+    # Most names do not match any pattern, which a single regex lets us detect
+    # in one pass. Since the rules are applied in order and each may affect
+    # the next, we still apply them one by one to the (rare) matching names.
+    matcher = re.compile('|'.join(re.escape(pat) for pat, _ in rules))
+
+    def renamer(name: str) -> str:
+        if not matcher.search(name):
+            return name
+        for pat, s in rules:
+            name = name.replace(pat, s)
+        return name
+
+    return renamer
 
 def find_target_dir(manifest: DotpkgManifest, opts: Options) -> Path:
     raw_dirs = manifest.target_dir
     dir_paths = [Path(resolve_manifest_str(raw_dir, opts)) for raw_dir in raw_dirs]
 
     for path in dir_paths:
-        if path.is_dir() and path.exists():
+        if opts.fs.is_dir(path):
             return path
 
     if manifest.create_target_dir_if_needed and dir_paths:
@@ -71,21 +183,27 @@ def find_target_dir(manifest: DotpkgManifest, opts: Options) -> Path:
 
     raise NoTargetDirError(f'No suitable targetDir found in {raw_dirs}!')
 
-def unsatisfied_path_requirements(manifest: DotpkgManifest) -> Iterable[str]:
+@lru_cache(maxsize=None)
+def path_executables(path: Optional[str]) -> ExecutableIndex:
+    return ExecutableIndex(path)
+
+def unsatisfied_path_requirements(manifest: DotpkgManifest, executables: Optional[ExecutableIndex] = None) -> Iterable[str]:
+    if executables is None:
+        executables = path_executables(os.environ.get('PATH'))
     for requirement in manifest.requires_on_path:
-        if not shutil.which(requirement):
+        if requirement not in executables:
             yield requirement
 
-def batch_skip_reason(manifest: DotpkgManifest, opts: Options) -> Optional[str]:
+def batch_skip_reason(manifest: DotpkgManifest, opts: Options, executables: Optional[ExecutableIndex] = None) -> Optional[str]:
     if manifest.skip_during_batch_install:
         return f'Batch-install'
 
-    our_platform = platform.system().lower()
+    our_platform = manifest_vars(opts).get('platform') or ''
     supported_platforms: set[str] = set(manifest.platforms)
     if supported_platforms and (our_platform not in supported_platforms):
         return f"Platform {our_platform} is not supported, supported {'is' if len(supported_platforms) == 1 else 'are'} {', '.join(sorted(supported_platforms))}"
 
-    unsatisfied_reqs = list(unsatisfied_path_requirements(manifest))
+    unsatisfied_reqs = list(unsatisfied_path_requirements(manifest, executables))
     if unsatisfied_reqs:
         return f"Could not find {', '.join(unsatisfied_reqs)} on PATH"
 
@@ -0,0 +1,108 @@
+from pathlib import Path
+from typing import Optional
+
+from dotpkg.error import ScriptTimeoutError
+from dotpkg.model import package_label
+from dotpkg.options import Options
+from dotpkg.timings import ScriptOutcome, ScriptTime, ScriptTimes
+from dotpkg.utils.log import is_output_buffered, warn
+from dotpkg.utils.profiler import span
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+# Lifecycle scripts
+
+def kill_script(process: subprocess.Popen[str], group: bool):
+    '''Kills the script along with any processes it spawned (if running in its own process group).'''
+    try:
+        if group and os.name == 'posix':
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+
+def run_script_command(name: str, script: str, cwd: Path, opts: Options, times: Optional[ScriptTimes] = None):
+    '''
+    Runs a script of the package at cwd, killing it if it takes longer than
+    the script timeout. Scripts run serially have the terminal to themselves
+    (e.g. for password prompts), whereas the output of concurrently running
+    scripts is captured and prefixed with the package and script name, so
+    they can be told apart.
+    '''
+
+    description = f"'{name}' ('{script}')"
+    if opts.safe_mode:
+        warn(f"Skipping script {description} in safe mode")
+        return
+
+    print(f"Running script {description}...")
+    if opts.dry_run:
+        return
+
+    package = package_label(cwd, opts.cwd)
+    with span('run_script', package=package, detail=name):
+        run_process(name, description, script, cwd, package, opts, times)
+
+def run_process(name: str, description: str, script: str, cwd: Path, package: str, opts: Options, times: Optional[ScriptTimes]):
+    prefix = f'[{package}:{name}]'
+    timed_out = threading.Event()
+    outcome: ScriptOutcome = 'failed'
+    start = time.perf_counter()
+
+    # Concurrently running scripts cannot share the terminal, hence we only
+    # capture their output (and give them no input) if ours is buffered. Such
+    # scripts also run in their own session, which lets us kill everything
+    # they spawned. Otherwise the script inherits our terminal (including its
+    # controlling tty, which e.g. sudo needs) and receives Ctrl+C like we do.
+    captured = is_output_buffered()
+    if not captured:
+        # Our own output must not end up after the script's
+        sys.stdout.flush()
+    process = subprocess.Popen(
+        script,
+        shell=True,
+        cwd=cwd,
+        stdin=subprocess.DEVNULL if captured else None,
+        stdout=subprocess.PIPE if captured else None,
+        stderr=subprocess.STDOUT if captured else None,
+        text=True,
+        errors='replace',
+        start_new_session=captured and os.name == 'posix',
+    )
+
+    def on_timeout():
+        timed_out.set()
+        kill_script(process, group=captured)
+
+    timer = threading.Timer(opts.script_timeout, on_timeout) if opts.script_timeout is not None else None
+
+    with process:
+        try:
+            if timer:
+                timer.start()
+            if process.stdout:
+                for line in process.stdout:
+                    print(f'{prefix} {line}', end='' if line.endswith('\n') else '\n')
+            returncode = process.wait()
+
+            if timed_out.is_set():
+                outcome = 'timeout'
+                raise ScriptTimeoutError(f'Script {description} of {package} timed out after {opts.script_timeout} s')
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, script)
+            outcome = 'ok'
+        except BaseException:
+            # E.g. on Ctrl+C, which does not reach a script in its own session
+            kill_script(process, group=captured)
+            raise
+        finally:
+            if timer:
+                timer.cancel()
+            if times is not None:
+                times.record(ScriptTime(package=package, name=name, seconds=time.perf_counter() - start, outcome=outcome))
@@ -0,0 +1,317 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator, Optional, cast
+
+from dotpkg.compact import read_compact_manifest, write_compact_manifest
+from dotpkg.constants import DIGEST_CACHE_CAPACITY, DIGEST_CACHE_NAME, EXECUTABLE_CACHE_CAPACITY, EXECUTABLE_CACHE_NAME, INSTALL_JOURNAL_NAME, INSTALL_MANIFEST_NAME, MANIFEST_CACHE_CAPACITY, MANIFEST_CACHE_NAME, OWNER_INDEX_NAME, STATE_LOCK_NAME, SYNC_DIGESTS_CAPACITY, SYNC_DIGESTS_NAME
+from dotpkg.error import InvalidManifestError
+from dotpkg.discovery import discovery_index
+from dotpkg.manifest.alias import CurrentInstallsManifest
+from dotpkg.manifest.installs import InstallsManifest
+from dotpkg.manifest.installs_v1 import InstallsV1Manifest
+from dotpkg.manifest.installs_v2 import InstallsV2Manifest
+from dotpkg.manifest.installs_v3 import InstallsV3Manifest
+from dotpkg.manifest.installs_v4 import InstallsV4Manifest
+from dotpkg.manifest.installs_v5 import InstallsV5Manifest
+from dotpkg.options import Options
+from dotpkg.owners import OwnerIndex, manifest_fingerprint, owner_candidates
+from dotpkg.timings import ScriptTimes
+from dotpkg.utils.cache import PersistentCache
+from dotpkg.utils.executables import ExecutableCache, ExecutableIndex
+from dotpkg.utils.lock import LockStats, file_lock
+from dotpkg.utils.log import note, warn
+from dotpkg.utils.profiler import profiled
+
+import json
+import threading
+
+# Install manifest
+
+def install_manifest_path(opts: Options) -> Path:
+    return opts.state_dir / INSTALL_MANIFEST_NAME
+
+@profiled('read_install_manifest')
+def read_install_manifest(opts: Options) -> InstallsManifest:
+    try:
+        path = install_manifest_path(opts)
+        data = opts.fs.read_bytes(path)
+        if compact_manifest := read_compact_manifest(data):
+            return compact_manifest
+        raw_manifest = json.loads(data)
+        version = raw_manifest.get('version', 0)
+        if version == 1: return InstallsV1Manifest.from_dict(raw_manifest)
+        elif version == 2: return InstallsV2Manifest.from_dict(raw_manifest)
+        elif version == 3: return InstallsV3Manifest.from_dict(raw_manifest)
+        elif version == 4: return InstallsV4Manifest.from_dict(raw_manifest)
+        elif version == 5: return InstallsV5Manifest.from_dict(raw_manifest)
+        else: raise InvalidManifestError(f'Invalid manifest version {version}')
+    except FileNotFoundError:
+        return CurrentInstallsManifest()
+
+@profiled('write_install_manifest')
+def write_install_manifest(manifest: InstallsManifest, opts: Options):
+    path = install_manifest_path(opts)
+    if opts.fs.exists(path):
+        note(f'Updating {path}')
+    else:
+        print(f'Creating {path}')
+    if manifest.version == 5:
+        opts.fs.write_text(path, write_compact_manifest(manifest))
+    else:
+        opts.fs.write_text(path, json.dumps(manifest.to_dict(), indent=2))
+
+# Journal
+#
+# Changes to the install manifest are appended to a journal (one JSON record
+# per line) as soon as a package is done, while the manifest itself is only
+# rewritten (atomically) once at the end of a run, after which the journal is
+# removed. If a run is interrupted before that, the next run replays the
+# journal, thus recovering the progress.
+
+INSTALL_ENTRY_TYPES: dict[int, Any] = {
+    1: InstallsV1Manifest.InstallsEntry,
+    2: InstallsV2Manifest.InstallsEntry,
+    3: InstallsV3Manifest.InstallsEntry,
+    4: InstallsV4Manifest.InstallsEntry,
+    5: InstallsV5Manifest.InstallsEntry,
+}
+
+def install_journal_path(opts: Options) -> Path:
+    return opts.state_dir / INSTALL_JOURNAL_NAME
+
+def append_install_journal(version: int, key: str, entry: Optional[Any], opts: Options):
+    '''Records that the install for the key was set to the entry (or removed if None).'''
+    path = install_journal_path(opts)
+    record: dict[str, Any] = {'version': version, 'key': key}
+    if entry is not None:
+        record['entry'] = entry.to_dict()
+    opts.fs.mkdir(path.parent)
+    opts.fs.append_text(path, json.dumps(record, separators=(',', ':')) + '\n')
+
+def replay_install_journal(manifest: InstallsManifest, opts: Options) -> int:
+    '''Applies the journaled changes to the manifest and returns how many there were.'''
+    try:
+        data = opts.fs.read_text(install_journal_path(opts))
+    except FileNotFoundError:
+        return 0
+
+    installs = cast(dict[str, Any], manifest.installs)
+    replayed = 0
+
+    for line in data.splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # The last record may be truncated if we were killed while appending
+            warn('Ignoring truncated record in install journal')
+            continue
+        if record.get('version') != manifest.version:
+            warn(f"Ignoring journaled change to {record.get('key')} for install manifest version {record.get('version')}")
+            continue
+        key = record['key']
+        if 'entry' in record:
+            installs[key] = INSTALL_ENTRY_TYPES[manifest.version].from_dict(record['entry'])
+        else:
+            installs.pop(key, None)
+        replayed += 1
+
+    return replayed
+
+def clear_install_journal(opts: Options):
+    path = install_journal_path(opts)
+    if opts.fs.lstat(path) is not None:
+        opts.fs.remove(path)
+
+# Owner index
+
+def owner_index_path(opts: Options) -> Path:
+    return opts.state_dir / OWNER_INDEX_NAME
+
+def read_owner_index(opts: Options) -> Optional[OwnerIndex]:
+    '''Reads the persisted owner index, if it is up to date with the install manifest.'''
+    try:
+        data = opts.fs.read_bytes(owner_index_path(opts))
+    except OSError:
+        return None
+    return OwnerIndex.parse(data, manifest_fingerprint(opts.fs.lstat(install_manifest_path(opts))))
+
+def write_owner_index(index: OwnerIndex, opts: Options):
+    fingerprint = manifest_fingerprint(opts.fs.lstat(install_manifest_path(opts)))
+    try:
+        opts.fs.write_text(owner_index_path(opts), index.serialize(fingerprint))
+        index.dirty = False
+    except OSError:
+        # The index can always be rebuilt from the manifest
+        pass
+
+# Locking
+
+# Waits shorter than this are not worth mentioning
+LOCK_WAIT_NOTE_THRESHOLD = 0.5
+
+def state_lock_path(opts: Options) -> Path:
+    return opts.state_dir / STATE_LOCK_NAME
+
+@contextmanager
+def lock_state(opts: Options, exclusive: bool = True) -> Iterator[LockStats]:
+    '''
+    Holds an advisory lock on the state dir, so that simultaneous dotpkg runs
+    don't interleave their changes. Runs that only read the state (including
+    dry runs) share the lock, whereas mutating runs hold it exclusively.
+    '''
+
+    # Only runs that persist their changes need to exclude others and may
+    # create the state dir for the lock (which we don't want to do otherwise).
+    # The lock itself lives on the file system shared with other processes
+    # (if any), i.e. beneath the overlay of dry runs.
+    exclusive = exclusive and opts.fs.persistent
+    disk = opts.fs.disk
+    if exclusive and opts.update_install_manifest:
+        opts.fs.mkdir(opts.state_dir)
+    elif disk is None or not disk.is_dir(opts.state_dir):
+        yield LockStats()
+        return
+
+    with file_lock(state_lock_path(opts), exclusive=exclusive, timeout=opts.lock_timeout) as stats:
+        if stats.wait_time >= LOCK_WAIT_NOTE_THRESHOLD:
+            note(f'Waited {stats.wait_time:.1f} s for another dotpkg run to release the state')
+        yield stats
+
+# State
+
+class State:
+    '''
+    The persistent state of dotpkg (i.e. the install manifest and caches),
+    loaded once and written back once for a whole run, regardless of how many
+    packages are (un)installed. Changes to the install manifest are journaled
+    in between.
+    '''
+
+    def __init__(self, opts: Options, lock_stats: Optional[LockStats] = None, read_only: bool = False):
+        self.opts = opts
+        # How long we had to wait for other runs, to measure contention
+        self.lock_stats = lock_stats or LockStats()
+        # Read-only runs (holding the lock shared) never commit the state
+        self.read_only = read_only
+        self.install_manifest = read_install_manifest(opts)
+        self.dirty = False
+        if read_only:
+            # Reflect an interrupted run in memory, leaving its recovery to
+            # the next run that commits (thus also keeping the journal)
+            self.dirty = replay_install_journal(self.install_manifest, opts) > 0
+        elif opts.update_install_manifest and (replayed := replay_install_journal(self.install_manifest, opts)):
+            note(f'Recovered {replayed} change(s) to the install manifest from an interrupted run')
+            self.dirty = True
+        # A replayed journal changed the manifest, thus invalidating the persisted owner index
+        self.recovered = self.dirty
+        # Loaded lazily, since most runs only need it for a few lookups (or
+        # to update it incrementally, if persisted)
+        self._owner_index: Optional[OwnerIndex] = None
+        self._owner_index_read = False
+        self.digests = PersistentCache[str](opts.state_dir / DIGEST_CACHE_NAME, capacity=DIGEST_CACHE_CAPACITY)
+        # The digests of the dotpkg manifests as of their last installation,
+        # used by sync to detect changes (losing these only forces a resync)
+        self.synced_manifests = PersistentCache[str](opts.state_dir / SYNC_DIGESTS_NAME, capacity=SYNC_DIGESTS_CAPACITY)
+        # The raw dotpkg manifests, keyed by path and validated by their file's signature
+        self.manifests = PersistentCache[Any](opts.state_dir / MANIFEST_CACHE_NAME, capacity=MANIFEST_CACHE_CAPACITY)
+        self.discovery = discovery_index(opts)
+        # The executables on PATH (for requiresOnPath), listed once per run
+        # and cached per directory, validated by the directory's mtime
+        self.executables = ExecutableIndex(cache=ExecutableCache(opts.state_dir / EXECUTABLE_CACHE_NAME, capacity=EXECUTABLE_CACHE_CAPACITY))
+        # Guards mutations, since packages may be (un)installed in parallel
+        self.lock = threading.Lock()
+        self.script_times = ScriptTimes()
+
+    @property
+    def installs(self) -> dict[str, Any]:
+        return self.install_manifest.installs
+
+    def load_owner_index(self, build: bool) -> Optional[OwnerIndex]:
+        '''Loads the persisted owner index, building it from the manifest if needed and requested. Requires holding the lock.'''
+        if self._owner_index is None and not self._owner_index_read:
+            self._owner_index_read = True
+            if not self.recovered:
+                self._owner_index = read_owner_index(self.opts)
+        if self._owner_index is None and build:
+            self._owner_index = OwnerIndex.build(self.installs)
+        return self._owner_index
+
+    @property
+    def owner_index(self) -> OwnerIndex:
+        with self.lock:
+            return cast(OwnerIndex, self.load_owner_index(build=True))
+
+    def owner(self, path: Path) -> Optional[tuple[str, int]]:
+        '''Looks up the install key owning the path (or an ancestor of it) and its position in the install.'''
+        index = self.owner_index
+        for candidate in owner_candidates(path):
+            if owner := index.owner(candidate):
+                return owner
+        return None
+
+    def set_install(self, key: str, entry: Any):
+        # The type checker cannot verify that this is the same manifest type. We
+        # might be able to model that with "generics", i.e. type variables but
+        # that would probably require splitting out the majority of install()
+        # into a new function.
+        installs = cast(dict[str, Any], self.install_manifest.installs)
+        with self.lock:
+            # A persisted index is kept up to date, otherwise the next lookup builds it
+            if (owner_index := self.load_owner_index(build=False)) is not None:
+                if old_entry := installs.get(key):
+                    owner_index.remove(key, old_entry)
+                owner_index.add(key, entry)
+            installs[key] = entry
+            self.dirty = True
+            self.journal(key, entry)
+
+    def remove_install(self, key: str):
+        with self.lock:
+            if key in self.install_manifest.installs:
+                if (owner_index := self.load_owner_index(build=False)) is not None:
+                    owner_index.remove(key, self.install_manifest.installs[key])
+                del self.install_manifest.installs[key]
+                self.dirty = True
+                self.journal(key, None)
+
+    def journal(self, key: str, entry: Optional[Any]):
+        if self.opts.update_install_manifest and not self.read_only:
+            append_install_journal(self.install_manifest.version, key, entry, self.opts)
+
+    def commit(self):
+        if self.dirty and self.opts.update_install_manifest and not self.read_only:
+            write_install_manifest(self.install_manifest, self.opts)
+            # Only now that the manifest has been replaced, the journal is obsolete
+            clear_install_journal(self.opts)
+            self.dirty = False
+        self.save_caches()
+
+    def save_caches(self):
+        '''Saves the caches, which (being atomically replaced) is also safe during read-only runs.'''
+        # Caches live in the state dir too, so we leave them alone if the
+        # user opted out of updating the state (or it is not persisted anyway)
+        if self.opts.update_install_manifest and self.opts.fs.persistent:
+            self.digests.save()
+            self.synced_manifests.save()
+            self.manifests.save()
+            self.discovery.save()
+            if self.executables.cache:
+                self.executables.cache.save()
+            # The index is only written if it was used or updated (and matches
+            # the manifest on disk), otherwise the next lookup rebuilds it
+            if self._owner_index is not None and self._owner_index.dirty and not self.dirty:
+                write_owner_index(self._owner_index, self.opts)
+
+@contextmanager
+def open_state(opts: Options, exclusive: bool = True) -> Iterator[State]:
+    '''
+    Locks and loads the state and commits it at the end, even if the run
+    fails midway. Runs that don't change the state should not be exclusive.
+    '''
+    with lock_state(opts, exclusive=exclusive) as lock_stats:
+        state = State(opts, lock_stats, read_only=not exclusive)
+        try:
+            yield state
+        finally:
+            state.commit()
+            state.script_times.display()
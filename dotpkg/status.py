@@ -0,0 +1,157 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Literal, Optional
+
+from dotpkg.error import MissingDotpkgManifestError
+from dotpkg.manifest.installs_v1 import InstallsV1Manifest
+from dotpkg.model import DotpkgRef, LinkCandidate
+from dotpkg.options import Options
+from dotpkg.state import State
+
+import os
+import stat
+
+# Drift detection
+
+# Only use a worker pool if there are enough files to amortize it
+PARALLEL_STATUS_MIN_FILES = 64
+PARALLEL_STATUS_WORKERS = min(8, os.cpu_count() or 1)
+
+FileStatusKind = Literal['ok', 'missing', 'modified', 'foreign', 'orphaned']
+
+@dataclass
+class FileStatus:
+    '''The status of an installed path compared to what the install manifest records.'''
+
+    kind: FileStatusKind
+    path: Path
+    package: str
+    '''The install key of the package owning the path.'''
+
+    detail: Optional[str] = None
+
+    def to_dict(self) -> dict[str, Any]:
+        d: dict[str, Any] = {'kind': self.kind, 'path': str(self.path), 'package': self.package}
+        if self.detail:
+            d['detail'] = self.detail
+        return d
+
+@dataclass
+class StatusReport:
+    VERSION = 1
+
+    files: list[FileStatus] = field(default_factory=list)
+
+    @property
+    def drifted(self) -> list[FileStatus]:
+        return [f for f in self.files if f.kind != 'ok']
+
+    def counts(self) -> dict[str, int]:
+        counts: dict[str, int] = {}
+        for f in self.files:
+            counts[f.kind] = counts.get(f.kind, 0) + 1
+        return counts
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            'version': self.VERSION,
+            'files': [f.to_dict() for f in self.files],
+            'counts': self.counts(),
+        }
+
+@dataclass
+class StatusCheck:
+    package: str
+    src_path: Optional[Path]
+    path: Path
+    checksum: Optional[str]
+    copy: Optional[bool]
+    '''Whether the package copies its files or None if the package is gone.'''
+
+def check_file(check: StatusCheck, legacy_order: bool, opts: Options, state: State) -> FileStatus:
+    '''Checks a single installed path, using metadata where possible and hashing only if needed.'''
+
+    def status(kind: FileStatusKind, detail: Optional[str] = None) -> FileStatus:
+        return FileStatus(kind, check.path, check.package, detail)
+
+    fs = opts.fs
+    src_path = check.src_path
+
+    if check.copy is None:
+        return status('orphaned', 'package no longer exists')
+    if not src_path or fs.lstat(src_path) is None:
+        return status('orphaned', 'source no longer exists')
+
+    target_stat = fs.lstat(check.path)
+    if target_stat is None:
+        return status('missing')
+    target_is_symlink = stat.S_ISLNK(target_stat.st_mode)
+
+    if check.copy:
+        if target_is_symlink:
+            return status('foreign', f'is a symlink to {fs.readlink(check.path)}')
+        if not check.checksum:
+            # Nothing to compare against (e.g. in legacy manifests)
+            return status('ok')
+        # The digest cache lets us skip hashing files whose metadata did not change
+        if fs.digest(check.path, legacy_order=legacy_order, cache=state.digests) != check.checksum:
+            return status('modified')
+        return status('ok')
+    else:
+        if not target_is_symlink:
+            return status('foreign', 'is not a symlink')
+        # Most links point directly to the recorded source, which saves us resolving both
+        if fs.readlink(check.path) == src_path:
+            return status('ok')
+        if LinkCandidate(src_path=src_path, target_path=check.path, target_stat=target_stat).target_links_to_src(fs):
+            return status('ok')
+        return status('foreign', f'links to {fs.readlink(check.path)}')
+
+def package_status_checks(key: str, entry: Any, state: State) -> list[StatusCheck]:
+    try:
+        copy: Optional[bool] = DotpkgRef(Path(key)).read(state.manifests, state.opts.fs).manifest.copy
+    except MissingDotpkgManifestError:
+        copy = None
+
+    src_paths = entry.src_paths
+    checksums = getattr(entry, 'checksums', None) or []
+
+    return [
+        StatusCheck(
+            package=key,
+            src_path=Path(src_paths[i]) if i < len(src_paths) else None,
+            path=Path(path),
+            checksum=checksums[i] if i < len(checksums) else None,
+            copy=copy,
+        )
+        for i, path in enumerate(entry.paths)
+    ]
+
+def check_status(keys: Optional[list[str]], opts: Options, state: State) -> StatusReport:
+    '''Compares the installed files of the given packages (or all) to the install manifest.'''
+
+    installs = state.installs
+    checks: list[StatusCheck] = []
+
+    for key in (installs.keys() if keys is None else keys):
+        entry = installs.get(key)
+        # The first manifest version did not record any paths
+        if entry is None or isinstance(entry, InstallsV1Manifest.InstallsEntry):
+            continue
+        checks += package_status_checks(key, entry, state)
+
+    legacy_order = state.install_manifest.version <= 3
+
+    def run(check: StatusCheck) -> FileStatus:
+        return check_file(check, legacy_order, opts, state)
+
+    if len(checks) >= PARALLEL_STATUS_MIN_FILES:
+        # Only imported when needed, since it is slow to import compared to
+        # checking a handful of files (and status should start quickly)
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=PARALLEL_STATUS_WORKERS) as executor:
+            files = list(executor.map(run, checks))
+    else:
+        files = [run(check) for check in checks]
+
+    return StatusReport(files=files)
@@ -0,0 +1,93 @@
+from pathlib import Path
+
+from dotpkg.error import DotpkgError
+from dotpkg.manifest.dotpkg import DotpkgManifest
+from dotpkg.manifest.installs_v1 import InstallsV1Manifest
+from dotpkg.manifest.installs_v2 import InstallsV2Manifest
+from dotpkg.model import Dotpkg
+from dotpkg.options import Options
+from dotpkg.resolve import compile_ignores, find_link_candidates, find_target_dir, package_renamer
+from dotpkg.state import State
+
+import hashlib
+import json
+import stat
+
+# Incremental sync
+
+def manifest_digest(manifest: DotpkgManifest) -> str:
+    return hashlib.sha256(json.dumps(manifest.to_dict(), sort_keys=True).encode('utf-8')).hexdigest()
+
+def unchanged_targets(pkg: Dotpkg, opts: Options, state: State) -> tuple[bool, set[Path]]:
+    '''
+    Compares the package's current plan (target dir, links/copies after
+    ignores and renames, manifest) to what is recorded in the install
+    manifest. Returns whether the package is entirely up to date, along with
+    the recorded target paths that are still planned and unchanged (and thus
+    need not be removed and reinstalled).
+    '''
+
+    install_key = str(pkg.path)
+    install = state.installs.get(install_key)
+
+    # Legacy entries do not record enough to compare against
+    if not install or isinstance(install, InstallsV1Manifest.InstallsEntry):
+        return False, set()
+    if pkg.manifest.copy and (isinstance(install, InstallsV2Manifest.InstallsEntry) or state.install_manifest.version <= 3):
+        return False, set()
+
+    up_to_date = not pkg.manifest.always_sync and state.synced_manifests.get(install_key) == manifest_digest(pkg.manifest)
+    unchanged: set[Path] = set()
+
+    if pkg.manifest.is_scripts_only:
+        return up_to_date, unchanged
+
+    try:
+        target_dir = find_target_dir(pkg.manifest, opts)
+    except DotpkgError:
+        return False, unchanged
+
+    if not install.target_dir or Path(install.target_dir) != target_dir:
+        return False, unchanged
+
+    if any(opts.fs.lstat(target_dir / rel_path) is None for rel_path in pkg.manifest.touch_files):
+        up_to_date = False
+
+    recorded = list(zip(install.src_paths, install.paths, getattr(install, 'checksums', None) or [None] * len(install.paths)))
+    recorded_checksums = {Path(target): checksum for _, target, checksum in recorded}
+
+    is_ignored = compile_ignores(pkg, opts)
+    planned = [
+        candidate
+        # Copied directories are compared as a whole, like they were recorded
+        for candidate in find_link_candidates(pkg.path, target_dir, opts.fs, package_renamer(pkg, opts), installed=set(recorded_checksums))
+        if not is_ignored(candidate.src_path)
+    ]
+
+    if [(Path(src), Path(target)) for src, target, _ in recorded] != [(c.src_path, c.target_path) for c in planned]:
+        up_to_date = False
+
+    for candidate in planned:
+        target_path = candidate.target_path
+        if target_path not in recorded_checksums:
+            continue
+
+        if pkg.manifest.copy:
+            checksum = recorded_checksums[target_path]
+            is_unchanged = (
+                candidate.target_stat is not None
+                and not stat.S_ISLNK(candidate.target_stat.st_mode)
+                and checksum is not None
+                and opts.fs.digest(target_path, cache=state.digests) == checksum
+                # Directory digests include the name, which renames may change
+                and opts.fs.digest(candidate.src_path, cache=state.digests, name=target_path.name) == checksum
+            )
+        else:
+            is_unchanged = candidate.target_links_to_src(opts.fs)
+
+        if is_unchanged:
+            unchanged.add(target_path)
+        else:
+            up_to_date = False
+
+    return up_to_date, unchanged
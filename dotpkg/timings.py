@@ -0,0 +1,42 @@
+from dataclasses import dataclass
+from typing import Literal
+
+from dotpkg.utils.log import note
+
+import threading
+
+# Script timings
+#
+# Kept apart from the script runner, so the state can collect timings
+# without importing subprocess (which read-only commands do not need).
+
+ScriptOutcome = Literal['ok', 'failed', 'timeout']
+
+@dataclass
+class ScriptTime:
+    package: str
+    name: str
+    seconds: float
+    outcome: ScriptOutcome
+
+class ScriptTimes:
+    '''Collects the wall times of the scripts run (possibly concurrently) during a run.'''
+
+    def __init__(self):
+        self.times: list[ScriptTime] = []
+        self.lock = threading.Lock()
+
+    def record(self, time: ScriptTime):
+        with self.lock:
+            self.times.append(time)
+
+    def display(self):
+        with self.lock:
+            times = sorted(self.times, key=lambda t: -t.seconds)
+        if not times:
+            return
+        note(f'Script times ({sum(t.seconds for t in times):.2f} s in total):')
+        width = max(len(f'{t.package}:{t.name}') for t in times)
+        for t in times:
+            outcome = '' if t.outcome == 'ok' else f' ({t.outcome})'
+            note(f"  {f'{t.package}:{t.name}'.ljust(width)} {t.seconds:8.2f} s{outcome}")
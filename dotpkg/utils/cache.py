@@ -0,0 +1,78 @@
+from collections import OrderedDict
+from pathlib import Path
+from typing import Generic, Optional, TypeVar
+
+from dotpkg.utils.file import write_atomically
+
+import json
+import threading
+
+V = TypeVar('V')
+
+class PersistentCache(Generic[V]):
+    '''
+    A least-recently-used cache of JSON-serializable values that is persisted
+    as a JSON file (usually in the state dir). The file is loaded lazily and a
+    missing or corrupt file is treated like an empty cache, since everything
+    in it can be recomputed.
+    '''
+
+    VERSION = 1
+
+    def __init__(self, path: Path, capacity: int):
+        self.path = path
+        self.capacity = capacity
+        self.dirty = False
+        self._entries: Optional[OrderedDict[str, V]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def entries(self) -> OrderedDict[str, V]:
+        if self._entries is None:
+            self._entries = OrderedDict()
+            try:
+                with open(self.path, 'r') as f:
+                    raw = json.load(f)
+                if raw.get('version') == self.VERSION:
+                    self._entries.update((key, value) for key, value in raw['entries'])
+            except (OSError, ValueError, KeyError, TypeError):
+                self._entries.clear()
+        return self._entries
+
+    def get(self, key: str) -> Optional[V]:
+        with self._lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: V):
+        with self._lock:
+            entries = self.entries
+            if entries.get(key) == value:
+                entries.move_to_end(key)
+                return
+            entries[key] = value
+            entries.move_to_end(key)
+            while len(entries) > self.capacity:
+                entries.popitem(last=False)
+            self.dirty = True
+
+    def remove(self, key: str):
+        with self._lock:
+            if self.entries.pop(key, None) is not None:
+                self.dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self.dirty or self._entries is None:
+                return
+            try:
+                write_atomically(self.path, json.dumps({
+                    'version': self.VERSION,
+                    'entries': [[key, value] for key, value in self._entries.items()],
+                }))
+                self.dirty = False
+            except OSError:
+                # Failing to persist a cache is not fatal
+                pass
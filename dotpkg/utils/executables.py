@@ -0,0 +1,106 @@
+from typing import Any, Optional
+
+from dotpkg.utils.cache import PersistentCache
+from dotpkg.utils.file import RACY_MTIME_NS
+
+import os
+import shutil
+import time
+
+# Executables on PATH
+#
+# Looking up a name with shutil.which stats candidates in every PATH directory
+# until it finds one, i.e. checking many requirements of many packages costs
+# lots of syscalls. Instead, we list each directory once and map names to the
+# directories containing them, so only the actual candidates are checked for
+# being executable. Listings can be cached along with the directory's mtime,
+# which changes whenever a file is added, removed or renamed.
+
+ExecutableCache = PersistentCache[Any]
+
+def candidate_names(dir_path: str) -> list[str]:
+    '''Lists the names of the potentially executable files in the directory.'''
+    try:
+        with os.scandir(dir_path) as entries:
+            # Checking the entry type (unlike permissions) usually needs no syscall
+            return [entry.name for entry in entries if not entry.is_dir(follow_symlinks=False)]
+    except OSError:
+        return []
+
+def is_executable(path: str) -> bool:
+    # Same check as shutil.which
+    return os.access(path, os.F_OK | os.X_OK) and not os.path.isdir(path)
+
+def executable_extensions() -> list[str]:
+    # On Windows, executables are found without their extension
+    if os.name == 'nt':
+        return [ext.lower() for ext in os.environ.get('PATHEXT', '.COM;.EXE;.BAT;.CMD').split(os.pathsep) if ext]
+    return []
+
+class ExecutableIndex:
+    '''
+    The names of the executables on a PATH, listed lazily on the first lookup
+    (so runs that never check for executables don't pay for it) and reused
+    for the remaining run.
+    '''
+
+    def __init__(self, path: Optional[str] = None, cache: Optional[ExecutableCache] = None):
+        self.path = os.environ.get('PATH', os.defpath) if path is None else path
+        self.cache = cache
+        self._names: Optional[dict[str, list[str]]] = None
+
+    @property
+    def dirs(self) -> list[str]:
+        # Like shutil.which, we skip duplicates and resolve empty entries to the cwd
+        return list(dict.fromkeys(d or os.curdir for d in self.path.split(os.pathsep)))
+
+    def dir_names(self, dir_path: str) -> list[str]:
+        try:
+            mtime_ns = os.stat(dir_path).st_mtime_ns
+        except OSError:
+            return []
+
+        # The cwd differs between runs, hence we only cache absolute paths
+        cache = self.cache if os.path.isabs(dir_path) else None
+        if cache and (cached := cache.get(dir_path)):
+            try:
+                if cached['mtime'] == mtime_ns:
+                    return cached['names']
+            except (KeyError, TypeError):
+                # Treat a corrupt entry like a missing one
+                pass
+
+        names = candidate_names(dir_path)
+
+        # Directories modified very recently might change again without their
+        # mtime changing (depending on its granularity), so we don't cache them
+        if cache and mtime_ns < time.time_ns() - RACY_MTIME_NS:
+            cache.put(dir_path, {'mtime': mtime_ns, 'names': names})
+
+        return names
+
+    @property
+    def names(self) -> dict[str, list[str]]:
+        '''Maps the name of each candidate to the paths of the files in PATH order.'''
+        if self._names is None:
+            extensions = executable_extensions()
+            names: dict[str, list[str]] = {}
+            for dir_path in self.dirs:
+                for name in self.dir_names(dir_path):
+                    path = os.path.join(dir_path, name)
+                    names.setdefault(name, []).append(path)
+                    root, ext = os.path.splitext(name)
+                    if ext.lower() in extensions:
+                        names.setdefault(root, []).append(path)
+            self._names = names
+        return self._names
+
+    def which(self, name: str) -> Optional[str]:
+        '''Finds the executable like shutil.which.'''
+        # Paths are not looked up on PATH, so we leave those to which
+        if os.sep in name or (os.altsep and os.altsep in name):
+            return shutil.which(name)
+        return next((path for path in self.names.get(name, []) if is_executable(path)), None)
+
+    def __contains__(self, name: str) -> bool:
+        return self.which(name) is not None
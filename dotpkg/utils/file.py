@@ -1,12 +1,20 @@
 from pathlib import Path
-from typing import ByteString, Protocol
+from collections import deque
+from typing import TYPE_CHECKING, ByteString, Optional, Protocol, Union
 
-from dotpkg.options import Options
 from dotpkg.utils.log import warn
+from dotpkg.utils.profiler import profiled
 
 import os
 import hashlib
+import mmap
 import shutil
+import stat
+import tempfile
+import time
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
 
 def relativize(path: Path, base_path: Path) -> Path:
     # We use os.path.relpath instead of Path.relative_to since
@@ -14,76 +22,281 @@ def relativize(path: Path, base_path: Path) -> Path:
     # (by inserting '..' as needed).
     return Path(os.path.relpath(str(path), str(base_path)))
 
+def lstat(path: Path) -> Optional[os.stat_result]:
+    '''Stats the path without following symlinks, returning None if it does not exist.'''
+    try:
+        return os.lstat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+def write_atomically(path: Path, data: str):
+    # Write to a temporary file in the same directory and rename it over the
+    # original, so an interrupted run never leaves a truncated file behind.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{path.name}.', suffix='.tmp', dir=path.parent)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
 class Hash(Protocol):
     '''Protocol for hash functions.'''
     def update(self, data: ByteString, /) -> None:
         raise NotImplementedError()
 
+# Files up to this size are read in one go, since most dotfiles are tiny and
+# the per-call overhead of the buffered loop would dominate.
+SMALL_FILE_SIZE = 128 * 1024
+# Files from this size on are mapped into memory and hashed straight from the
+# mapping, avoiding the copies into a userspace buffer.
+MMAP_MIN_SIZE = 4 * 1024 * 1024
+
 def hash_file(path: Path, hash: Hash):
-    # https://stackoverflow.com/a/44873382
-    b = bytearray(128 * 1024)
-    mv = memoryview(b)
     with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+
+        if size <= SMALL_FILE_SIZE:
+            hash.update(f.read())
+            return
+
+        if size >= MMAP_MIN_SIZE:
+            try:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m, memoryview(m) as mv:
+                    hash.update(mv)
+                return
+            except (OSError, ValueError):
+                # Some file systems do not support mapping, fall back to reading
+                pass
+
+        # https://stackoverflow.com/a/44873382
+        b = bytearray(128 * 1024)
+        mv = memoryview(b)
         while n := f.readinto(mv):
             hash.update(mv[:n])
 
 # TODO: Abstract out HashOptions or similar
 
-def hash_dir(path: Path, hash: Hash, legacy_order: bool=False):
+def hash_dir(path: Path, hash: Hash, legacy_order: bool=False, name: Optional[str]=None):
     childs = path.iterdir()
     # For backwards compatibility with manifest version 3 we preserve the
     # ability to use the non-deterministic, os-dependent order (which happens to
     # be stable on macOS, but not on Linux).
     if not legacy_order:
         childs = sorted(childs)
+    encoded_name = (name or path.name).encode('utf-8')
     for child in childs:
-        hash.update(path.name.encode('utf-8'))
+        hash.update(encoded_name)
         hash_path(child, hash)
 
-def hash_path(path: Path, hash: Hash, legacy_order: bool=False):
+def hash_path(path: Path, hash: Hash, legacy_order: bool=False, name: Optional[str]=None):
+    '''
+    Hashes the file or directory. Since directory digests include the
+    directory's name, name lets us hash it as if it were named differently
+    (e.g. a source under the name of the target it is copied to).
+    '''
+
     if not path.exists():
         warn(f'Path {path} does not exist and thus cannot be hashed.')
     elif path.is_dir():
-        hash_dir(path, hash, legacy_order=legacy_order)
+        hash_dir(path, hash, legacy_order=legacy_order, name=name)
     elif path.is_file():
         hash_file(path, hash)
     else:
         warn(f'Encountered strange path {path} that is neither a file nor directory (thus cannot be hashed)')
 
-def path_digest(path: Path, legacy_order: bool=False) -> str:
-    hash = hashlib.sha256()
-    hash_path(path, hash, legacy_order=legacy_order)
-    return hash.hexdigest()
-
-def copy(src_path: Path, target_path: Path, opts: Options):
-    print(f'Copying {src_path} to {target_path}')
-    if not opts.dry_run:
-        if src_path.is_dir():
-            shutil.copytree(src_path, target_path)
+# Parallel hashing
+
+# Hashing is inherently sequential, but reading the files is not. Hence, for
+# larger trees, we prefetch the (small) files on a thread pool while feeding
+# them into the hash in the exact same order as hash_path would.
+PARALLEL_HASH_MIN_FILES = 16
+PARALLEL_HASH_WORKERS = min(8, os.cpu_count() or 1)
+PREFETCH_MAX_SIZE = 1024 * 1024
+
+HashInput = Union[bytes, Path]
+
+def walk_hash_inputs(path: Path, legacy_order: bool=False, name: Optional[str]=None) -> list[HashInput]:
+    '''Walks the path once, collecting the byte strings and files (in order) that hash_path would hash.'''
+    inputs: list[HashInput] = []
+
+    def walk_dir(path: Path, legacy_order: bool, name: Optional[str]):
+        # Using scandir lets us avoid most stats, since the entries already
+        # know their types (unless they are symlinks).
+        with os.scandir(path) as it:
+            childs = [(Path(entry.path), entry.is_dir(), entry.is_file()) for entry in it]
+        if not legacy_order:
+            childs.sort()
+        encoded_name = (name or path.name).encode('utf-8')
+        for child, is_dir, is_file in childs:
+            inputs.append(encoded_name)
+            walk(child, is_dir, is_file)
+
+    def walk(path: Path, is_dir: bool, is_file: bool, legacy_order: bool=False, name: Optional[str]=None):
+        if is_dir:
+            walk_dir(path, legacy_order, name)
+        elif is_file:
+            inputs.append(path)
+        elif not path.exists():
+            warn(f'Path {path} does not exist and thus cannot be hashed.')
         else:
-            shutil.copy(src_path, target_path)
-
-def move(src_path: Path, target_path: Path, opts: Options):
-    print(f'Moving {src_path} to {target_path}')
-    if not opts.dry_run:
-        shutil.move(src_path, target_path)
-
-def link(src_path: Path, target_path: Path, opts: Options):
-    print(f'Linking {target_path} -> {src_path}')
-    if not opts.dry_run:
-        target_path.symlink_to(src_path)
-
-def touch(path: Path, opts: Options):
-    print(f'Touching {path}')
-    if not opts.dry_run:
-        path.touch()
-
-def remove(target_path: Path, opts: Options):
-    if target_path.is_symlink() or not target_path.is_dir():
-        print(f'Removing {target_path}')
-        if not opts.dry_run:
-            target_path.unlink()
+            warn(f'Encountered strange path {path} that is neither a file nor directory (thus cannot be hashed)')
+
+    walk(path, path.is_dir(), path.is_file(), legacy_order, name)
+    return inputs
+
+def read_small_file(path: Path) -> Optional[bytes]:
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size > PREFETCH_MAX_SIZE:
+            return None
+        return f.read()
+
+def hash_inputs(inputs: list[HashInput], hash: Hash, workers: int=PARALLEL_HASH_WORKERS):
+    files = [i for i in inputs if isinstance(i, Path)]
+
+    if workers <= 1 or len(files) < PARALLEL_HASH_MIN_FILES:
+        for i in inputs:
+            if isinstance(i, Path):
+                hash_file(i, hash)
+            else:
+                hash.update(i)
+        return
+
+    # Only imported when needed, since read-only commands should start quickly
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # Only prefetch a bounded window of files to keep memory usage in check
+        pending: deque[Future[Optional[bytes]]] = deque()
+        remaining = iter(files)
+
+        def prefetch_next():
+            if (path := next(remaining, None)) is not None:
+                pending.append(executor.submit(read_small_file, path))
+
+        for _ in range(workers * 4):
+            prefetch_next()
+
+        for i in inputs:
+            if isinstance(i, Path):
+                data = pending.popleft().result()
+                prefetch_next()
+                if data is None:
+                    # Large files are streamed on this thread instead
+                    hash_file(i, hash)
+                else:
+                    hash.update(data)
+            else:
+                hash.update(i)
+
+class DigestCache(Protocol):
+    '''Protocol for caches of path digests, keyed by path signatures.'''
+    def get(self, key: str, /) -> Optional[str]:
+        raise NotImplementedError()
+
+    def put(self, key: str, digest: str, /) -> None:
+        raise NotImplementedError()
+
+# Files modified more recently than this are not cached, since a subsequent
+# modification might not change the mtime (depending on its granularity).
+RACY_MTIME_NS = 2_000_000_000
+
+def stat_signature(st: os.stat_result, now_ns: int) -> Optional[str]:
+    if now_ns - st.st_mtime_ns < RACY_MTIME_NS:
+        return None
+    return f'{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}'
+
+def path_signature(path: Path, name: Optional[str]=None) -> Optional[str]:
+    '''
+    Computes a key from the file metadata (device, inode, size and mtime) that
+    changes whenever the digest of the path (as computed by hash_path) might,
+    without reading any file contents. Returns None if no reliable signature
+    could be computed, in which case the path has to be hashed.
+    '''
+
+    now_ns = time.time_ns()
+
+    try:
+        st = os.stat(path)
+        if stat.S_ISREG(st.st_mode):
+            sig = stat_signature(st, now_ns)
+            return f'f:{sig}' if sig else None
+        elif not stat.S_ISDIR(st.st_mode):
+            return None
+
+        # Since the directory digest depends on the (nested) names and
+        # contents, we hash the names along with the file signatures.
+        hash = hashlib.sha256()
+        hash.update(f'r:{name or path.name}\0'.encode('utf-8'))
+        stack = [path]
+        while stack:
+            dir_path = stack.pop()
+            hash.update(f'd:{dir_path.relative_to(path)}\0'.encode('utf-8'))
+            for child in sorted(dir_path.iterdir(), reverse=True):
+                child_st = os.stat(child)
+                if stat.S_ISDIR(child_st.st_mode):
+                    stack.append(child)
+                elif stat.S_ISREG(child_st.st_mode):
+                    sig = stat_signature(child_st, now_ns)
+                    if not sig:
+                        return None
+                    hash.update(f'f:{child.name}:{sig}\0'.encode('utf-8'))
+                else:
+                    return None
+        return f'd:{hash.hexdigest()}'
+    except (OSError, UnicodeError):
+        return None
+
+@profiled('path_digest')
+def path_digest(path: Path, legacy_order: bool=False, cache: Optional[DigestCache]=None, name: Optional[str]=None) -> str:
+    '''Hashes the path like hash_path, reusing cached digests if possible.'''
+    # Legacy digests depend on the directory listing order and are thus never cached
+    key = path_signature(path, name) if cache and not legacy_order else None
+    if cache and key and (digest := cache.get(key)):
+        return digest
+
+    hash = hashlib.sha256()
+    hash_inputs(walk_hash_inputs(path, legacy_order=legacy_order, name=name), hash)
+    digest = hash.hexdigest()
+
+    if cache and key:
+        cache.put(key, digest)
+    return digest
+
+def copy_file(src_path: Path, target_path: Path, hash: Optional[Hash]=None):
+    b = bytearray(128 * 1024)
+    mv = memoryview(b)
+    with open(src_path, 'rb') as src_file, open(target_path, 'wb') as target_file:
+        while n := src_file.readinto(mv):
+            if hash:
+                hash.update(mv[:n])
+            target_file.write(mv[:n])
+
+def copy_path(src_path: Path, target_path: Path, hash: Optional[Hash]=None):
+    '''
+    Copies a file or directory (like shutil.copytree, i.e. following symlinks)
+    while feeding the copied contents into the hash exactly like hash_path
+    would for the target, thus avoiding reading it again.
+    '''
+
+    if src_path.is_dir():
+        target_path.mkdir()
+        for child in sorted(src_path.iterdir()):
+            if hash:
+                hash.update(target_path.name.encode('utf-8'))
+            copy_path(child, target_path / child.name, hash)
+        shutil.copystat(src_path, target_path)
+    elif src_path.is_file():
+        copy_file(src_path, target_path, hash)
+        shutil.copystat(src_path, target_path)
+    else:
+        # Let shutil raise the appropriate error for special files
+        shutil.copy2(src_path, target_path)
+
+def remove_path(path: Path):
+    if path.is_symlink() or not path.is_dir():
+        path.unlink()
     else:
-        print(f'Removing directory {target_path}')
-        if not opts.dry_run:
-            shutil.rmtree(target_path)
+        shutil.rmtree(path)
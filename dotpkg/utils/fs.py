@@ -0,0 +1,474 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional, Union
+
+from dotpkg.utils.file import DigestCache, Hash, copy_path, lstat, path_digest, remove_path, write_atomically
+from dotpkg.utils.log import warn
+
+import hashlib
+import os
+import shutil
+import stat
+import threading
+import time
+
+MAX_SYMLINK_HOPS = 40
+
+class FileSystem(ABC):
+    '''
+    The file system that dotpkg operates on. Besides the real file system,
+    this may be an in-memory file system (e.g. for tests) or an overlay that
+    records changes without applying them (e.g. for dry runs).
+    '''
+
+    persistent = False
+    '''Whether changes outlive the run (i.e. whether it is worth persisting caches).'''
+
+    @property
+    def disk(self) -> Optional['FileSystem']:
+        '''The persistent file system that reads see (e.g. through an overlay) and other processes share, if any.'''
+        return self if self.persistent else None
+
+    @abstractmethod
+    def lstat(self, path: Path) -> Optional[os.stat_result]:
+        '''Stats the path without following symlinks, returning None if it does not exist.'''
+        raise NotImplementedError()
+
+    @abstractmethod
+    def readlink(self, path: Path) -> Path:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def listdir(self, path: Path) -> list[str]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def read_bytes(self, path: Path) -> bytes:
+        raise NotImplementedError()
+
+    def scandir(self, path: Path) -> list[tuple[str, os.stat_result]]:
+        '''Lists the directory's entries along with their lstat.'''
+        resolved = self.resolve(path)
+        return [(name, st) for name in self.listdir(resolved) if (st := self.lstat(resolved / name)) is not None]
+
+    @abstractmethod
+    def write_text(self, path: Path, data: str):
+        '''Writes the file atomically, creating parent directories as needed.'''
+        raise NotImplementedError()
+
+    @abstractmethod
+    def append_text(self, path: Path, data: str):
+        '''Appends to the file, creating it (but not its parents) if needed.'''
+        raise NotImplementedError()
+
+    @abstractmethod
+    def mkdir(self, path: Path):
+        '''Creates the directory along with its parents, unless it exists.'''
+        raise NotImplementedError()
+
+    @abstractmethod
+    def touch(self, path: Path):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def symlink(self, path: Path, target: Path):
+        '''Creates a symlink at path pointing to target.'''
+        raise NotImplementedError()
+
+    @abstractmethod
+    def move(self, src_path: Path, target_path: Path):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def remove(self, path: Path):
+        '''Removes the file, symlink or (recursively) directory.'''
+        raise NotImplementedError()
+
+    @abstractmethod
+    def copy(self, src_path: Path, target_path: Path) -> str:
+        '''Copies the file or directory (following symlinks) and returns the digest of the copy.'''
+        raise NotImplementedError()
+
+    def stat(self, path: Path) -> Optional[os.stat_result]:
+        '''Stats the path following symlinks, returning None if it does not exist.'''
+        try:
+            return self.lstat(self.resolve(path))
+        except (OSError, RuntimeError):
+            return None
+
+    def exists(self, path: Path) -> bool:
+        return self.stat(path) is not None
+
+    def is_dir(self, path: Path) -> bool:
+        st = self.stat(path)
+        return st is not None and stat.S_ISDIR(st.st_mode)
+
+    def is_file(self, path: Path) -> bool:
+        st = self.stat(path)
+        return st is not None and stat.S_ISREG(st.st_mode)
+
+    def is_symlink(self, path: Path) -> bool:
+        st = self.lstat(path)
+        return st is not None and stat.S_ISLNK(st.st_mode)
+
+    def read_text(self, path: Path) -> str:
+        return self.read_bytes(path).decode('utf-8')
+
+    def resolve(self, path: Path, hops: int = 0) -> Path:
+        '''Resolves symlinks (like Path.resolve in non-strict mode).'''
+        resolved = Path(path.anchor)
+        for part in path.parts[1:] if path.anchor else path.parts:
+            if part == '..':
+                resolved = resolved.parent
+                continue
+            resolved = resolved / part
+            if self.is_symlink(resolved):
+                if hops >= MAX_SYMLINK_HOPS:
+                    raise RuntimeError(f'Too many levels of symlinks at {resolved}')
+                resolved = self.resolve(resolved.parent / self.readlink(resolved), hops + 1)
+        return resolved
+
+    def hash_path(self, path: Path, hash: Hash, legacy_order: bool = False, name: Optional[str] = None):
+        '''Hashes the path exactly like dotpkg.utils.file.hash_path.'''
+        st = self.stat(path)
+        if st is None:
+            warn(f'Path {path} does not exist and thus cannot be hashed.')
+        elif stat.S_ISDIR(st.st_mode):
+            child_names = self.listdir(path)
+            if not legacy_order:
+                child_names = sorted(child_names)
+            encoded_name = (name or path.name).encode('utf-8')
+            for child_name in child_names:
+                hash.update(encoded_name)
+                self.hash_path(path / child_name, hash)
+        elif stat.S_ISREG(st.st_mode):
+            hash.update(self.read_bytes(path))
+        else:
+            warn(f'Encountered strange path {path} that is neither a file nor directory (thus cannot be hashed)')
+
+    def digest(self, path: Path, legacy_order: bool = False, cache: Optional[DigestCache] = None, name: Optional[str] = None) -> str:
+        '''Hashes the path, optionally as if it were named name (see dotpkg.utils.file.hash_path).'''
+        hash = hashlib.sha256()
+        self.hash_path(path, hash, legacy_order=legacy_order, name=name)
+        return hash.hexdigest()
+
+class OSFileSystem(FileSystem):
+    '''The real file system.'''
+
+    persistent = True
+
+    def lstat(self, path: Path) -> Optional[os.stat_result]:
+        return lstat(path)
+
+    def stat(self, path: Path) -> Optional[os.stat_result]:
+        try:
+            return os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def readlink(self, path: Path) -> Path:
+        return Path(os.readlink(path))
+
+    def listdir(self, path: Path) -> list[str]:
+        return os.listdir(path)
+
+    def scandir(self, path: Path) -> list[tuple[str, os.stat_result]]:
+        with os.scandir(path) as it:
+            return [(entry.name, entry.stat(follow_symlinks=False)) for entry in it]
+
+    def read_bytes(self, path: Path) -> bytes:
+        return path.read_bytes()
+
+    def write_text(self, path: Path, data: str):
+        write_atomically(path, data)
+
+    def append_text(self, path: Path, data: str):
+        with open(path, 'a') as f:
+            f.write(data)
+
+    def mkdir(self, path: Path):
+        path.mkdir(parents=True, exist_ok=True)
+
+    def touch(self, path: Path):
+        path.touch()
+
+    def symlink(self, path: Path, target: Path):
+        path.symlink_to(target)
+
+    def move(self, src_path: Path, target_path: Path):
+        shutil.move(src_path, target_path)
+
+    def remove(self, path: Path):
+        remove_path(path)
+
+    def resolve(self, path: Path, hops: int = 0) -> Path:
+        return path.resolve()
+
+    def digest(self, path: Path, legacy_order: bool = False, cache: Optional[DigestCache] = None, name: Optional[str] = None) -> str:
+        return path_digest(path, legacy_order=legacy_order, cache=cache, name=name)
+
+    def copy(self, src_path: Path, target_path: Path) -> str:
+        hash = hashlib.sha256()
+        copy_path(src_path, target_path, hash)
+        return hash.hexdigest()
+
+# In-memory file systems
+
+@dataclass
+class MemoryFile:
+    data: bytes = b''
+    mtime: float = field(default_factory=time.time)
+
+@dataclass
+class MemoryDir:
+    mtime: float = field(default_factory=time.time)
+
+@dataclass
+class MemorySymlink:
+    target: Path
+    mtime: float = field(default_factory=time.time)
+
+MemoryNode = Union[MemoryFile, MemoryDir, MemorySymlink]
+
+def memory_stat(mode: int, size: int, mtime: float) -> os.stat_result:
+    mtime_ns = int(mtime * 1_000_000_000)
+    times = {f'st_{kind}time': mtime for kind in ['a', 'm', 'c']}
+    times_ns = {f'st_{kind}time_ns': mtime_ns for kind in ['a', 'm', 'c']}
+    return os.stat_result((mode, 0, 0, 1, 0, 0, size, int(mtime), int(mtime), int(mtime)), {**times, **times_ns})
+
+class MemoryFileSystem(FileSystem):
+    '''
+    A file system that lives entirely in memory. Only absolute paths are
+    supported and intermediate symlinks are not followed when looking up
+    paths (only by resolve).
+    '''
+
+    def __init__(self):
+        self.base: Optional[FileSystem] = None
+        self.entries: dict[Path, Optional[MemoryNode]] = {Path(os.sep): MemoryDir()}
+        '''The nodes by path, None denoting a deleted path (of the base).'''
+        self.lock = threading.RLock()
+
+    def node(self, path: Path) -> Union[MemoryNode, None, FileSystem]:
+        '''Looks up the node at the path, which may also live in the base file system.'''
+        if path in self.entries:
+            return self.entries[path]
+        if self.base is None:
+            return None
+        # Anything in our layer shadows the base at the nested paths
+        if any(parent in self.entries for parent in path.parents):
+            return None
+        return self.base
+
+    def lstat(self, path: Path) -> Optional[os.stat_result]:
+        with self.lock:
+            node = self.node(path)
+        if isinstance(node, FileSystem):
+            return node.lstat(path)
+        elif isinstance(node, MemoryFile):
+            return memory_stat(stat.S_IFREG | 0o644, len(node.data), node.mtime)
+        elif isinstance(node, MemoryDir):
+            return memory_stat(stat.S_IFDIR | 0o755, 0, node.mtime)
+        elif isinstance(node, MemorySymlink):
+            return memory_stat(stat.S_IFLNK | 0o777, len(str(node.target)), node.mtime)
+        return None
+
+    def readlink(self, path: Path) -> Path:
+        with self.lock:
+            node = self.node(path)
+        if isinstance(node, FileSystem):
+            return node.readlink(path)
+        elif isinstance(node, MemorySymlink):
+            return node.target
+        raise OSError(f'Not a symlink: {path}')
+
+    def listdir(self, path: Path) -> list[str]:
+        path = self.resolve(path)
+        with self.lock:
+            node = self.node(path)
+            if isinstance(node, FileSystem):
+                names = set(node.listdir(path))
+            elif isinstance(node, MemoryDir):
+                names = set()
+            else:
+                raise NotADirectoryError(f'Not a directory: {path}')
+            for child, child_node in self.entries.items():
+                if child.parent == path and child != path:
+                    if child_node is None:
+                        names.discard(child.name)
+                    else:
+                        names.add(child.name)
+            return list(names)
+
+    def read_bytes(self, path: Path) -> bytes:
+        path = self.resolve(path)
+        with self.lock:
+            node = self.node(path)
+        if isinstance(node, FileSystem):
+            return node.read_bytes(path)
+        elif isinstance(node, MemoryFile):
+            return node.data
+        elif node is None:
+            raise FileNotFoundError(f'No such file: {path}')
+        raise IsADirectoryError(f'Not a file: {path}')
+
+    def put(self, path: Path, node: MemoryNode):
+        with self.lock:
+            if not self.is_dir(path.parent):
+                raise FileNotFoundError(f'No such directory: {path.parent}')
+            self.entries[path] = node
+
+    def copy(self, src_path: Path, target_path: Path) -> str:
+        hash = hashlib.sha256()
+        self.copy_into(src_path, target_path, hash)
+        return hash.hexdigest()
+
+    def copy_into(self, src_path: Path, target_path: Path, hash: Hash):
+        '''Copies like dotpkg.utils.file.copy_path (the source may live in the base file system).'''
+        if self.is_dir(src_path):
+            self.mkdir(target_path)
+            for name in sorted(self.listdir(src_path)):
+                hash.update(target_path.name.encode('utf-8'))
+                self.copy_into(src_path / name, target_path / name, hash)
+        else:
+            data = self.read_bytes(src_path)
+            hash.update(data)
+            self.write_bytes(target_path, data)
+
+    def write_bytes(self, path: Path, data: bytes):
+        self.mkdir(path.parent)
+        self.put(self.resolve(path.parent) / path.name, MemoryFile(data))
+
+    def write_text(self, path: Path, data: str):
+        self.write_bytes(path, data.encode('utf-8'))
+
+    def append_text(self, path: Path, data: str):
+        with self.lock:
+            existing = self.read_bytes(path) if self.exists(path) else b''
+            self.write_bytes(path, existing + data.encode('utf-8'))
+
+    def mkdir(self, path: Path):
+        with self.lock:
+            if self.is_dir(path):
+                return
+            if self.lstat(path) is not None:
+                raise FileExistsError(f'File exists: {path}')
+            self.mkdir(path.parent)
+            self.put(path, MemoryDir())
+
+    def touch(self, path: Path):
+        with self.lock:
+            if self.exists(path):
+                st = self.lstat(path)
+                if isinstance(node := self.node(path), (MemoryFile, MemoryDir, MemorySymlink)):
+                    node.mtime = time.time()
+                elif st and stat.S_ISREG(st.st_mode):
+                    # Bring the file into our layer to update its mtime
+                    self.put(path, MemoryFile(self.read_bytes(path)))
+            else:
+                self.put(path, MemoryFile())
+
+    def symlink(self, path: Path, target: Path):
+        with self.lock:
+            if self.lstat(path) is not None:
+                raise FileExistsError(f'File exists: {path}')
+            self.put(path, MemorySymlink(target))
+
+    def move(self, src_path: Path, target_path: Path):
+        with self.lock:
+            if self.lstat(src_path) is None:
+                raise FileNotFoundError(f'No such file or directory: {src_path}')
+            # Like shutil.move, we move into existing directories
+            if self.is_dir(target_path):
+                target_path = target_path / src_path.name
+            if self.is_symlink(src_path):
+                self.put(target_path, MemorySymlink(self.readlink(src_path)))
+            else:
+                self.copy_into(src_path, target_path, hashlib.sha256())
+            self.remove(src_path)
+
+    def remove(self, path: Path):
+        with self.lock:
+            if self.lstat(path) is None:
+                raise FileNotFoundError(f'No such file or directory: {path}')
+            for child in [child for child in self.entries if path in child.parents]:
+                del self.entries[child]
+            if self.base is None:
+                del self.entries[path]
+            else:
+                self.entries[path] = None
+
+    def is_affected(self, path: Path) -> bool:
+        '''Whether the path (or anything in or above it) has been changed in this layer.'''
+        with self.lock:
+            return any(entry == path or entry in path.parents or path in entry.parents for entry in self.entries)
+
+class OverlayFileSystem(MemoryFileSystem):
+    '''
+    An in-memory layer on top of another file system, which is left
+    untouched. Reads see the changes made through the overlay, which are
+    also recorded.
+    '''
+
+    def __init__(self, base: FileSystem):
+        super().__init__()
+        self.base = base
+        self.entries.clear()
+        self.operations: list[tuple[str, Path, Optional[Path]]] = []
+        '''The recorded changes as (kind, path, source path) tuples.'''
+        self.local = threading.local()
+
+    @property
+    def disk(self) -> Optional[FileSystem]:
+        return self.base.disk
+
+    @contextmanager
+    def recording(self, kind: str, path: Path, src_path: Optional[Path] = None):
+        '''Records the operation, unless it is part of another one (e.g. a mkdir during a copy).'''
+        depth = getattr(self.local, 'depth', 0)
+        if depth == 0:
+            with self.lock:
+                self.operations.append((kind, path, src_path))
+        self.local.depth = depth + 1
+        try:
+            yield
+        finally:
+            self.local.depth = depth
+
+    def write_bytes(self, path: Path, data: bytes):
+        with self.recording('write', path):
+            super().write_bytes(path, data)
+
+    def mkdir(self, path: Path):
+        if self.is_dir(path):
+            return
+        with self.recording('mkdir', path):
+            super().mkdir(path)
+
+    def touch(self, path: Path):
+        with self.recording('touch', path):
+            super().touch(path)
+
+    def symlink(self, path: Path, target: Path):
+        with self.recording('symlink', path, target):
+            super().symlink(path, target)
+
+    def move(self, src_path: Path, target_path: Path):
+        with self.recording('move', target_path, src_path):
+            super().move(src_path, target_path)
+
+    def remove(self, path: Path):
+        with self.recording('remove', path):
+            super().remove(path)
+
+    def copy(self, src_path: Path, target_path: Path) -> str:
+        with self.recording('copy', target_path, src_path):
+            return super().copy(src_path, target_path)
+
+    def digest(self, path: Path, legacy_order: bool = False, cache: Optional[DigestCache] = None, name: Optional[str] = None) -> str:
+        assert self.base
+        if not self.is_affected(path):
+            return self.base.digest(path, legacy_order=legacy_order, cache=cache, name=name)
+        return super().digest(path, legacy_order=legacy_order, cache=cache, name=name)
@@ -0,0 +1,72 @@
+from pathlib import PurePath
+from typing import Callable, Optional, Union
+
+import fnmatch
+import os
+import re
+
+# Like pathlib, we match case-insensitively on Windows only
+CASE_FLAGS = re.IGNORECASE if os.name == 'nt' else 0
+
+Segment = Union[str, re.Pattern[str], None]
+'''A literal name, a compiled wildcard or None for a recursive wildcard (**).'''
+
+def compile_segment(raw: str) -> Segment:
+    if raw == '**':
+        return None
+    elif any(c in raw for c in '*?['):
+        return re.compile(fnmatch.translate(raw), CASE_FLAGS)
+    else:
+        return raw
+
+class GlobPattern:
+    '''
+    A relative glob pattern compiled for matching paths directly. '*' does
+    not cross directory boundaries, '**' matches zero or more directories and
+    a trailing '**' or separator only matches directories, like pathlib's
+    Path.glob on Python 3.11 and 3.12 (whose semantics differ between Python
+    versions, which is why we don't delegate to it). In contrast to globbing,
+    matching does not require walking the file system.
+    '''
+
+    def __init__(self, raw: str):
+        self.raw = raw
+        parts = PurePath(raw).parts
+        self.segments = [compile_segment(part) for part in parts]
+        # PurePath drops the trailing separator, which restricts the matches
+        # to directories
+        self.dirs_only = raw.endswith('/') or raw.endswith(os.sep) or bool(os.altsep and raw.endswith(os.altsep))
+        # Globbing yields unnormalized paths for '..', which never equal any
+        # path within the package, hence such patterns never match
+        self.matches_nothing = '..' in parts
+
+    def matches(self, parts: tuple[str, ...], is_dir: Callable[[], bool]) -> bool:
+        '''Matches the given relative path parts. is_dir is only called if needed.'''
+        segments = self.segments
+        memo: dict[tuple[int, int], bool] = {}
+
+        def match_segment(segment: Segment, part: str) -> bool:
+            if isinstance(segment, str):
+                return segment == part if not CASE_FLAGS else segment.lower() == part.lower()
+            return segment is not None and segment.match(part) is not None
+
+        def match(i: int, j: int) -> bool:
+            if (i, j) in memo:
+                return memo[i, j]
+            result: Optional[bool] = None
+            if i == len(segments):
+                result = j == len(parts)
+            elif segments[i] is None:
+                if i == len(segments) - 1:
+                    # A trailing ** matches directories (at any depth)
+                    result = is_dir()
+                else:
+                    result = any(match(i + 1, k) for k in range(j, len(parts) + 1))
+            else:
+                result = j < len(parts) and match_segment(segments[i], parts[j]) and match(i + 1, j + 1)
+            memo[i, j] = result
+            return result
+
+        if not segments or self.matches_nothing:
+            return False
+        return match(0, 0) and (not self.dirs_only or is_dir())
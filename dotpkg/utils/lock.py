@@ -0,0 +1,115 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+
+from dotpkg.error import StateLockedError
+
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Advisory locks are not available (e.g. on Windows), hence we don't lock
+    fcntl = None
+
+LOCK_POLL_MIN_INTERVAL = 0.005
+LOCK_POLL_MAX_INTERVAL = 0.1
+
+@dataclass
+class LockStats:
+    '''Measurements of acquiring a lock.'''
+
+    wait_time: float = 0
+    '''The time (in seconds) spent waiting for other processes to release the lock.'''
+
+    contended: bool = False
+    '''Whether another process held the lock when we first tried acquiring it.'''
+
+@dataclass
+class HeldLock:
+    fd: int
+    exclusive: bool
+    count: int = 1
+
+# flock conflicts between different open files even within a process, so we
+# track the locks held by this process to make them reentrant.
+held_locks: dict[Path, HeldLock] = {}
+held_locks_lock = threading.Lock()
+
+def try_flock(fd: int, exclusive: bool) -> bool:
+    assert fcntl
+    try:
+        fcntl.flock(fd, (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | fcntl.LOCK_NB)
+        return True
+    except BlockingIOError:
+        return False
+
+@contextmanager
+def file_lock(path: Path, exclusive: bool, timeout: Optional[float]) -> Iterator[LockStats]:
+    '''
+    Holds an advisory lock on the given lock file, which is shared between
+    readers unless exclusive. Waits at most timeout seconds (or indefinitely
+    if None) for other processes to release a conflicting lock.
+    '''
+
+    stats = LockStats()
+
+    if fcntl is None:
+        yield stats
+        return
+
+    with held_locks_lock:
+        held = held_locks.get(path)
+        if held and (held.exclusive or not exclusive):
+            held.count += 1
+            reentered = True
+        else:
+            reentered = False
+
+    if reentered:
+        try:
+            yield stats
+        finally:
+            release(path)
+        return
+
+    if held:
+        # Upgrading our own shared lock would deadlock with other upgrading
+        # processes, hence we refuse to do so.
+        raise StateLockedError(f'Cannot upgrade shared lock on {path} to an exclusive one')
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        start = time.perf_counter()
+        interval = LOCK_POLL_MIN_INTERVAL
+        while not try_flock(fd, exclusive):
+            stats.contended = True
+            waited = time.perf_counter() - start
+            if timeout is not None and waited >= timeout:
+                raise StateLockedError(f'Timed out after {waited:.1f} s waiting for another dotpkg run to release {path}')
+            time.sleep(min(interval, timeout - waited) if timeout is not None else interval)
+            interval = min(interval * 2, LOCK_POLL_MAX_INTERVAL)
+        stats.wait_time = time.perf_counter() - start
+    except BaseException:
+        os.close(fd)
+        raise
+
+    with held_locks_lock:
+        held_locks[path] = HeldLock(fd=fd, exclusive=exclusive)
+
+    try:
+        yield stats
+    finally:
+        release(path)
+
+def release(path: Path):
+    with held_locks_lock:
+        held = held_locks[path]
+        held.count -= 1
+        if held.count == 0:
+            del held_locks[path]
+            # Closing the file releases the lock
+            os.close(held.fd)
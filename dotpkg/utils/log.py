@@ -1,4 +1,9 @@
+from contextlib import contextmanager, redirect_stdout
+from typing import Iterator, TextIO
+
+import io
 import sys
+import threading
 
 RED_COLOR = '\033[91m'
 YELLOW_COLOR = '\033[93m'
@@ -25,3 +30,56 @@ def success(msg: str):
 
 def note(msg: str):
     print(f'{GRAY_COLOR}{msg}{CLEAR_COLOR}')
+
+# Output buffering (e.g. for parallel installs)
+
+class ThreadLocalOutput(io.TextIOBase):
+    '''A stdout replacement that routes writes to a per-thread buffer, if any.'''
+
+    def __init__(self, fallback: TextIO):
+        self.fallback = fallback
+        self.local = threading.local()
+
+    @property
+    def buffer_stack(self) -> list[io.StringIO]:
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def write(self, s: str) -> int:
+        stack = self.buffer_stack
+        return (stack[-1] if stack else self.fallback).write(s)
+
+    def flush(self):
+        if not self.buffer_stack:
+            self.fallback.flush()
+
+output_lock = threading.Lock()
+
+@contextmanager
+def thread_local_output() -> Iterator[None]:
+    '''Installs a thread-local stdout for the duration of the block.'''
+    with redirect_stdout(ThreadLocalOutput(sys.stdout)):
+        yield
+
+@contextmanager
+def buffered_output() -> Iterator[None]:
+    '''Buffers the current thread's output and emits it in one piece at the end.'''
+    stdout = sys.stdout
+    if not isinstance(stdout, ThreadLocalOutput):
+        yield
+        return
+
+    buffer = io.StringIO()
+    stdout.buffer_stack.append(buffer)
+    try:
+        yield
+    finally:
+        stdout.buffer_stack.pop()
+        with output_lock:
+            stdout.write(buffer.getvalue())
+            stdout.flush()
+
+def is_output_buffered() -> bool:
+    stdout = sys.stdout
+    return isinstance(stdout, ThreadLocalOutput) and bool(stdout.buffer_stack)
@@ -0,0 +1,183 @@
+from contextlib import contextmanager, redirect_stdout
+from dataclasses import dataclass
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional, TypeVar
+
+from dotpkg.utils.log import note
+
+import os
+import sys
+import threading
+import time
+
+# Profiling
+#
+# Phases are instrumented with spans, which are recorded by the active
+# profiler (if any) along with the package they belong to. The package is
+# inherited by nested spans on the same thread. Since profiling is off by
+# default, entering a span without an active profiler only costs a check.
+
+F = TypeVar('F', bound=Callable[..., Any])
+
+@dataclass
+class Span:
+    phase: str
+    package: Optional[str]
+    start: float
+    '''The start time (in seconds, relative to the start of the profile).'''
+
+    duration: float
+    self_duration: float
+    '''The duration excluding nested spans.'''
+
+    thread: int
+    detail: Optional[str] = None
+
+@dataclass
+class OpenSpan:
+    package: Optional[str]
+    start: float
+    nested_duration: float = 0
+
+class Profiler:
+    '''Records the spans of a run (possibly on multiple threads).'''
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans: list[Span] = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    @property
+    def stack(self) -> list[OpenSpan]:
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    @contextmanager
+    def span(self, phase: str, package: Optional[str] = None, detail: Optional[str] = None) -> Iterator[None]:
+        stack = self.stack
+        if package is None and stack:
+            package = stack[-1].package
+        opened = OpenSpan(package=package, start=time.perf_counter())
+        stack.append(opened)
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            duration = end - opened.start
+            if stack:
+                stack[-1].nested_duration += duration
+            span = Span(
+                phase=phase,
+                package=package,
+                start=opened.start - self.start,
+                duration=duration,
+                self_duration=duration - opened.nested_duration,
+                thread=threading.get_ident(),
+                detail=detail,
+            )
+            with self.lock:
+                self.spans.append(span)
+
+    def summary(self) -> dict[tuple[str, str], tuple[int, float, float]]:
+        '''Aggregates the spans to (calls, total and self time) per package and phase.'''
+        rows: dict[tuple[str, str], tuple[int, float, float]] = {}
+        with self.lock:
+            spans = list(self.spans)
+        for span in spans:
+            key = (span.package or '-', span.phase)
+            calls, total, self_total = rows.get(key, (0, 0, 0))
+            rows[key] = (calls + 1, total + span.duration, self_total + span.self_duration)
+        return rows
+
+    def display(self):
+        rows = sorted(self.summary().items(), key=lambda row: (row[0][0] == '-', row[0][0], -row[1][2]))
+        note(f'Profile ({time.perf_counter() - self.start:.3f} s in total):')
+        if not rows:
+            return
+        package_width = max(len('package'), *(len(package) for (package, _), _ in rows))
+        phase_width = max(len('phase'), *(len(phase) for (_, phase), _ in rows))
+        note(f"  {'package'.ljust(package_width)} {'phase'.ljust(phase_width)} {'calls':>6} {'total':>11} {'self':>11}")
+        for (package, phase), (calls, total, self_total) in rows:
+            note(f'  {package.ljust(package_width)} {phase.ljust(phase_width)} {calls:6} {total * 1000:8.2f} ms {self_total * 1000:8.2f} ms')
+
+    def trace_events(self) -> list[dict[str, Any]]:
+        '''Converts the spans to complete events in the Chrome trace event format.'''
+        pid = os.getpid()
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span.start)
+        events = []
+        for span in spans:
+            args: dict[str, Any] = {}
+            if span.package:
+                args['package'] = span.package
+            if span.detail:
+                args['detail'] = span.detail
+            events.append({
+                'name': span.phase if span.package is None else f'{span.phase} ({span.package})',
+                'cat': span.phase,
+                'ph': 'X',
+                'ts': round(span.start * 1_000_000, 3),
+                'dur': round(span.duration * 1_000_000, 3),
+                'pid': pid,
+                'tid': span.thread,
+                'args': args,
+            })
+        return events
+
+    def write_trace(self, path: Path):
+        # Only imported when needed (see the CLI)
+        import json
+        path.write_text(json.dumps({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}))
+
+active_profiler: Optional[Profiler] = None
+
+@contextmanager
+def profiling(enabled: bool, trace_path: Optional[Path] = None) -> Iterator[Optional[Profiler]]:
+    '''Profiles the block if enabled, displaying a summary and writing the trace (if requested) at the end.'''
+    global active_profiler
+
+    if not enabled:
+        yield None
+        return
+
+    profiler = Profiler()
+    active_profiler = profiler
+    try:
+        yield profiler
+    finally:
+        active_profiler = None
+        # Keep the command's output (e.g. JSON) parseable
+        with redirect_stdout(sys.stderr):
+            profiler.display()
+            if trace_path:
+                profiler.write_trace(trace_path)
+                note(f'Wrote trace to {trace_path}')
+
+@contextmanager
+def span(phase: str, package: Optional[str] = None, detail: Optional[str] = None) -> Iterator[None]:
+    '''Records the block as a span of the given phase, if profiling.'''
+    profiler = active_profiler
+    if profiler is None:
+        yield
+        return
+    with profiler.span(phase, package, detail):
+        yield
+
+def profiled(phase: str) -> Callable[[F], F]:
+    '''Records each call of the decorated function as a span of the given phase, if profiling.'''
+
+    def decorator(f: F) -> F:
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            profiler = active_profiler
+            if profiler is None:
+                return f(*args, **kwargs)
+            with profiler.span(phase):
+                return f(*args, **kwargs)
+        return wrapper # type: ignore
+
+    return decorator
@@ -8,6 +8,9 @@ from dotpkg.install import install, read_install_manifest, uninstall, write_inst
 from dotpkg.manifest.installs import InstallsManifest
 from dotpkg.model import Dotpkg, DotpkgRef
 from dotpkg.options import Options
+from dotpkg.utils.fs import MemoryFileSystem
+
+import os
 
 TEST_ROOT = Path(__file__).resolve().parent
 TEST_PKGS = TEST_ROOT / 'pkgs'
@@ -63,11 +66,37 @@ class HomeDirFixture:
             home=self.path,
         )
     
-    def upgrade_install_manifest(self):
-        upgrade_install_manifest_cmd([], self.opts)
+    def upgrade_install_manifest(self, compact: bool = False):
+        upgrade_install_manifest_cmd(['5'] if compact else [], self.opts)
     
     def write_install_manifest(self, manifest: InstallsManifest):
         write_install_manifest(manifest, self.opts)
 
     def read_install_manifest(self) -> InstallsManifest:
         return read_install_manifest(self.opts)
+
+class MemoryHomeDirFixture:
+    '''A home directory living entirely in memory, along with (a copy of) the test packages.'''
+
+    def __init__(self):
+        self.fs = MemoryFileSystem()
+        self.path = Path('/nonexistent/dotpkg-test-home')
+        self.fs.mkdir(self.path)
+        for dir_path, _, names in os.walk(TEST_PKGS):
+            for name in names:
+                path = Path(dir_path) / name
+                self.fs.write_bytes(path, path.read_bytes())
+
+    @property
+    def opts(self) -> Options:
+        return Options(
+            cwd=TEST_PKGS,
+            home=self.path,
+            fs=self.fs,
+        )
+
+    def read_dotpkg(self, name: str) -> Dotpkg:
+        return DotpkgRef(TEST_PKGS / name).read(fs=self.fs)
+
+    def read_install_manifest(self) -> InstallsManifest:
+        return read_install_manifest(self.opts)
@@ -0,0 +1,73 @@
+import json
+import unittest
+
+from dotpkg.compact import CompactInstalls, read_compact_manifest, write_compact_manifest
+from dotpkg.error import InvalidManifestError
+from dotpkg.manifest.installs_v4 import InstallsV4Manifest
+from dotpkg.manifest.installs_v5 import InstallsV5Manifest
+from dotpkg.state import install_manifest_path
+
+from tests.fixtures import DotpkgFixture, HomeDirFixture
+
+class TestCompactManifest(unittest.TestCase):
+    def test_roundtrip(self):
+        entries = {
+            f'/home/user/dotfiles/pkg{i}': InstallsV5Manifest.InstallsEntry(
+                target_dir='/home/user',
+                src_paths=[f'/home/user/dotfiles/pkg{i}/.file{j}' for j in range(3)],
+                paths=[f'/home/user/.file{j}' for j in range(3)],
+                checksums=[f'{i:02x}' * 32, f'{i:064x}', 'not-a-hex-digest'],
+            )
+            for i in range(5)
+        }
+        data = write_compact_manifest(InstallsV5Manifest(installs=entries)).encode('utf-8')
+        manifest = read_compact_manifest(data)
+
+        assert manifest
+        installs = manifest.installs
+        assert isinstance(installs, CompactInstalls)
+        self.assertEqual(list(installs.keys()), list(entries.keys()))
+        self.assertEqual(installs['/home/user/dotfiles/pkg3'], entries['/home/user/dotfiles/pkg3'])
+        # Only the looked up entry should have been decoded
+        self.assertEqual(sum(1 for entry in installs.entries.values() if not isinstance(entry, bytes)), 1)
+
+        del installs['/home/user/dotfiles/pkg0']
+        rewritten = read_compact_manifest(write_compact_manifest(manifest).encode('utf-8'))
+        assert rewritten
+        self.assertEqual(dict(rewritten.installs), {k: v for k, v in entries.items() if k != '/home/user/dotfiles/pkg0'})
+
+    def test_legacy_json(self):
+        self.assertIsNone(read_compact_manifest(b'{\n  "version": 4,\n  "installs": {}\n}'))
+        self.assertIsNone(read_compact_manifest(b'{"version": 4, "installs": {}}'))
+
+    def test_missing_index(self):
+        # Treating this as empty would silently drop all installs
+        with self.assertRaises(InvalidManifestError):
+            read_compact_manifest(b'{"version":5}\n{"t":"/home/user"}\n')
+        with self.assertRaises(InvalidManifestError):
+            read_compact_manifest(b'{"version":5,"index":{"/pkg":7}}\n')
+
+    def test_default_version(self):
+        pkg = DotpkgFixture('copy')
+
+        with HomeDirFixture() as home:
+            # New manifests stay readable by older dotpkg versions
+            with pkg.install_context(home.opts):
+                data = install_manifest_path(home.opts).read_text()
+                self.assertEqual(json.loads(data)['version'], 4)
+
+    def test_v4_upgrade(self):
+        pkg = DotpkgFixture('copy')
+
+        with HomeDirFixture() as home:
+            home.write_install_manifest(InstallsV4Manifest())
+
+            with pkg.install_context(home.opts):
+                entry = home.read_install_manifest().installs[str(pkg.path)]
+                self.assertIsInstance(entry, InstallsV4Manifest.InstallsEntry)
+
+                home.upgrade_install_manifest(compact=True)
+                manifest = home.read_install_manifest()
+                self.assertIsInstance(manifest, InstallsV5Manifest)
+                self.assertEqual(manifest.installs[str(pkg.path)].to_dict(), entry.to_dict())
+                self.assertTrue(install_manifest_path(home.opts).with_name('installs.json.v4.backup').exists())
@@ -1,6 +1,7 @@
 import unittest
 
 from dotpkg.manifest.alias import CurrentInstallsEntry
+from dotpkg.utils.file import path_digest
 
 from tests.fixtures import DotpkgFixture, HomeDirFixture
 
@@ -36,3 +37,12 @@ class TestCopy(unittest.TestCase):
             self.assertEqual(home.read_install_manifest().installs, {})
 
             # TODO: Test failing uninstallations (e.g. if hashes mismatch)
+
+    def test_copy_digest(self):
+        pkg = DotpkgFixture('copy')
+
+        with HomeDirFixture() as home:
+            for name, target_name in [('dir', 'renamed-dir'), ('file.txt', 'file.txt')]:
+                target_path = home.path / target_name
+                digest = home.opts.fs.copy(pkg.path / name, target_path)
+                self.assertEqual(digest, path_digest(target_path))
@@ -0,0 +1,56 @@
+import os
+import unittest
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dotpkg.utils.cache import PersistentCache
+from dotpkg.utils.file import path_digest, path_signature
+
+def write_old(path: Path, content: str):
+    path.write_text(content)
+    # Make sure the file is not considered to be recently modified
+    os.utime(path, ns=(0, 1_000_000_000))
+
+class TestDigestCache(unittest.TestCase):
+    def test_cached_digests(self):
+        with TemporaryDirectory() as raw_dir:
+            root = Path(raw_dir)
+            tree = root / 'tree'
+            (tree / 'sub').mkdir(parents=True)
+            write_old(tree / 'a.txt', 'a')
+            write_old(tree / 'sub' / 'b.txt', 'b')
+
+            cache = PersistentCache[str](root / 'digests.json', capacity=8)
+            for path in [tree, tree / 'a.txt']:
+                digest = path_digest(path)
+                self.assertEqual(path_digest(path, cache=cache), digest)
+                self.assertEqual(cache.get(path_signature(path) or ''), digest)
+                self.assertEqual(path_digest(path, cache=cache), digest)
+
+            cache.save()
+            reloaded = PersistentCache[str](root / 'digests.json', capacity=8)
+            self.assertEqual(reloaded.get(path_signature(tree) or ''), path_digest(tree))
+
+            # Modifying a nested file should invalidate the directory's signature
+            old_signature = path_signature(tree)
+            write_old(tree / 'sub' / 'b.txt', 'changed')
+            self.assertNotEqual(path_signature(tree), old_signature)
+            self.assertEqual(path_digest(tree, cache=cache), path_digest(tree))
+
+    def test_recent_files_are_not_cached(self):
+        with TemporaryDirectory() as raw_dir:
+            path = Path(raw_dir) / 'recent.txt'
+            path.write_text('recent')
+            self.assertIsNone(path_signature(path))
+
+    def test_eviction(self):
+        with TemporaryDirectory() as raw_dir:
+            cache = PersistentCache[str](Path(raw_dir) / 'cache.json', capacity=2)
+            cache.put('a', '1')
+            cache.put('b', '2')
+            cache.get('a')
+            cache.put('c', '3')
+            self.assertEqual(cache.get('a'), '1')
+            self.assertIsNone(cache.get('b'))
+            self.assertEqual(cache.get('c'), '3')
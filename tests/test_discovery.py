@@ -0,0 +1,112 @@
+import os
+import time
+import unittest
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Optional
+
+from dotpkg.discovery import discover_packages
+from dotpkg.options import Options
+
+class DictIndex:
+    def __init__(self):
+        self.entries: dict[str, Any] = {}
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.entries.get(key)
+
+    def put(self, key: str, value: Any):
+        self.entries[key] = value
+
+def make_packages(root: Path, rel_paths: list[str]):
+    for rel_path in rel_paths:
+        (root / rel_path).mkdir(parents=True, exist_ok=True)
+        (root / rel_path / 'dotpkg.json').write_text('{"name": "test"}')
+
+def age_dirs(root: Path, seconds: float):
+    # Recently modified directories are never indexed
+    mtime = time.time() - seconds
+    for path, _, _ in os.walk(root):
+        os.utime(path, (mtime, mtime))
+
+class TestDiscovery(unittest.TestCase):
+    def test_recursive(self):
+        with TemporaryDirectory(prefix='dotpkg-test-repo') as repo_dir:
+            root = Path(repo_dir)
+            make_packages(root, ['a', 'a/nested', 'group/b', 'group/sub/c', 'node_modules/x', '.git/y'])
+            (root / 'group' / 'empty').mkdir()
+
+            expected = [root / 'a', root / 'group' / 'b', root / 'group' / 'sub' / 'c']
+            self.assertEqual(discover_packages(root, Options()), expected)
+            self.assertEqual(discover_packages(root, Options(jobs=4)), expected)
+            self.assertEqual(discover_packages(root / 'a', Options()), [root / 'a'])
+
+    def test_pruned(self):
+        with TemporaryDirectory(prefix='dotpkg-test-repo') as repo_dir:
+            root = Path(repo_dir)
+            (root / '.git').mkdir()
+            make_packages(root, ['a/b/c', 'a/b/c2/too-deep', '.config/hidden', '.config/nested/x', 'repo/tests/pkgs/fixture', 'pkg-repo'])
+            # Nested repositories are not descended into, unless they are packages
+            (root / 'repo' / '.git').mkdir()
+            (root / 'pkg-repo' / '.git').mkdir()
+
+            expected = [root / 'a' / 'b' / 'c', root / 'pkg-repo']
+            self.assertEqual(discover_packages(root, Options()), expected)
+            self.assertEqual(discover_packages(root, Options(jobs=4)), expected)
+
+            # Hidden directories are not descended into, but may be packages
+            make_packages(root, ['.config'])
+            self.assertEqual(discover_packages(root, Options()), [root / '.config', *expected])
+
+            # The depth is relative to where we discover from
+            self.assertEqual(discover_packages(root / 'a', Options()), [root / 'a' / 'b' / 'c', root / 'a' / 'b' / 'c2' / 'too-deep'])
+
+    def test_symlinked_and_vendored(self):
+        with TemporaryDirectory(prefix='dotpkg-test-repo') as repo_dir, TemporaryDirectory(prefix='dotpkg-test-external') as external_dir:
+            root = Path(repo_dir)
+            make_packages(root, ['real', 'vendor', 'node_modules/x'])
+            make_packages(Path(external_dir), ['linked', 'group/nested'])
+            (root / 'linked').symlink_to(Path(external_dir) / 'linked')
+            # Symlinked directories are not descended into, which avoids cycles
+            (root / 'group').symlink_to(Path(external_dir) / 'group')
+            (root / 'real' / 'cycle').symlink_to(root)
+
+            self.assertEqual(discover_packages(root, Options()), [root / 'linked', root / 'real', root / 'vendor'])
+
+            # Adding a manifest to a directory not descended into is noticed too
+            index = DictIndex()
+            age_dirs(root, 60)
+            self.assertEqual(discover_packages(root, Options(), index), [root / 'linked', root / 'real', root / 'vendor'])
+            make_packages(root, ['node_modules'])
+            self.assertEqual(discover_packages(root, Options(), index), [root / 'linked', root / 'node_modules', root / 'real', root / 'vendor'])
+
+    def test_index(self):
+        with TemporaryDirectory(prefix='dotpkg-test-repo') as repo_dir:
+            root = Path(repo_dir)
+            index = DictIndex()
+            opts = Options()
+            make_packages(root, ['a', 'group/b'])
+            age_dirs(root, 60)
+
+            self.assertEqual(discover_packages(root, opts, index), [root / 'a', root / 'group' / 'b'])
+            self.assertIn(str(root), index.entries)
+
+            # An unchanged tree is served from the index
+            index.entries[str(root)]['packages'] = ['indexed']
+            self.assertEqual(discover_packages(root, opts, index), [root / 'indexed'])
+
+            # Adding a package changes the mtime of its parent
+            make_packages(root, ['group/c'])
+            age_dirs(root, 30)
+            self.assertEqual(discover_packages(root, opts, index), [root / 'a', root / 'group' / 'b', root / 'group' / 'c'])
+
+            # So does removing a manifest
+            (root / 'a' / 'dotpkg.json').unlink()
+            age_dirs(root, 10)
+            self.assertEqual(discover_packages(root, opts, index), [root / 'group' / 'b', root / 'group' / 'c'])
+
+            # Recent changes are picked up, but not indexed
+            make_packages(root, ['d'])
+            self.assertEqual(discover_packages(root, opts, index), [root / 'd', root / 'group' / 'b', root / 'group' / 'c'])
+            self.assertNotIn('d', index.entries[str(root)]['packages'])
@@ -0,0 +1,62 @@
+import os
+import unittest
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dotpkg.utils.cache import PersistentCache
+from dotpkg.utils.executables import ExecutableIndex
+
+def write_executable(path: Path, executable: bool = True):
+    path.write_text('#!/bin/sh\n')
+    path.chmod(0o755 if executable else 0o644)
+
+def age_dir(path: Path):
+    # Make sure the directory is not considered to be recently modified
+    os.utime(path, ns=(0, 1_000_000_000))
+
+@unittest.skipIf(os.name != 'posix', 'requires POSIX permissions')
+class TestExecutables(unittest.TestCase):
+    def test_lookup(self):
+        with TemporaryDirectory() as raw_dir:
+            root = Path(raw_dir)
+            (root / 'a').mkdir()
+            (root / 'b').mkdir()
+            write_executable(root / 'a' / 'tool')
+            write_executable(root / 'b' / 'other')
+            write_executable(root / 'b' / 'data', executable=False)
+            (root / 'b' / 'subdir').mkdir()
+
+            index = ExecutableIndex(os.pathsep.join([str(root / 'a'), str(root / 'b'), str(root / 'missing')]))
+            self.assertIn('tool', index)
+            self.assertIn('other', index)
+            self.assertNotIn('data', index)
+            self.assertNotIn('subdir', index)
+            self.assertNotIn('missing', index)
+
+            # Paths are checked directly
+            self.assertIn(str(root / 'a' / 'tool'), index)
+            self.assertNotIn(str(root / 'b' / 'data'), index)
+
+    def test_cache(self):
+        with TemporaryDirectory() as raw_dir:
+            root = Path(raw_dir)
+            bin_dir = root / 'bin'
+            bin_dir.mkdir()
+            write_executable(bin_dir / 'tool')
+            age_dir(bin_dir)
+
+            cache = PersistentCache(root / 'executables.json', capacity=8)
+            self.assertIn('tool', ExecutableIndex(str(bin_dir), cache=cache))
+            self.assertEqual(cache.get(str(bin_dir)), {'mtime': 1_000_000_000, 'names': ['tool']})
+
+            # Unchanged directories are not listed again
+            cache.put(str(bin_dir), {'mtime': 1_000_000_000, 'names': ['cached']})
+            self.assertEqual(list(ExecutableIndex(str(bin_dir), cache=cache).names), ['cached'])
+
+            # Adding an executable changes the mtime, which invalidates the listing
+            write_executable(bin_dir / 'new')
+            index = ExecutableIndex(str(bin_dir), cache=cache)
+            self.assertIn('new', index)
+            self.assertIn('tool', index)
+            self.assertNotIn('cached', index.names)
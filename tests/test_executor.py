@@ -0,0 +1,85 @@
+import unittest
+
+from contextlib import redirect_stdout
+from dataclasses import replace
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dotpkg.error import OperationFailedError
+from dotpkg.executor import Executor, chain_operations, dedupe_mkdirs
+from dotpkg.options import Options
+from dotpkg.plan import Operation
+from dotpkg.utils.file import path_digest
+
+import io
+
+class TestExecutor(unittest.TestCase):
+    def test_chains(self):
+        a, b = Path('/home/a'), Path('/home/b')
+        backup = Operation('move', a.with_name('a.backup'), src=a)
+        chains = chain_operations([
+            Operation('link', b, src=Path('/pkg/b')),
+            backup,
+            Operation('link', a, src=Path('/pkg/a')),
+            Operation('touch', a / 'nested'),
+        ])
+        self.assertEqual([[op.kind for op in chain] for chain in chains], [['move', 'link', 'touch'], ['link']])
+
+    def test_dedupe_mkdirs(self):
+        self.assertEqual(dedupe_mkdirs([Path('/a'), Path('/a/b'), Path('/c'), Path('/a/b')]), [Path('/a/b'), Path('/c')])
+
+    def test_parallel_matches_serial(self):
+        with TemporaryDirectory() as raw_dir:
+            dir = Path(raw_dir)
+            src_dir = dir / 'src'
+            src_dir.mkdir()
+            for i in range(50):
+                (src_dir / f'{i}.txt').write_text(f'File {i}')
+
+            outputs = []
+            for workers in [1, 4]:
+                target_dir = dir / f'target-{workers}' / 'nested'
+                executor = Executor(Options(), workers=workers)
+                executor.submit(Operation('mkdir', target_dir))
+                executor.submit(Operation('mkdir', target_dir.parent))
+                for i in range(50):
+                    executor.submit(Operation('copy', target_dir / f'{i}.txt', src=src_dir / f'{i}.txt'))
+                output = io.StringIO()
+                with redirect_stdout(output):
+                    digests = executor.flush()
+                outputs.append(output.getvalue().replace(str(target_dir), '<target>'))
+
+                self.assertEqual(len(digests), 50)
+                for path, digest in digests.items():
+                    self.assertEqual(digest, path_digest(path))
+
+            self.assertEqual(outputs[0], outputs[1])
+
+    def test_dry_run(self):
+        with TemporaryDirectory() as raw_dir:
+            dir = Path(raw_dir)
+            executor = Executor(replace(Options(), dry_run=True))
+            executor.submit(Operation('mkdir', dir / 'a'))
+            executor.submit(Operation('touch', dir / 'a' / 'b'))
+            with redirect_stdout(io.StringIO()):
+                executor.flush()
+            self.assertEqual(list(dir.iterdir()), [])
+
+    def test_failure(self):
+        with TemporaryDirectory() as raw_dir:
+            dir = Path(raw_dir)
+            (dir / 'src.txt').write_text('Source')
+            (dir / 'b').write_text('Existing')
+            link = Operation('link', dir / 'a', src=dir / 'src.txt')
+            executor = Executor(Options(), workers=1)
+            executor.submit(link)
+            executor.submit(Operation('copy', dir / 'b', src=dir / 'src.txt'))
+            executor.submit(Operation('touch', dir / 'c'))
+
+            with redirect_stdout(io.StringIO()), self.assertRaises(OperationFailedError):
+                executor.flush()
+
+            # Serial runs stop at the first failure
+            self.assertEqual(executor.performed, [link])
+            self.assertEqual((dir / 'b').read_text(), 'Existing')
+            self.assertFalse((dir / 'c').exists())
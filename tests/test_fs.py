@@ -0,0 +1,119 @@
+import unittest
+
+from contextlib import redirect_stdout
+from dataclasses import replace
+from pathlib import Path
+
+from dotpkg.install import install, uninstall
+from dotpkg.options import Options
+from dotpkg.state import install_manifest_path, open_state
+from dotpkg.utils.file import path_digest
+from dotpkg.utils.fs import MemoryFileSystem, OSFileSystem, OverlayFileSystem
+
+from tests.fixtures import TEST_PKGS, DotpkgFixture, HomeDirFixture, MemoryHomeDirFixture
+
+import io
+
+class TestFileSystem(unittest.TestCase):
+    def test_memory(self):
+        fs = MemoryFileSystem()
+        fs.write_text(Path('/a/b/c.txt'), 'Hello')
+        fs.symlink(Path('/a/link'), Path('b'))
+
+        self.assertTrue(fs.is_dir(Path('/a/b')))
+        self.assertTrue(fs.is_dir(Path('/a/link')))
+        self.assertEqual(fs.read_text(Path('/a/link/c.txt')), 'Hello')
+        self.assertEqual(sorted(fs.listdir(Path('/a'))), ['b', 'link'])
+
+        fs.move(Path('/a/b'), Path('/d'))
+        self.assertFalse(fs.exists(Path('/a/b/c.txt')))
+        self.assertFalse(fs.exists(Path('/a/link')))
+        self.assertTrue(fs.is_symlink(Path('/a/link')))
+        self.assertEqual(fs.read_text(Path('/d/c.txt')), 'Hello')
+
+        fs.remove(Path('/d'))
+        self.assertEqual(fs.listdir(Path('/')), ['a'])
+
+    def test_overlay_copy(self):
+        pkg = DotpkgFixture('copy')
+        fs = OverlayFileSystem(OSFileSystem())
+        target_path = Path('/nonexistent/dotpkg-test/dir')
+
+        fs.mkdir(target_path.parent)
+        digest = fs.copy(pkg.path / 'dir', target_path)
+
+        self.assertEqual(digest, path_digest(pkg.path / 'dir'))
+        self.assertEqual(digest, fs.digest(target_path))
+        self.assertFalse(target_path.parent.exists())
+        self.assertEqual([kind for kind, _, _ in fs.operations], ['mkdir', 'copy'])
+
+    def test_install_in_memory(self):
+        home = MemoryHomeDirFixture()
+        opts = replace(home.opts, assume_yes=True)
+        pkgs = [home.read_dotpkg('minimal'), home.read_dotpkg('copy')]
+
+        # Packages only exist in memory too
+        home.fs.write_text(TEST_PKGS / 'minimal' / 'virtual.txt', 'Virtual')
+
+        output = io.StringIO()
+        with redirect_stdout(output):
+            for _ in range(10):
+                with open_state(opts) as state:
+                    for pkg in pkgs:
+                        install(pkg, opts, state)
+
+                self.assertEqual(home.fs.readlink(home.path / 'hello.txt'), TEST_PKGS / 'minimal' / 'hello.txt')
+                self.assertTrue(home.fs.is_symlink(home.path / 'virtual.txt'))
+                self.assertEqual(home.fs.read_text(home.path / 'dir' / 'a.txt'), (TEST_PKGS / 'copy' / 'dir' / 'a.txt').read_text())
+                self.assertFalse(home.fs.is_symlink(home.path / 'file.txt'))
+                self.assertEqual(set(home.read_install_manifest().installs.keys()), {str(pkg.path) for pkg in pkgs})
+
+                with open_state(opts) as state:
+                    for pkg in pkgs:
+                        uninstall(pkg, opts, state)
+
+                self.assertEqual(home.fs.listdir(home.path), ['.local'])
+                self.assertEqual(home.read_install_manifest().installs, {})
+
+        self.assertNotIn('cannot be hashed', output.getvalue())
+        self.assertFalse(home.path.exists())
+        self.assertFalse((TEST_PKGS / 'minimal' / 'virtual.txt').exists())
+
+    def test_install_in_overlay(self):
+        pkgs = [DotpkgFixture('minimal'), DotpkgFixture('copy')]
+        fs = OverlayFileSystem(OSFileSystem())
+        home = Path('/nonexistent/dotpkg-test-home')
+        opts = Options(cwd=TEST_PKGS, home=home, fs=fs)
+        fs.mkdir(home)
+
+        with redirect_stdout(io.StringIO()):
+            with open_state(opts) as state:
+                for pkg in pkgs:
+                    install(pkg.dotpkg, opts, state)
+
+            self.assertTrue(fs.is_symlink(home / 'hello.txt'))
+            self.assertTrue(fs.is_file(home / 'dir' / 'a.txt'))
+
+            with open_state(opts) as state:
+                for pkg in pkgs:
+                    uninstall(pkg.dotpkg, opts, state)
+
+            self.assertEqual(fs.listdir(home), ['.local'])
+
+        self.assertFalse(home.exists())
+
+    def test_dry_run(self):
+        pkg = DotpkgFixture('minimal')
+
+        with HomeDirFixture() as home:
+            opts = replace(home.opts, dry_run=True, assume_yes=True)
+            output = io.StringIO()
+
+            with redirect_stdout(output):
+                pkg.install(opts)
+                # Reinstalling should see the (simulated) effects of the first install
+                pkg.install(opts)
+
+            self.assertTrue(home.is_empty)
+            self.assertTrue(opts.fs.is_symlink(home.path / 'hello.txt'))
+            self.assertIn(f"Removing {home.path / 'hello.txt'}", output.getvalue())
@@ -0,0 +1,65 @@
+import unittest
+
+from pathlib import PurePosixPath
+
+from dotpkg.utils.glob import GlobPattern
+
+FILES = [
+    'x1.txt',
+    'a/c.txt',
+    'a/b/c.txt',
+    'a/b/d/c.txt',
+    'a/b/e.pyc',
+    'b/f.pyc',
+    'top.pyc',
+    '.hidden-file',
+    '.hidden-dir/g.txt',
+]
+
+DIRS = {str(parent) for file in FILES for parent in PurePosixPath(file).parents if str(parent) != '.'}
+
+# The expected matches are spelled out (rather than compared against
+# Path.glob), since pathlib's semantics differ between Python versions
+# (e.g. for trailing separators and a trailing '**')
+PATTERNS = {
+    '*': {'.hidden-dir', '.hidden-file', 'a', 'b', 'top.pyc', 'x1.txt'},
+    '*.txt': {'x1.txt'},
+    '**': {'.hidden-dir', 'a', 'a/b', 'a/b/d', 'b'},
+    '**/*.pyc': {'a/b/e.pyc', 'b/f.pyc', 'top.pyc'},
+    'a/**': {'a', 'a/b', 'a/b/d'},
+    'a/**/c.txt': {'a/b/c.txt', 'a/b/d/c.txt', 'a/c.txt'},
+    'a/*/c.txt': {'a/b/c.txt'},
+    '**/b': {'a/b', 'b'},
+    '.hidden*': {'.hidden-dir', '.hidden-file'},
+    'a/b': {'a/b'},
+    'x?.txt': {'x1.txt'},
+    '[ab]': {'a', 'b'},
+    'missing/*': set(),
+    # A trailing separator only matches directories
+    'a/*': {'a/b', 'a/c.txt'},
+    'a/*/': {'a/b'},
+    '**/': {'.hidden-dir', 'a', 'a/b', 'a/b/d', 'b'},
+    '*.pyc/': set(),
+    # Globbing yields unnormalized paths for '..' (e.g. a/../a/c.txt), which
+    # never equal a path in the package
+    '..': set(),
+    '../a': set(),
+    'a/..': set(),
+    'a/../a/c.txt': set(),
+}
+
+class TestGlob(unittest.TestCase):
+    def test_matches(self):
+        paths = set(FILES) | DIRS
+        for raw_pattern, expected in PATTERNS.items():
+            pattern = GlobPattern(raw_pattern)
+            actual = {p for p in paths if pattern.matches(PurePosixPath(p).parts, lambda: p in DIRS)}
+            self.assertEqual(actual, expected, f'Pattern {raw_pattern}')
+
+    def test_lazy_is_dir(self):
+        def is_dir() -> bool:
+            raise AssertionError('is_dir should not be called')
+
+        # Only a trailing '**' or separator needs to know whether the path is a directory
+        self.assertTrue(GlobPattern('a/*.txt').matches(('a', 'c.txt'), is_dir))
+        self.assertFalse(GlobPattern('a/*/').matches(('b', 'c'), is_dir))
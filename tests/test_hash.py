@@ -0,0 +1,65 @@
+import hashlib
+import unittest
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dotpkg.utils.file import MMAP_MIN_SIZE, PREFETCH_MAX_SIZE, SMALL_FILE_SIZE, copy_path, hash_file, hash_inputs, hash_path, path_digest, walk_hash_inputs
+from dotpkg.utils.fs import MemoryFileSystem, OSFileSystem
+
+from tests.fixtures import TEST_PKGS
+
+class TestHash(unittest.TestCase):
+    def assert_matches_reference(self, path: Path, legacy_order: bool=False):
+        expected = hashlib.sha256()
+        hash_path(path, expected, legacy_order=legacy_order)
+
+        for workers in [1, 4]:
+            actual = hashlib.sha256()
+            hash_inputs(walk_hash_inputs(path, legacy_order=legacy_order), actual, workers=workers)
+            self.assertEqual(actual.hexdigest(), expected.hexdigest())
+
+    def test_fixtures(self):
+        for path in [TEST_PKGS / 'copy', TEST_PKGS / 'copy' / 'dir', TEST_PKGS / 'copy' / 'file.txt']:
+            self.assert_matches_reference(path)
+
+    def test_large_tree(self):
+        with TemporaryDirectory() as raw_dir:
+            root = Path(raw_dir) / 'tree'
+            for i in range(100):
+                dir_path = root / f'dir{i % 7}' / f'sub{i % 3}'
+                dir_path.mkdir(parents=True, exist_ok=True)
+                (dir_path / f'file{i}.txt').write_text(f'File {i}\n' * i)
+            # A file that is too large to be prefetched
+            (root / 'large.bin').write_bytes(b'x' * (PREFETCH_MAX_SIZE + 1))
+
+            self.assert_matches_reference(root)
+            self.assert_matches_reference(root, legacy_order=True)
+
+    def test_renamed(self):
+        src_path = TEST_PKGS / 'copy' / 'dir'
+        with TemporaryDirectory() as raw_dir:
+            target_path = Path(raw_dir) / '.renamed'
+            copy_path(src_path, target_path)
+
+            # Directory digests include the name, which we can hash the source under
+            expected = path_digest(target_path)
+            self.assertNotEqual(path_digest(src_path), expected)
+            self.assertEqual(path_digest(src_path, name='.renamed'), expected)
+            self.assertEqual(OSFileSystem().digest(src_path, name='.renamed'), expected)
+
+            fs = MemoryFileSystem()
+            fs.write_text(Path('/dir/a.txt'), (src_path / 'a.txt').read_text())
+            fs.write_text(Path('/dir/b.txt'), (src_path / 'b.txt').read_text())
+            self.assertEqual(fs.digest(Path('/dir'), name='.renamed'), expected)
+
+    def test_file_strategies(self):
+        with TemporaryDirectory() as raw_dir:
+            for size in [0, 1, SMALL_FILE_SIZE, SMALL_FILE_SIZE + 1, MMAP_MIN_SIZE + 17]:
+                path = Path(raw_dir) / f'file{size}'
+                data = bytes(i % 251 for i in range(size))
+                path.write_bytes(data)
+
+                hash = hashlib.sha256()
+                hash_file(path, hash)
+                self.assertEqual(hash.hexdigest(), hashlib.sha256(data).hexdigest())
@@ -0,0 +1,89 @@
+import subprocess
+import sys
+import unittest
+
+from dataclasses import replace
+
+from dotpkg.error import StateLockedError
+from dotpkg.state import lock_state, open_state, state_lock_path
+from dotpkg.utils.fs import MemoryFileSystem
+from dotpkg.utils.lock import fcntl
+
+from tests.fixtures import DotpkgFixture, HomeDirFixture
+
+# Holds a lock on the given file until stdin is closed
+HOLD_LOCK_SCRIPT = '''
+import fcntl, sys
+with open(sys.argv[1], 'a') as f:
+    fcntl.flock(f, fcntl.LOCK_EX if sys.argv[2] == 'exclusive' else fcntl.LOCK_SH)
+    print('locked', flush=True)
+    sys.stdin.read()
+'''
+
+@unittest.skipIf(fcntl is None, 'Advisory locks are not supported on this platform')
+class TestLock(unittest.TestCase):
+    def hold_lock(self, path, mode: str) -> subprocess.Popen:
+        process = subprocess.Popen([sys.executable, '-c', HOLD_LOCK_SCRIPT, str(path), mode], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        self.addCleanup(process.wait)
+        self.addCleanup(process.stdin.close)
+        assert process.stdout
+        self.assertEqual(process.stdout.readline().strip(), 'locked')
+        return process
+
+    def test_exclusive_timeout(self):
+        pkg = DotpkgFixture('minimal')
+
+        with HomeDirFixture() as home:
+            opts = replace(home.opts, lock_timeout=0.1)
+            with lock_state(opts):
+                pass
+            self.hold_lock(state_lock_path(opts), 'exclusive')
+
+            with self.assertRaises(StateLockedError):
+                pkg.install(opts)
+            self.assertFalse((home.path / 'hello.txt').exists())
+
+            with self.assertRaises(StateLockedError):
+                with lock_state(opts, exclusive=False):
+                    pass
+
+    def test_shared(self):
+        with HomeDirFixture() as home:
+            opts = replace(home.opts, lock_timeout=0.1)
+            with lock_state(opts):
+                pass
+            self.hold_lock(state_lock_path(opts), 'shared')
+
+            with open_state(opts, exclusive=False) as state:
+                self.assertFalse(state.lock_stats.contended)
+
+            with self.assertRaises(StateLockedError):
+                with lock_state(opts):
+                    pass
+
+    def test_reentrant(self):
+        pkg = DotpkgFixture('minimal')
+
+        with HomeDirFixture() as home:
+            opts = replace(home.opts, lock_timeout=0.1)
+            with lock_state(opts):
+                with pkg.install_context(opts):
+                    self.assertTrue((home.path / 'hello.txt').is_symlink())
+
+    def test_virtual_file_systems(self):
+        with HomeDirFixture() as home:
+            # Neither dry runs nor in-memory runs touch the real state dir
+            for opts in [replace(home.opts, dry_run=True), replace(home.opts, fs=MemoryFileSystem())]:
+                with open_state(opts):
+                    pass
+                self.assertTrue(home.is_empty)
+
+            # In-memory runs don't share any state with other runs, thus need no lock
+            disk_opts = replace(home.opts, lock_timeout=0.1)
+            with lock_state(disk_opts):
+                pass
+            self.hold_lock(state_lock_path(disk_opts), 'exclusive')
+            opts = replace(disk_opts, fs=MemoryFileSystem())
+            opts.fs.mkdir(opts.state_dir)
+            with lock_state(opts, exclusive=False) as stats:
+                self.assertFalse(stats.contended)
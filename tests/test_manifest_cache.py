@@ -0,0 +1,69 @@
+import json
+import os
+import time
+import unittest
+
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Optional
+
+from dotpkg.model import DotpkgRef, parsed_manifests
+
+class DictCache:
+    def __init__(self):
+        self.entries: dict[str, Any] = {}
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.entries.get(key)
+
+    def put(self, key: str, value: Any):
+        self.entries[key] = value
+
+def write_manifest(pkg_path: Path, manifest: dict[str, Any], mtime: float):
+    manifest_path = pkg_path / 'dotpkg.json'
+    manifest_path.write_text(json.dumps(manifest))
+    # Pretend the manifest was written a while ago (recent ones are never cached)
+    os.utime(manifest_path, (mtime, mtime))
+
+class TestManifestCache(unittest.TestCase):
+    def test_memo(self):
+        with TemporaryDirectory(prefix='dotpkg-test-pkg') as pkg_dir:
+            pkg_path = Path(pkg_dir)
+            ref = DotpkgRef(pkg_path)
+            write_manifest(pkg_path, {'name': 'a'}, time.time() - 60)
+
+            self.assertEqual(ref.read().manifest.name, 'a')
+            # Reads reuse the parsed manifest, but return a copy
+            parsed_manifests[str(ref.manifest_path)][1]['name'] = 'parsed'
+            ref.read().manifest.name = 'changed'
+            self.assertEqual(ref.read().manifest.name, 'parsed')
+
+            write_manifest(pkg_path, {'name': 'b'}, time.time() - 30)
+            self.assertEqual(ref.read().manifest.name, 'b')
+
+            # Recently modified manifests are always read again
+            write_manifest(pkg_path, {'name': 'c'}, time.time())
+            self.assertEqual(ref.read().manifest.name, 'c')
+            self.assertEqual(ref.read().manifest.name, 'c')
+
+    def test_persistent_cache(self):
+        with TemporaryDirectory(prefix='dotpkg-test-pkg') as pkg_dir:
+            pkg_path = Path(pkg_dir)
+            ref = DotpkgRef(pkg_path)
+            cache = DictCache()
+            write_manifest(pkg_path, {'name': 'a', 'copy': True}, time.time() - 60)
+
+            self.assertTrue(ref.read(cache).manifest.copy)
+            manifest_key = str(ref.manifest_path)
+            self.assertEqual(cache.entries[manifest_key][1], {'name': 'a', 'copy': True})
+
+            # A fresh process would read the (unchanged) manifest from the cache
+            del parsed_manifests[manifest_key]
+            cache.entries[manifest_key][1]['name'] = 'cached'
+            self.assertEqual(ref.read(cache).manifest.name, 'cached')
+
+            # Changes invalidate the cache
+            del parsed_manifests[manifest_key]
+            write_manifest(pkg_path, {'name': 'b'}, time.time() - 30)
+            self.assertEqual(ref.read(cache).manifest.name, 'b')
+            self.assertEqual(cache.entries[manifest_key][1], {'name': 'b'})
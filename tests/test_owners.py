@@ -0,0 +1,95 @@
+import json
+import unittest
+
+from dataclasses import replace
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dotpkg.install import install, uninstall
+from dotpkg.model import DotpkgRef
+from dotpkg.plan import plan_install
+from dotpkg.state import State, open_state, owner_index_path, read_owner_index
+
+from tests.fixtures import DotpkgFixture, HomeDirFixture
+
+class TestOwners(unittest.TestCase):
+    def test_owners(self):
+        minimal, copy = DotpkgFixture('minimal'), DotpkgFixture('copy')
+
+        with HomeDirFixture() as home:
+            with open_state(home.opts) as state:
+                install(minimal.dotpkg, home.opts, state)
+                self.assertEqual(state.owner(home.path / 'hello.txt'), (str(minimal.path), 0))
+                install(copy.dotpkg, home.opts, state)
+
+            # The index is persisted along with the manifest and reused by the next run
+            self.assertIsNotNone(read_owner_index(home.opts))
+            state = State(home.opts)
+            self.assertEqual(state.owner(home.path / 'file.txt'), (str(copy.path), 1))
+            # Paths inside installed directories are owned too
+            self.assertEqual(state.owner(home.path / 'dir' / 'a.txt'), (str(copy.path), 0))
+            self.assertIsNone(state.owner(home.path / 'unrelated.txt'))
+
+            with open_state(home.opts) as state:
+                uninstall(minimal.dotpkg, home.opts, state)
+                self.assertIsNone(state.owner(home.path / 'hello.txt'))
+                self.assertEqual(state.owner(home.path / 'file.txt'), (str(copy.path), 1))
+
+            self.assertIsNone(State(home.opts).owner(home.path / 'hello.txt'))
+            copy.uninstall(home.opts)
+
+    def test_stale_index(self):
+        pkg = DotpkgFixture('minimal')
+
+        with HomeDirFixture() as home:
+            with open_state(home.opts) as state:
+                state.owner(home.path)
+                install(pkg.dotpkg, home.opts, state)
+            stale_index = owner_index_path(home.opts).read_text()
+
+            # E.g. if another tool rewrote the manifest
+            pkg.uninstall(home.opts)
+            owner_index_path(home.opts).write_text(stale_index)
+
+            self.assertIsNone(read_owner_index(home.opts))
+            self.assertIsNone(State(home.opts).owner(home.path / 'hello.txt'))
+
+    def test_incremental_update(self):
+        minimal, copy = DotpkgFixture('minimal'), DotpkgFixture('copy')
+
+        with HomeDirFixture() as home:
+            # Installing with lookups (e.g. for conflicts) persists the index
+            with open_state(home.opts) as state:
+                state.owner(home.path)
+                install(copy.dotpkg, home.opts, state)
+            self.assertIsNotNone(read_owner_index(home.opts))
+
+            # Runs that don't look up owners still keep it up to date
+            minimal.install(home.opts)
+            index = read_owner_index(home.opts)
+            assert index
+            self.assertEqual(index.owner(home.path / 'hello.txt'), (str(minimal.path), 0))
+
+            minimal.uninstall(home.opts)
+            index = read_owner_index(home.opts)
+            assert index
+            self.assertIsNone(index.owner(home.path / 'hello.txt'))
+            self.assertEqual(index.owner(home.path / 'file.txt'), (str(copy.path), 1))
+
+            copy.uninstall(home.opts)
+
+    def test_conflict(self):
+        pkg = DotpkgFixture('minimal')
+
+        with HomeDirFixture() as home, TemporaryDirectory(prefix='dotpkg-test-other') as other_dir:
+            other_path = Path(other_dir).resolve()
+            (other_path / 'dotpkg.json').write_text(json.dumps({'name': 'other'}))
+            (other_path / 'hello.txt').write_text('Other')
+            other = DotpkgRef(other_path).read()
+            opts = replace(home.opts, assume_yes=True)
+
+            with pkg.install_context(opts):
+                # Files of other packages are skipped by default
+                plan = plan_install(other, opts, State(opts))
+                self.assertEqual(plan.paths, [])
+                self.assertEqual([op.kind for op in plan.operations], ['mkdir'])
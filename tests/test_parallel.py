@@ -0,0 +1,40 @@
+import unittest
+
+from dataclasses import replace
+
+from dotpkg.commands import install_cmd, uninstall_cmd
+from dotpkg.parallel import independent_groups
+from dotpkg.state import open_state
+
+from tests.fixtures import DotpkgFixture, HomeDirFixture
+
+class TestParallel(unittest.TestCase):
+    def test_independent_groups(self):
+        pkgs = [DotpkgFixture(name) for name in ['minimal', 'copy', 'target-dir-basic', 'minimal']]
+
+        with HomeDirFixture() as home:
+            with open_state(home.opts) as state:
+                groups = independent_groups([pkg.dotpkg for pkg in pkgs], home.opts, state)
+
+        # Both 'minimal's claim the same link and thus end up in one group
+        self.assertEqual([[pkg.path for pkg in group] for group in groups], [
+            [pkgs[0].path, pkgs[3].path],
+            [pkgs[1].path],
+            [pkgs[2].path],
+        ])
+
+    def test_parallel_install(self):
+        pkgs = [DotpkgFixture(name) for name in ['minimal', 'copy', 'target-dir-basic']]
+        raw_paths = [str(pkg.path) for pkg in pkgs]
+
+        with HomeDirFixture() as home:
+            opts = replace(home.opts, jobs=4, assume_yes=True)
+
+            install_cmd(raw_paths, opts)
+            self.assertTrue((home.path / 'hello.txt').is_symlink())
+            self.assertTrue((home.path / 'file.txt').is_file())
+            self.assertTrue((home.path / '.config' / 'someapp' / 'someconfig.json').is_symlink())
+            self.assertEqual(set(home.read_install_manifest().installs.keys()), set(raw_paths))
+
+            uninstall_cmd(raw_paths, opts)
+            self.assertEqual(home.read_install_manifest().installs, {})
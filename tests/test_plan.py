@@ -0,0 +1,66 @@
+import io
+import json
+import unittest
+
+from contextlib import redirect_stdout
+
+from dotpkg.error import OperationFailedError
+from dotpkg.install import apply_package_plan
+from dotpkg.plan import Plan, plan_packages
+from dotpkg.state import State, open_state
+
+from tests.fixtures import DotpkgFixture, HomeDirFixture
+
+class TestPlan(unittest.TestCase):
+    def test_plan_apply(self):
+        pkgs = [DotpkgFixture('minimal'), DotpkgFixture('copy')]
+
+        with HomeDirFixture() as home:
+            plan = plan_packages([pkg.dotpkg for pkg in pkgs], home.opts, State(home.opts))
+            # Planning should not touch the file system
+            self.assertTrue(home.is_empty)
+
+            plan = Plan.from_dict(json.loads(json.dumps(plan.to_dict())))
+
+            with open_state(home.opts) as state:
+                for pkg_plan in plan.packages:
+                    apply_package_plan(pkg_plan, home.opts, state)
+
+            self.assertTrue((home.path / 'hello.txt').is_symlink())
+            self.assertEqual(set(home.read_install_manifest().installs.keys()), {str(pkg.path) for pkg in pkgs})
+
+            for pkg in pkgs:
+                pkg.uninstall(home.opts)
+
+            self.assertEqual(home.read_install_manifest().installs, {})
+
+    def test_apply_stale_plan(self):
+        link_pkg, copy_pkg = DotpkgFixture('minimal'), DotpkgFixture('copy')
+
+        with HomeDirFixture() as home, redirect_stdout(io.StringIO()):
+            plan = plan_packages([link_pkg.dotpkg, copy_pkg.dotpkg], home.opts, State(home.opts))
+            link_plan, copy_plan = plan.packages
+
+            # Applying a plan again only creates what is missing
+            for _ in range(2):
+                with open_state(home.opts) as state:
+                    apply_package_plan(link_plan, home.opts, state)
+            self.assertTrue((home.path / 'hello.txt').is_symlink())
+
+            # A file created since planning should fail the copy (without
+            # overwriting it), but what was applied before is still recorded
+            (home.path / 'file.txt').write_text('Not ours')
+            with self.assertRaises(OperationFailedError) as context:
+                with open_state(home.opts) as state:
+                    apply_package_plan(copy_plan, home.opts, state)
+            self.assertIn(str(home.path / 'file.txt'), str(context.exception))
+            self.assertEqual((home.path / 'file.txt').read_text(), 'Not ours')
+            self.assertTrue((home.path / 'dir' / 'a.txt').is_file())
+
+            installs = home.read_install_manifest().installs
+            self.assertEqual(installs[str(copy_pkg.path)].paths, [str(home.path / 'dir')])
+
+            copy_pkg.uninstall(home.opts)
+            link_pkg.uninstall(home.opts)
+            self.assertFalse((home.path / 'dir').exists())
+            self.assertEqual(home.read_install_manifest().installs, {})
@@ -0,0 +1,68 @@
+import json
+import unittest
+
+from contextlib import redirect_stderr, redirect_stdout
+from dataclasses import replace
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dotpkg.utils.profiler import profiling, span
+from tests.fixtures import TEST_ROOT, DotpkgFixture, HomeDirFixture
+
+class TestProfiler(unittest.TestCase):
+    def test_install_profile(self):
+        pkg = DotpkgFixture('copy')
+
+        with HomeDirFixture() as home, TemporaryDirectory() as raw_dir:
+            opts = replace(home.opts, update_install_manifest=True)
+            trace_path = Path(raw_dir) / 'trace.json'
+
+            with redirect_stdout(StringIO()) as output, redirect_stderr(StringIO()) as profile_output:
+                with profiling(True, trace_path) as profiler:
+                    with pkg.install_context(opts):
+                        pass
+
+            assert profiler
+            summary = profiler.summary()
+            for phase in ['install', 'uninstall', 'plan', 'execute', 'find_link_candidates', 'path_digest']:
+                self.assertIn(('copy', phase), summary)
+            self.assertIn(('-', 'read_install_manifest'), summary)
+
+            # Nested spans are excluded from the self time
+            calls, total, self_total = summary[('copy', 'install')]
+            self.assertEqual(calls, 1)
+            self.assertLess(self_total, total)
+            # The profile must not mix with the command's (possibly JSON) output
+            self.assertIn('find_link_candidates', profile_output.getvalue())
+            self.assertNotIn('Profile', output.getvalue())
+
+            events = json.loads(trace_path.read_text())['traceEvents']
+            self.assertEqual(len(events), len(profiler.spans))
+            self.assertTrue(all(e['ph'] == 'X' and e['dur'] >= 0 for e in events))
+            self.assertIn({'package': 'copy'}, [e['args'] for e in events if e['cat'] == 'install'])
+
+    def test_package_paths(self):
+        pkg = DotpkgFixture('copy')
+
+        # Packages are labeled by their path relative to the cwd, since
+        # names may repeat across groups
+        with HomeDirFixture() as home:
+            opts = replace(home.opts, cwd=TEST_ROOT)
+
+            with redirect_stdout(StringIO()), redirect_stderr(StringIO()):
+                with profiling(True) as profiler:
+                    with pkg.install_context(opts):
+                        pass
+
+            assert profiler
+            summary = profiler.summary()
+            for phase in ['install', 'uninstall', 'execute', 'record']:
+                self.assertIn(('pkgs/copy', phase), summary)
+            self.assertNotIn(('copy', 'install'), summary)
+
+    def test_disabled(self):
+        with profiling(False) as profiler:
+            with span('install', package='copy'):
+                pass
+        self.assertIsNone(profiler)
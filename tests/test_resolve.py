@@ -0,0 +1,75 @@
+import platform
+import socket
+import stat
+import unittest
+
+from pathlib import Path
+
+from dotpkg.resolve import find_link_candidates, package_renamer, resolve_manifest_str
+
+from dotpkg.utils.fs import OSFileSystem, OverlayFileSystem
+
+from tests.fixtures import DotpkgFixture, HomeDirFixture
+
+class TestResolve(unittest.TestCase):
+    def test_link_candidates(self):
+        pkg = DotpkgFixture('copy')
+
+        with HomeDirFixture() as home:
+            candidates = list(find_link_candidates(pkg.path, home.path, home.opts.fs))
+            self.assertEqual([(c.src_path, c.target_path) for c in candidates], [
+                (pkg.path / 'dir', home.path / 'dir'),
+                (pkg.path / 'file.txt', home.path / 'file.txt'),
+            ])
+            self.assertFalse(any(c.target_exists for c in candidates))
+
+            # Existing target dirs are descended into
+            (home.path / 'dir').mkdir()
+            (home.path / 'dir' / 'a.txt').symlink_to(pkg.path / 'dir' / 'a.txt')
+            candidates = list(find_link_candidates(pkg.path, home.path, home.opts.fs))
+            self.assertEqual([(c.src_path, c.target_path) for c in candidates], [
+                (pkg.path / 'dir' / 'a.txt', home.path / 'dir' / 'a.txt'),
+                (pkg.path / 'dir' / 'b.txt', home.path / 'dir' / 'b.txt'),
+                (pkg.path / 'file.txt', home.path / 'file.txt'),
+            ])
+            self.assertEqual([c.target_links_to_src(home.opts.fs) for c in candidates], [True, False, False])
+
+    def test_link_candidate_sources(self):
+        pkg = DotpkgFixture('copy')
+        fs = OverlayFileSystem(OSFileSystem())
+        target_dir = Path('/nonexistent/dotpkg-test-home')
+
+        # Sources are listed through the file system (e.g. seeing simulated changes)
+        fs.write_text(pkg.path / 'new.txt', 'New')
+        fs.remove(pkg.path / 'file.txt')
+
+        candidates = find_link_candidates(pkg.path, target_dir, fs)
+        self.assertEqual([(c.src_path, c.target_path) for c in candidates], [
+            (pkg.path / 'dir', target_dir / 'dir'),
+            (pkg.path / 'new.txt', target_dir / 'new.txt'),
+        ])
+        self.assertEqual([c.src_dest for c in candidates], [pkg.path / 'dir', pkg.path / 'new.txt'])
+        self.assertEqual([stat.S_ISDIR(c.src_stat.st_mode) for c in candidates if c.src_stat], [True, False])
+        self.assertTrue((pkg.path / 'file.txt').exists())
+
+    def test_renamer(self):
+        pkg = DotpkgFixture('minimal').dotpkg
+        pkg.manifest.renames = {
+            'hello': 'bye',
+            'bye.txt': 'farewell.txt',
+            'same': 'same',
+            '${hostname}': 'host',
+        }
+
+        with HomeDirFixture() as home:
+            renamer = package_renamer(pkg, home.opts)
+            self.assertEqual(renamer('hello.txt'), 'farewell.txt')
+            self.assertEqual(renamer('hello.md'), 'bye.md')
+            self.assertEqual(renamer('unrelated'), 'unrelated')
+            self.assertEqual(renamer(f'config.{socket.gethostname()}'), 'config.host')
+
+    def test_manifest_vars(self):
+        with HomeDirFixture() as home:
+            self.assertEqual(resolve_manifest_str('${home}/.config', home.opts), f'{home.path}/.config')
+            self.assertEqual(resolve_manifest_str('${hostname}-${platform}', home.opts), f'{socket.gethostname()}-{platform.system().lower()}')
+            self.assertEqual(resolve_manifest_str('${unknown}/$home', home.opts), '${unknown}/$home')
@@ -0,0 +1,98 @@
+import io
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+from contextlib import redirect_stdout
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dotpkg.error import ScriptTimeoutError
+from dotpkg.options import Options
+from dotpkg.scripts import ScriptTimes, run_script_command
+from dotpkg.utils.log import buffered_output, thread_local_output
+
+from tests.fixtures import TEST_ROOT
+
+class TestScripts(unittest.TestCase):
+    def test_prefixed_output(self):
+        with TemporaryDirectory(prefix='dotpkg-test-repo') as repo_dir:
+            repo = Path(repo_dir)
+            opts = Options(cwd=repo)
+            times = ScriptTimes()
+            output = io.StringIO()
+
+            # Packages are labeled by their path, since names may repeat across groups
+            for group in ['linux', 'macos']:
+                (repo / group / 'git').mkdir(parents=True)
+
+            # Output is captured if buffered, like in parallel runs
+            with redirect_stdout(output), thread_local_output(), buffered_output():
+                run_script_command('install', 'echo one; echo two >&2', repo / 'linux' / 'git', opts, times)
+                run_script_command('install', 'echo three', repo / 'macos' / 'git', opts, times)
+
+            self.assertIn('[linux/git:install] one\n[linux/git:install] two\n', output.getvalue())
+            self.assertIn('[macos/git:install] three\n', output.getvalue())
+            self.assertEqual([(t.package, t.name, t.outcome) for t in times.times], [('linux/git', 'install', 'ok'), ('macos/git', 'install', 'ok')])
+
+            cwd = repo / 'linux' / 'git'
+
+            with redirect_stdout(io.StringIO()), self.assertRaises(subprocess.CalledProcessError):
+                run_script_command('postinstall', 'exit 3', cwd, opts, times)
+            self.assertEqual(times.times[-1].outcome, 'failed')
+
+    @unittest.skipIf(os.name != 'posix', 'requires a pty')
+    def test_serial_terminal(self):
+        # Serially run scripts inherit our terminal, e.g. to prompt for passwords
+        program = '\n'.join([
+            'from pathlib import Path',
+            'from dotpkg.options import Options',
+            'from dotpkg.scripts import run_script_command',
+            "run_script_command('install', 'test -t 0 && test -t 1 && read line && echo \"got $line\"', Path.cwd(), Options())",
+        ])
+        primary, secondary = os.openpty()
+        try:
+            process = subprocess.Popen([sys.executable, '-c', program], cwd=TEST_ROOT.parent, stdin=secondary, stdout=secondary, stderr=secondary)
+            os.close(secondary)
+            os.write(primary, b'input\n')
+            output = b''
+            while True:
+                try:
+                    chunk = os.read(primary, 1024)
+                except OSError:
+                    # The pty is closed once the child exits (EIO on Linux)
+                    break
+                if not chunk:
+                    break
+                output += chunk
+            self.assertEqual(process.wait(timeout=10), 0, output)
+        finally:
+            os.close(primary)
+
+        lines = output.decode().splitlines()
+        self.assertIn('got input', lines)
+
+    def test_timeout(self):
+        with TemporaryDirectory(prefix='dotpkg-test-pkg') as pkg_dir:
+            times = ScriptTimes()
+            start = time.perf_counter()
+
+            with redirect_stdout(io.StringIO()), self.assertRaises(ScriptTimeoutError):
+                run_script_command('install', 'sleep 10', Path(pkg_dir), Options(script_timeout=0.2), times)
+
+            self.assertLess(time.perf_counter() - start, 5)
+            self.assertEqual(times.times[-1].outcome, 'timeout')
+
+    def test_captured_timeout(self):
+        with TemporaryDirectory(prefix='dotpkg-test-pkg') as pkg_dir:
+            times = ScriptTimes()
+            start = time.perf_counter()
+
+            with redirect_stdout(io.StringIO()), thread_local_output(), buffered_output(), self.assertRaises(ScriptTimeoutError):
+                # The background process keeps the output open, so it has to be killed too
+                run_script_command('install', 'sleep 10 & sleep 10', Path(pkg_dir), Options(script_timeout=0.2), times)
+
+            self.assertLess(time.perf_counter() - start, 5)
+            self.assertEqual(times.times[-1].outcome, 'timeout')
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+import unittest
+
+from tests.fixtures import TEST_ROOT
+
+# Budgets for the cumulative import time (in microseconds), leaving about
+# twice the typical time (including -X importtime's overhead) as headroom,
+# since these tests run on all kinds of machines.
+IMPORT_TIME_BUDGETS = {
+    'dotpkg': 100_000,
+    'dotpkg.queries': 200_000,
+}
+
+# Modules that read-only commands should never load (thread pools are only
+# imported when there is enough work to parallelize)
+INSTALL_MODULES = {'dotpkg.commands', 'dotpkg.install', 'dotpkg.plan', 'dotpkg.executor', 'dotpkg.scripts', 'subprocess', 'concurrent.futures'}
+
+def import_times(module: str) -> dict[str, int]:
+    '''Imports the module in a fresh interpreter and returns the cumulative import times of all modules loaded.'''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=TEST_ROOT.parent, stderr=subprocess.PIPE, text=True, check=True)
+    times: dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        parts = line.removeprefix('import time:').split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            times[parts[2].strip()] = int(parts[1])
+    return times
+
+class TestStartup(unittest.TestCase):
+    def test_cli_imports(self):
+        times = import_times('dotpkg')
+        # Commands (and thus the options) are only imported once invoked
+        self.assertFalse({'dotpkg.options', 'dotpkg.state', 'hashlib'} & times.keys())
+        self.assertLess(times['dotpkg'], IMPORT_TIME_BUDGETS['dotpkg'])
+
+    def test_query_imports(self):
+        times = import_times('dotpkg.queries')
+        self.assertFalse(INSTALL_MODULES & times.keys())
+        self.assertLess(times['dotpkg.queries'], IMPORT_TIME_BUDGETS['dotpkg.queries'])
@@ -0,0 +1,72 @@
+import io
+import unittest
+
+from contextlib import redirect_stdout
+
+from dotpkg.install import install, uninstall
+from dotpkg.state import State, install_journal_path, install_manifest_path, open_state
+
+from tests.fixtures import DotpkgFixture, HomeDirFixture
+
+class TestState(unittest.TestCase):
+    def test_batch_commit(self):
+        pkgs = [DotpkgFixture('minimal'), DotpkgFixture('copy')]
+
+        with HomeDirFixture() as home:
+            with open_state(home.opts) as state:
+                for pkg in pkgs:
+                    install(pkg.dotpkg, home.opts, state)
+                # The manifest should only be written once at the end
+                self.assertFalse(install_manifest_path(home.opts).exists())
+
+            self.assertEqual(set(home.read_install_manifest().installs.keys()), {str(pkg.path) for pkg in pkgs})
+
+            with open_state(home.opts) as state:
+                for pkg in pkgs:
+                    uninstall(pkg.dotpkg, home.opts, state)
+
+            self.assertEqual(home.read_install_manifest().installs, {})
+
+    def test_flush_on_failure(self):
+        pkg = DotpkgFixture('minimal')
+
+        with HomeDirFixture() as home:
+            with self.assertRaises(RuntimeError):
+                with open_state(home.opts) as state:
+                    install(pkg.dotpkg, home.opts, state)
+                    raise RuntimeError('Simulated failure')
+
+            self.assertIn(str(pkg.path), home.read_install_manifest().installs)
+            pkg.uninstall(home.opts)
+
+    def test_journal_recovery(self):
+        pkgs = [DotpkgFixture('minimal'), DotpkgFixture('copy')]
+
+        with HomeDirFixture() as home:
+            # Simulate a run that is killed before committing
+            state = State(home.opts)
+            for pkg in pkgs:
+                install(pkg.dotpkg, home.opts, state)
+            self.assertFalse(install_manifest_path(home.opts).exists())
+
+            # A truncated record (e.g. from being killed while appending) is skipped
+            with open(install_journal_path(home.opts), 'a') as f:
+                f.write('{"version":5,"key":')
+
+            # Read-only runs see the changes, but leave the recovery to the next committing run
+            with redirect_stdout(io.StringIO()) as output:
+                with open_state(home.opts, exclusive=False) as state:
+                    self.assertEqual(set(state.installs.keys()), {str(pkg.path) for pkg in pkgs})
+                self.assertEqual(set(State(home.opts, read_only=True).installs.keys()), {str(pkg.path) for pkg in pkgs})
+            self.assertNotIn('Recovered', output.getvalue())
+            self.assertTrue(install_journal_path(home.opts).exists())
+            self.assertFalse(install_manifest_path(home.opts).exists())
+
+            with open_state(home.opts) as state:
+                self.assertEqual(set(state.installs.keys()), {str(pkg.path) for pkg in pkgs})
+
+            self.assertFalse(install_journal_path(home.opts).exists())
+            self.assertEqual(set(home.read_install_manifest().installs.keys()), {str(pkg.path) for pkg in pkgs})
+
+            for pkg in pkgs:
+                pkg.uninstall(home.opts)
@@ -0,0 +1,57 @@
+import shutil
+import unittest
+
+from dotpkg.state import State, open_state
+from dotpkg.status import check_status
+
+from tests.fixtures import DotpkgFixture, HomeDirFixture
+
+class TestStatus(unittest.TestCase):
+    def kinds(self, home: HomeDirFixture) -> dict[str, str]:
+        report = check_status(None, home.opts, State(home.opts))
+        return {str(f.path.relative_to(home.path)): f.kind for f in report.files}
+
+    def test_status(self):
+        minimal, copy = DotpkgFixture('minimal'), DotpkgFixture('copy')
+
+        with HomeDirFixture() as home:
+            for pkg in [minimal, copy]:
+                pkg.install(home.opts)
+
+            self.assertEqual(self.kinds(home), {
+                'hello.txt': 'ok',
+                'dir': 'ok',
+                'file.txt': 'ok',
+            })
+
+            (home.path / 'hello.txt').unlink()
+            (home.path / 'hello.txt').write_text('Not a link')
+            (home.path / 'dir' / 'a.txt').write_text('Changed')
+            (home.path / 'file.txt').unlink()
+
+            self.assertEqual(self.kinds(home), {
+                'hello.txt': 'foreign',
+                'dir': 'modified',
+                'file.txt': 'missing',
+            })
+
+            # Remove the drifted files (which uninstall skips)
+            (home.path / 'hello.txt').unlink()
+            shutil.rmtree(home.path / 'dir')
+            for pkg in [minimal, copy]:
+                pkg.uninstall(home.opts)
+
+    def test_orphaned(self):
+        pkg = DotpkgFixture('minimal')
+
+        with HomeDirFixture() as home:
+            with pkg.install_context(home.opts):
+                with open_state(home.opts) as state:
+                    entry = state.installs[str(pkg.path)]
+                    state.set_install('/nonexistent/package', entry)
+
+                report = check_status(['/nonexistent/package'], home.opts, State(home.opts))
+                self.assertEqual([f.kind for f in report.files], ['orphaned'])
+
+                with open_state(home.opts) as state:
+                    state.remove_install('/nonexistent/package')
@@ -0,0 +1,111 @@
+import io
+import json
+import unittest
+
+from contextlib import redirect_stdout
+from dataclasses import replace
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from dotpkg.commands import sync_cmd, uninstall_cmd
+
+from tests.fixtures import HomeDirFixture
+
+class TestSync(unittest.TestCase):
+    def test_incremental_sync(self):
+        with TemporaryDirectory() as raw_pkg, HomeDirFixture() as home:
+            pkg_path = Path(raw_pkg).resolve()
+            (pkg_path / 'dotpkg.json').write_text(json.dumps({'name': 'sync-test'}))
+            (pkg_path / 'a.txt').write_text('a')
+            (pkg_path / 'b.txt').write_text('b')
+
+            opts = replace(home.opts, assume_yes=True)
+            raw_paths = [str(pkg_path)]
+
+            def link_inode(name: str) -> int:
+                return (home.path / name).lstat().st_ino
+
+            sync_cmd(raw_paths, opts)
+            self.assertTrue((home.path / 'a.txt').is_symlink())
+            a_inode = link_inode('a.txt')
+
+            # A no-op sync should not touch anything
+            sync_cmd(raw_paths, opts)
+            self.assertEqual(link_inode('a.txt'), a_inode)
+
+            # Adding and removing files should only affect those
+            (pkg_path / 'b.txt').unlink()
+            (pkg_path / 'c.txt').write_text('c')
+            sync_cmd(raw_paths, opts)
+            self.assertEqual(link_inode('a.txt'), a_inode)
+            self.assertFalse((home.path / 'b.txt').is_symlink())
+            self.assertTrue((home.path / 'c.txt').is_symlink())
+            self.assertEqual(home.read_install_manifest().installs[str(pkg_path)].paths, [
+                str(home.path / 'a.txt'),
+                str(home.path / 'c.txt'),
+            ])
+
+            # Changing the manifest should resync the package
+            (pkg_path / 'dotpkg.json').write_text(json.dumps({'name': 'sync-test', 'ignoredFiles': ['c.txt']}))
+            sync_cmd(raw_paths, opts)
+            self.assertEqual(link_inode('a.txt'), a_inode)
+            self.assertFalse((home.path / 'c.txt').is_symlink())
+
+            uninstall_cmd(raw_paths, opts)
+            self.assertEqual(home.read_install_manifest().installs, {})
+
+    def test_incremental_copy_sync(self):
+        with TemporaryDirectory() as raw_pkg, HomeDirFixture() as home:
+            pkg_path = Path(raw_pkg).resolve()
+            (pkg_path / 'dotpkg.json').write_text(json.dumps({'name': 'sync-copy-test', 'copy': True}))
+            (pkg_path / 'dir').mkdir()
+            (pkg_path / 'dir' / 'a.txt').write_text('a')
+            (pkg_path / 'file.txt').write_text('file')
+
+            opts = replace(home.opts, assume_yes=True)
+            raw_paths = [str(pkg_path)]
+
+            def inode(name: str) -> int:
+                return (home.path / name).lstat().st_ino
+
+            sync_cmd(raw_paths, opts)
+            self.assertTrue((home.path / 'dir').is_dir())
+            self.assertFalse((home.path / 'dir').is_symlink())
+            dir_inode = inode('dir')
+            file_inode = inode('file.txt')
+
+            # A no-op sync should not recopy the directory
+            sync_cmd(raw_paths, opts)
+            self.assertEqual(inode('dir'), dir_inode)
+            self.assertEqual(inode('file.txt'), file_inode)
+
+            # Changing a file in the directory should only recopy that
+            (pkg_path / 'dir' / 'a.txt').write_text('changed')
+            sync_cmd(raw_paths, opts)
+            self.assertEqual((home.path / 'dir' / 'a.txt').read_text(), 'changed')
+            self.assertEqual(inode('file.txt'), file_inode)
+            self.assertEqual(home.read_install_manifest().installs[str(pkg_path)].paths, [
+                str(home.path / 'dir'),
+                str(home.path / 'file.txt'),
+            ])
+
+    def test_renamed_copy_sync(self):
+        with TemporaryDirectory() as raw_pkg, HomeDirFixture() as home:
+            pkg_path = Path(raw_pkg).resolve()
+            (pkg_path / 'dotpkg.json').write_text(json.dumps({'name': 'sync-rename-test', 'copy': True, 'renames': {'conf': '.conf'}}))
+            (pkg_path / 'conf').mkdir()
+            (pkg_path / 'conf' / 'a.txt').write_text('a')
+
+            opts = replace(home.opts, assume_yes=True)
+            raw_paths = [str(pkg_path)]
+
+            sync_cmd(raw_paths, opts)
+            self.assertEqual((home.path / '.conf' / 'a.txt').read_text(), 'a')
+
+            # The directory digest depends on its name, hence the source has
+            # to be compared under the target's name
+            output = io.StringIO()
+            with redirect_stdout(output):
+                sync_cmd(raw_paths, opts)
+            self.assertIn('up to date', output.getvalue())
+            self.assertNotIn('Uninstalling', output.getvalue())